@@ -0,0 +1,176 @@
+"""
+Comparação A/B do modelo treinado (com o adaptador LoRA) com o modelo
+base, para uma lista inteira de livros.
+
+compare.py compara um livro fixo e só imprime as duas respostas. Aqui
+os livros de um CSV ou JSONL (como no batch_inference.py) passam pelos
+dois braços, com o modelo carregado uma vez:
+
+- cada prompt é tokenizado uma vez só e serve aos dois braços;
+- os lotes são formados como no batch_inference.py (ordenados pelo
+  tamanho do prompt) e cada lote gera os dois braços num único generate
+  (SINGLE_PASS): as linhas do modelo base têm o LoRA desligado só para
+  elas, o padding é o mesmo e o cache KV do bloco fixo de instruções de
+  cada braço é calculado uma vez para todos os lotes;
+- o resultado vai para um relatório JSON: as duas respostas de cada
+  livro, o tempo e os tokens de cada lote e um resumo.
+
+Com SINGLE_PASS=False os braços são gerados um depois do outro, para
+medir o ganho da passada única no mesmo relatório.
+
+Uso: python ab_compare.py livros.csv|livros.jsonl relatorio.json
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+import torch
+from tqdm import tqdm
+
+from batch_inference import (
+    ADAPTER_PATH,
+    BATCH_SIZE,
+    BUCKET_WINDOW,
+    MODEL_NAME,
+    SEED,
+    CatalogEngine,
+    length_buckets,
+    load_model,
+    read_books,
+    resolve_device,
+)
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Os dois braços no mesmo generate. Com False, um depois do outro.
+SINGLE_PASS = os.getenv("SINGLE_PASS", "1") != "0"
+
+# Cada livro ocupa duas linhas do lote (com e sem o adaptador).
+BOOKS_PER_BATCH = max(1, BATCH_SIZE // 2)
+
+# Geração determinística: as diferenças entre os braços vêm do adaptador.
+GENERATION_CONFIG = {"do_sample": False}
+
+
+# ============================================================
+# COMPARAÇÃO
+# ============================================================
+
+def compare_books(books, engine, books_per_batch=BOOKS_PER_BATCH, window=BUCKET_WINDOW, single_pass=SINGLE_PASS):
+    """
+    Gera os dois braços para (id, campos) de cada livro. Retorna
+    (resultados por livro, medidas por lote).
+    """
+
+    books = iter(books)
+    resultados = []
+    lotes = []
+
+    with tqdm(desc="Comparando", unit=" livro") as pbar:
+        while True:
+            janela = list(islice(books, books_per_batch * window))
+
+            if not janela:
+                break
+
+            # Uma tokenização por livro, para os dois braços.
+            ids = engine.encode([engine.prompt(fields) for _, fields in janela])
+
+            for lote in length_buckets([len(x) for x in ids], books_per_batch):
+                tokens_antes = engine.generated_tokens
+                inicio = time.perf_counter()
+
+                com, sem = engine.generate_ab([ids[i] for i in lote], single_pass)
+
+                segundos = time.perf_counter() - inicio
+                tokens = engine.generated_tokens - tokens_antes
+
+                lotes.append({
+                    "books": len(lote),
+                    "prompt_tokens": sum(len(ids[i]) for i in lote),
+                    "generated_tokens": tokens,
+                    "seconds": round(segundos, 3),
+                })
+
+                for i, adaptada, base in zip(lote, com, sem):
+                    livro_id, fields = janela[i]
+                    resultados.append({
+                        "id": livro_id,
+                        **fields,
+                        "adapter": adaptada,
+                        "base": base,
+                        "identical": adaptada == base,
+                    })
+
+                pbar.update(len(lote))
+
+    return resultados, lotes
+
+
+def summarize(resultados, lotes, engine):
+    """Resumo do relatório: tempo, vazão e quantas respostas coincidem."""
+
+    segundos = sum(lote["seconds"] for lote in lotes)
+    tokens = sum(lote["generated_tokens"] for lote in lotes)
+
+    return {
+        "books": len(resultados),
+        "batches": len(lotes),
+        "identical": sum(r["identical"] for r in resultados),
+        "seconds": round(segundos, 3),
+        "books_per_second": round(len(resultados) / segundos, 3) if segundos else None,
+        "generated_tokens": tokens,
+        "tokens_per_second": round(tokens / segundos, 2) if segundos else None,
+        "prefill_tokens": engine.prefill_tokens,
+        "prefill_tokens_saved": engine.prefill_tokens_saved,
+    }
+
+
+def compare_file(input_path, report_path, engine, single_pass=SINGLE_PASS):
+    """Compara os livros de input_path e grava o relatório JSON em report_path."""
+
+    resultados, lotes = compare_books(read_books(input_path), engine, single_pass=single_pass)
+
+    relatorio = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "input": input_path,
+        "model": MODEL_NAME,
+        "adapter": ADAPTER_PATH or None,
+        "device": str(engine.device),
+        "single_pass": single_pass,
+        "generation": engine.generation_config,
+        "summary": summarize(resultados, lotes, engine),
+        "batches": lotes,
+        "books": resultados,
+    }
+
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+    return relatorio
+
+
+if __name__ == "__main__":
+    entrada, saida = sys.argv[1], sys.argv[2]
+
+    torch.manual_seed(SEED)
+
+    print("Iniciando o carregamento do modelo (Isso pode levar um minuto)...")
+    model, tokenizer = load_model()
+    print(f"✅ Modelo carregado ({resolve_device()})\n")
+
+    engine = CatalogEngine(model, tokenizer, generation_config=GENERATION_CONFIG)
+    resumo = compare_file(entrada, saida, engine)["summary"]
+
+    print(
+        f"\n📊 {resumo['books']:,} livro(s) comparado(s) em {resumo['seconds']} s "
+        f"({resumo['tokens_per_second']} tokens/s); "
+        f"{resumo['identical']:,} com respostas idênticas. Relatório: {saida}"
+    )
@@ -0,0 +1,855 @@
+"""
+Catalogação em lote com o modelo treinado.
+
+inference.py cataloga um livro fixo por execução: carrega o modelo,
+gera uma resposta e sai. Aqui uma lista inteira de livros (CSV ou JSONL
+com title/author/year/edition/imprint) é catalogada com o modelo
+carregado uma única vez:
+
+- o prompt de cada livro é o template do treino (prompt_template.py),
+  com o bloco fixo de instruções tokenizado uma vez só
+  (prompt_tokenizer.py);
+- os livros são lidos em janelas de BATCH_SIZE * BUCKET_WINDOW; dentro
+  de cada janela são ordenados pelo tamanho do prompt e cortados em
+  lotes, para que cada lote tenha pouco padding;
+- cada lote é gerado com um único generate, com padding à esquerda
+  (todas as respostas começam na mesma coluna);
+- o cache de atenção (KV) do bloco fixo de instruções é calculado uma
+  vez por estado do adaptador e compartilhado por todos os lotes: o
+  prefill de cada livro cobre só as últimas linhas do prompt
+  (PREFIX_CACHE; vale também para os prompts dos scripts enviados ao
+  model_server.py);
+- com MARC_GRAMMAR, a saída fica restrita à gramática das linhas MARC
+  e cada livro para assim que o registro fecha (marc_grammar.py);
+- com SPECULATIVE, cada livro é gerado com decodificação especulativa
+  (rascunho por n-gramas do próprio prompt ou por um modelo pequeno,
+  conferido pelo modelo com o adaptador); no fim são mostradas a taxa
+  de aceitação do rascunho e os tokens por segundo;
+- as respostas vão para um JSONL assim que cada lote termina. Numa nova
+  execução, os IDs que já estão na saída são pulados: depois de uma
+  interrupção, basta rodar de novo.
+
+Roda também em CPU com um modelo pequeno, sem quantização 4-bit, para
+testes sem GPU:
+
+    DEVICE=cpu MODEL_NAME=<modelo pequeno> ADAPTER_PATH="" \\
+        python batch_inference.py livros.csv saida.jsonl
+
+Uso: python batch_inference.py livros.csv|livros.jsonl saida.jsonl
+"""
+
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+import torch
+from peft import PeftModel
+from tqdm import tqdm
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, DynamicCache, LogitsProcessorList
+
+from marc_grammar import MarcGrammar, MarcLogitsProcessor, MarcVocab, prompt_tags, token_texts
+from prompt_template import MARC_TEMPLATE_ID, PROMPT_SPLIT_MARKER, render_prompt
+from prompt_tokenizer import PrefixTokenizer
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+MODEL_NAME = os.getenv("MODEL_NAME", "mistralai/Mistral-7B-v0.1")
+# Pasta do adaptador LoRA treinado ("" = modelo base, sem adaptador).
+ADAPTER_PATH = os.getenv("ADAPTER_PATH", "./outputs")
+# "cuda", "cpu" ou "auto" (cuda quando disponível). Em cuda o modelo é
+# carregado em 4-bit, como no inference.py; em cpu, em float32.
+DEVICE = os.getenv("DEVICE", "auto")
+
+TEMPLATE_ID = MARC_TEMPLATE_ID
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+# Lotes por janela de ordenação: janelas maiores agrupam melhor os
+# tamanhos, mas atrasam a gravação das primeiras respostas.
+BUCKET_WINDOW = 16
+
+# Mesmos parâmetros de geração do inference.py.
+GENERATION_CONFIG = {
+    "max_new_tokens": 512,
+    "temperature": 0.1,
+    "top_p": 0.9,
+    "do_sample": True,
+}
+SEED = 42
+
+# Reaproveita o cache KV do prefixo fixo do template em todos os
+# prompts que começam por ele. Com False, cada lote faz o prefill do
+# prompt inteiro.
+PREFIX_CACHE = True
+
+# Prompts montados à mão (inference.py, compare.py...) têm o prefixo
+# cortado na primeira destas marcas; guarda os MAX_PREFIXES mais recentes.
+PROMPT_MARKERS = (PROMPT_SPLIT_MARKER, "Titulo completo:")
+MAX_PREFIXES = 4
+
+# Decodificação restrita à gramática das linhas MARC (marc_grammar.py):
+# só sai registro bem formado e a geração para na linha em branco que
+# fecha o registro. Pode ser ligada por pedido (generation["grammar"]).
+MARC_GRAMMAR = False
+# Tags aceitas: "prompt" (as citadas nas regras do prompt) ou None (todas).
+GRAMMAR_TAGS = "prompt"
+
+# Decodificação especulativa: "prompt_lookup" (rascunho com n-gramas
+# copiados do próprio prompt: título, autor, imprenta...) ou "draft"
+# (rascunho de um modelo pequeno, DRAFT_MODEL, com o mesmo tokenizer).
+# O modelo com o adaptador confere cada rascunho em um único forward;
+# com do_sample=False a saída é idêntica à do generate comum. O
+# generate assistido não aceita lotes: cada prompt é gerado sozinho.
+SPECULATIVE = os.getenv("SPECULATIVE") or None
+SPECULATIVE_MODES = ("prompt_lookup", "draft")
+DRAFT_MODEL = os.getenv("DRAFT_MODEL", "")
+# Tamanho máximo do rascunho no prompt_lookup.
+PROMPT_LOOKUP_TOKENS = 10
+
+# Campos do template -> nomes de coluna aceitos na entrada.
+INPUT_COLUMNS = {
+    "full_title": ("title", "titulo", "full_title"),
+    "author_prompt": ("author", "autor", "author_prompt"),
+    "year": ("year", "ano"),
+    "edition": ("edition", "edicao"),
+    "imprint": ("imprint", "imprenta"),
+}
+# Coluna com o identificador do livro (sem ela, o número da linha).
+ID_COLUMNS = ("id", "record_id")
+
+
+# ============================================================
+# MODELO
+# ============================================================
+
+def resolve_device(device=DEVICE):
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    return device
+
+
+def load_model(model_name=MODEL_NAME, adapter_path=ADAPTER_PATH, device=DEVICE):
+    """Modelo (com o adaptador, se houver) e tokenizer, prontos para gerar."""
+
+    device = resolve_device(device)
+
+    if device == "cuda":
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True,
+        )
+
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            quantization_config=bnb_config,
+            device_map="auto",
+        )
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        model.to(device)
+
+    # Como no inference.py, o tokenizer salvo junto do adaptador.
+    tokenizer = AutoTokenizer.from_pretrained(adapter_path or model_name)
+
+    if adapter_path:
+        model = PeftModel.from_pretrained(model, adapter_path)
+
+    model.eval()
+
+    return model, tokenizer
+
+
+def load_draft_model(model_name=DRAFT_MODEL, device=DEVICE):
+    """Modelo pequeno que escreve os rascunhos da geração especulativa."""
+
+    device = resolve_device(device)
+    dtype = torch.float16 if device == "cuda" else torch.float32
+
+    draft = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype)
+    draft.to(device)
+    draft.eval()
+
+    return draft
+
+
+# ============================================================
+# GERAÇÃO EM LOTE
+# ============================================================
+
+class CatalogEngine:
+    """
+    Gera registros MARC para vários livros por chamada ao generate.
+    Os prompts de um lote são alinhados à direita (padding à esquerda),
+    com a attention_mask zerando o padding.
+
+    Com prefix_cache, os prompts que começam por um prefixo fixo
+    conhecido (o do template ou o de um prompt montado à mão, cortado
+    em PROMPT_MARKERS) são montados como [prefixo][padding][sufixo]: o
+    cache KV do prefixo (calculado uma vez) é repetido para o lote e o
+    generate só processa o padding e o sufixo. As posições vêm da
+    attention_mask (cumsum), então o sufixo continua logo depois do
+    prefixo.
+
+    Com speculative, cada prompt é gerado sozinho com o generate
+    assistido (prompt_lookup ou draft_model) e as contas do rascunho
+    (tokens propostos e aceitos) vão para stats().
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        template_id=TEMPLATE_ID,
+        generation_config=None,
+        prefix_cache=PREFIX_CACHE,
+        grammar=MARC_GRAMMAR,
+        speculative=SPECULATIVE,
+        draft_model=None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.template_id = template_id
+        self.generation_config = {**GENERATION_CONFIG, **(generation_config or {})}
+        self.prefix_cache = prefix_cache
+        self.grammar = grammar
+        self.speculative = speculative
+        self.draft_model = draft_model
+
+        # Vocabulário da gramática por conjunto de tags (marc_grammar.py).
+        self._textos_tokens = None
+        self._vocabs = {}
+
+        # Tokenizers do Mistral/Llama não têm token de padding.
+        self.pad_id = tokenizer.pad_token_id
+
+        if self.pad_id is None:
+            self.pad_id = tokenizer.eos_token_id
+
+        self.prefix_tokenizer = PrefixTokenizer.from_template(tokenizer, template_id)
+
+        # Prefixos de prompts montados à mão (texto -> PrefixTokenizer),
+        # do menos para o mais recente. O do template é sempre mantido.
+        self._prefixos = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Cache KV de cada prefixo, por adaptador (adapter_name), do
+        # menos para o mais recente. Os do template são sempre mantidos.
+        self._prefix_kv = OrderedDict()
+
+        # Tokens de prompt processados no prefill e tokens cujo prefill
+        # foi evitado pelo cache do prefixo.
+        self.prefill_tokens = 0
+        self.prefill_tokens_saved = 0
+
+        # Tokens gerados (sem o EOS e o padding) e tempo gasto no generate.
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+
+        # Geração especulativa: forwards do modelo que conferem rascunhos,
+        # tokens propostos pelo rascunho e tokens do rascunho aceitos.
+        self.verify_steps = 0
+        self.draft_tokens = 0
+        self.accepted_tokens = 0
+
+    @property
+    def device(self):
+        return self.model.device
+
+    def prompt(self, fields):
+        return render_prompt(self.template_id, fields)
+
+    # --------------------------------------------------------
+    # Tokenização
+    # --------------------------------------------------------
+
+    def prefix_tokenizer_for(self, prompt):
+        """PrefixTokenizer do prefixo fixo do prompt (o do template por padrão)."""
+
+        if prompt.startswith(self.prefix_tokenizer.prefix):
+            return self.prefix_tokenizer
+
+        corte = min((prompt.find(m) for m in PROMPT_MARKERS if m in prompt), default=-1)
+
+        if corte <= 0:
+            return self.prefix_tokenizer
+
+        prefixo = prompt[:corte]
+
+        # Pedidos do servidor são tokenizados em threads concorrentes.
+        with self._lock:
+            if prefixo in self._prefixos:
+                self._prefixos.move_to_end(prefixo)
+                return self._prefixos[prefixo]
+
+            prefix_tokenizer = PrefixTokenizer(self.tokenizer, prefixo)
+            prefix_tokenizer.check([prompt])
+
+            self._prefixos[prefixo] = prefix_tokenizer
+
+            while len(self._prefixos) > MAX_PREFIXES:
+                self._prefixos.popitem(last=False)
+
+            return prefix_tokenizer
+
+    def encode(self, prompts):
+        """IDs de cada prompt (cada prefixo fixo tokenizado uma vez só)."""
+
+        grupos = {}
+
+        for i, prompt in enumerate(prompts):
+            grupos.setdefault(self.prefix_tokenizer_for(prompt), []).append(i)
+
+        result = [None] * len(prompts)
+
+        for prefix_tokenizer, indices in grupos.items():
+            for i, ids in zip(indices, prefix_tokenizer.encode_batch([prompts[i] for i in indices])):
+                result[i] = ids
+
+        return result
+
+    def pad_left(self, ids_list):
+        """(input_ids, attention_mask) do lote, com padding à esquerda."""
+
+        largura = max(len(ids) for ids in ids_list)
+
+        input_ids = torch.full((len(ids_list), largura), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+
+        for i, ids in enumerate(ids_list):
+            input_ids[i, largura - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[i, largura - len(ids):] = 1
+
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    def adapter_context(self, adapter=True):
+        """Com adapter=False, desliga o LoRA durante a geração (modelo base)."""
+
+        if adapter or not hasattr(self.model, "disable_adapter"):
+            return contextlib.nullcontext()
+
+        return self.model.disable_adapter()
+
+    def adapter_name(self, adapter=True):
+        """Nome do LoRA em uso, ou "__base__" com ele desligado (ou sem LoRA)."""
+
+        if adapter and hasattr(self.model, "active_adapter"):
+            return self.model.active_adapter
+
+        return "__base__"
+
+    # --------------------------------------------------------
+    # Cache do prefixo
+    # --------------------------------------------------------
+
+    def cached_prefix(self, ids):
+        """
+        PrefixTokenizer do prefixo conhecido pelo qual os IDs começam (e
+        vão além dele), ou None. Só valem prefixos com corte estável.
+        """
+
+        with self._lock:
+            candidatos = [self.prefix_tokenizer, *self._prefixos.values()]
+
+        for prefix_tokenizer in candidatos:
+            prefix_ids = prefix_tokenizer.prefix_ids
+
+            if (
+                prefix_tokenizer.mode is not None
+                and len(ids) > len(prefix_ids)
+                and ids[:len(prefix_ids)] == prefix_ids
+            ):
+                return prefix_tokenizer
+
+        return None
+
+    @torch.no_grad()
+    def prefix_kv(self, prefix_ids, adapter=True):
+        """Cache KV de um prefixo (lote de 1), calculado na primeira vez."""
+
+        # O LoRA ativo pode mudar entre chamadas (set_adapter): o cache
+        # de um adaptador não serve para outro.
+        chave = (prefix_ids, self.adapter_name(adapter))
+
+        if chave in self._prefix_kv:
+            self._prefix_kv.move_to_end(chave)
+            return self._prefix_kv[chave]
+
+        # Mantém só os caches dos prefixos usados mais recentemente.
+        template_ids = tuple(self.prefix_tokenizer.prefix_ids)
+        antigos = [c for c in self._prefix_kv if c[0] != template_ids]
+
+        while len(self._prefix_kv) >= 2 * (MAX_PREFIXES + 1) and antigos:
+            del self._prefix_kv[antigos.pop(0)]
+
+        input_ids = torch.tensor([prefix_ids], dtype=torch.long, device=self.device)
+
+        with self.adapter_context(adapter):
+            saida = self.model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True)
+
+        self._prefix_kv[chave] = saida.past_key_values
+        self.prefill_tokens += len(prefix_ids)
+
+        return saida.past_key_values
+
+    def batch_kv(self, prefix_ids, adapter, n):
+        """
+        Cópia do cache do prefixo para um lote de n prompts. As camadas
+        são views (expand) do cache original: o generate concatena os
+        tokens novos em tensores novos e nunca altera o original.
+        """
+
+        cache = DynamicCache()
+
+        if isinstance(adapter, list):
+            # Lote misto: cada linha recebe o cache do prefixo do seu braço.
+            prefixos = {a: self.prefix_kv(prefix_ids, a) for a in set(adapter)}
+
+            for camada in range(len(prefixos[adapter[0]].key_cache)):
+                cache.update(
+                    torch.cat([prefixos[a].key_cache[camada] for a in adapter]),
+                    torch.cat([prefixos[a].value_cache[camada] for a in adapter]),
+                    camada,
+                )
+
+            return cache
+
+        prefixo = self.prefix_kv(prefix_ids, adapter)
+
+        for camada, (k, v) in enumerate(zip(prefixo.key_cache, prefixo.value_cache)):
+            cache.update(k.expand(n, -1, -1, -1), v.expand(n, -1, -1, -1), camada)
+
+        return cache
+
+    def pad_middle(self, ids_list, prefix_ids):
+        """
+        (input_ids, attention_mask) de prompts que começam por prefix_ids:
+        o padding fica entre o prefixo e o sufixo, para que o prefixo
+        ocupe as mesmas colunas (as do cache) em todas as linhas.
+        """
+
+        n_prefixo = len(prefix_ids)
+        largura = max(len(ids) for ids in ids_list)
+
+        input_ids = torch.full((len(ids_list), largura), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+
+        input_ids[:, :n_prefixo] = torch.tensor(prefix_ids, dtype=torch.long)
+        attention_mask[:, :n_prefixo] = 1
+
+        for i, ids in enumerate(ids_list):
+            input_ids[i, largura - len(ids) + n_prefixo:] = torch.tensor(ids[n_prefixo:], dtype=torch.long)
+            attention_mask[i, largura - len(ids) + n_prefixo:] = 1
+
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    # --------------------------------------------------------
+    # Gramática
+    # --------------------------------------------------------
+
+    def grammar_processor(self, prefix_text):
+        """LogitsProcessor da gramática MARC, com as tags do prompt."""
+
+        tags = prompt_tags(prefix_text) if GRAMMAR_TAGS == "prompt" else None
+
+        if tags not in self._vocabs:
+            if self._textos_tokens is None:
+                self._textos_tokens = token_texts(self.tokenizer)
+
+            self._vocabs[tags] = MarcVocab(self.tokenizer, MarcGrammar(tags), self._textos_tokens)
+
+        return MarcLogitsProcessor(self._vocabs[tags])
+
+    # --------------------------------------------------------
+    # Geração especulativa
+    # --------------------------------------------------------
+
+    def speculative_kwargs(self, speculative):
+        """Argumentos do generate assistido para o modo pedido."""
+
+        if speculative == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": PROMPT_LOOKUP_TOKENS}
+
+        if speculative == "draft":
+            if self.draft_model is None:
+                raise ValueError('speculative="draft" precisa de um modelo de rascunho (DRAFT_MODEL).')
+            return {"assistant_model": self.draft_model}
+
+        raise ValueError(f"speculative deve ser um de {SPECULATIVE_MODES}, não {speculative!r}.")
+
+    @contextlib.contextmanager
+    def count_forwards(self):
+        """
+        Tamanho da entrada de cada forward do modelo principal (o de
+        rascunho tem as próprias embeddings e não entra na conta).
+        """
+
+        tamanhos = []
+        hook = self.model.get_input_embeddings().register_forward_hook(
+            lambda modulo, entrada, saida: tamanhos.append(entrada[0].shape[-1])
+        )
+
+        try:
+            yield tamanhos
+        finally:
+            hook.remove()
+
+    def count_draft(self, tamanhos, prompt_tokens, new_tokens):
+        """
+        Contas do rascunho de um generate assistido. O primeiro forward
+        leva o prompt (sem o prefixo em cache) e o primeiro rascunho; os
+        seguintes, o último token aceito e o próximo rascunho. Cada
+        forward produz os tokens aceitos do rascunho e mais um.
+        """
+
+        passos = len(tamanhos)
+
+        self.verify_steps += passos
+        self.draft_tokens += sum(tamanhos) - prompt_tokens - (passos - 1)
+        self.accepted_tokens += new_tokens - passos
+
+    def stats(self):
+        """Tokens gerados, tokens por segundo e, na geração especulativa, a aceitação do rascunho."""
+
+        stats = {
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_second": round(self.generated_tokens / self.generation_seconds, 2)
+            if self.generation_seconds else None,
+        }
+
+        if self.verify_steps:
+            stats.update({
+                "draft_tokens": self.draft_tokens,
+                "accepted_tokens": self.accepted_tokens,
+                "acceptance_rate": round(self.accepted_tokens / self.draft_tokens, 4)
+                if self.draft_tokens else None,
+                "tokens_per_step": round((self.accepted_tokens + self.verify_steps) / self.verify_steps, 2),
+            })
+
+        return stats
+
+    # --------------------------------------------------------
+    # Geração
+    # --------------------------------------------------------
+
+    def decode(self, seq):
+        """Texto gerado até o EOS, e quantos tokens ele tem."""
+
+        seq = seq.tolist()
+        eos = self.tokenizer.eos_token_id
+
+        if eos in seq:
+            seq = seq[:seq.index(eos)]
+
+        # Com pad diferente do EOS, o padding só aparece depois do EOS.
+        return self.tokenizer.decode(seq, skip_special_tokens=True).strip(), len(seq)
+
+    def adapter_rows(self, adapter):
+        """
+        adapter por linha do lote: um bool quando todas as linhas estão
+        no mesmo braço, senão a lista de bools.
+        """
+
+        if not isinstance(adapter, (list, tuple)):
+            return bool(adapter)
+
+        # Sem adaptador carregado, todas as linhas usam o mesmo modelo.
+        if not hasattr(self.model, "disable_adapter"):
+            return True
+
+        adapter = [bool(a) for a in adapter]
+
+        return adapter[0] if len(set(adapter)) == 1 else adapter
+
+    @torch.no_grad()
+    def _generate(self, ids_list, adapter, generation, prefix_tokenizer=None, grammar=False, speculative=None):
+        prefix_ids = tuple(prefix_tokenizer.prefix_ids) if prefix_tokenizer else None
+        extras = self.speculative_kwargs(speculative) if speculative else {}
+        adapter = self.adapter_rows(adapter)
+
+        if isinstance(adapter, list):
+            # LoRA ligado em umas linhas e desligado em outras do mesmo
+            # generate (lotes mistos do PEFT; "__base__" = modelo base).
+            extras["adapter_names"] = [self.adapter_name(a) for a in adapter]
+
+        if grammar:
+            # Sem prefixo conhecido, valem as regras do template.
+            regras = (prefix_tokenizer or self.prefix_tokenizer).prefix
+            extras["logits_processor"] = LogitsProcessorList([self.grammar_processor(regras)])
+
+        if prefix_ids:
+            input_ids, attention_mask = self.pad_middle(ids_list, prefix_ids)
+            extras["past_key_values"] = self.batch_kv(prefix_ids, adapter, len(ids_list))
+        else:
+            input_ids, attention_mask = self.pad_left(ids_list)
+
+        n_prefixo = len(prefix_ids or ())
+
+        self.prefill_tokens += (input_ids.shape[1] - n_prefixo) * len(ids_list)
+        self.prefill_tokens_saved += n_prefixo * len(ids_list)
+
+        generation = {**self.generation_config, **generation}
+        inicio = time.perf_counter()
+
+        with self.adapter_context(adapter), self.count_forwards() as tamanhos:
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                pad_token_id=self.pad_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                **extras,
+                **generation,
+            )
+
+        self.generation_seconds += time.perf_counter() - inicio
+
+        # Só os tokens gerados (o prompt ocupa as primeiras colunas).
+        gerados = outputs[:, input_ids.shape[1]:]
+
+        if speculative:
+            self.count_draft(tamanhos, input_ids.shape[1] - n_prefixo, gerados.shape[1])
+
+            # O prompt_lookup pode aceitar um rascunho inteiro no último
+            # passo e passar de max_new_tokens.
+            if "max_new_tokens" in generation:
+                gerados = gerados[:, :generation["max_new_tokens"]]
+
+        respostas = []
+
+        for seq in gerados:
+            texto, n = self.decode(seq)
+            self.generated_tokens += n
+            respostas.append(texto)
+
+        return respostas
+
+    def generate_ids(self, ids_list, adapter=True, **generation):
+        """
+        Resposta decodificada de cada prompt já tokenizado do lote.
+        `generation` sobrepõe parâmetros de GENERATION_CONFIG. adapter
+        pode ser uma lista (um bool por prompt): linhas com e sem o
+        adaptador vão no mesmo generate.
+
+        Prompts com o mesmo prefixo conhecido são gerados juntos, a
+        partir do cache dele; os demais vão num generate à parte, com o
+        prompt inteiro. generation["grammar"] liga ou desliga a
+        gramática MARC só nesta chamada; generation["speculative"] escolhe
+        o modo especulativo (None segue o do engine, False desliga).
+        """
+
+        grammar = generation.pop("grammar", self.grammar)
+        speculative = generation.pop("speculative", None)
+
+        if speculative is None:
+            speculative = self.speculative
+
+        grupos = {}
+
+        for i, ids in enumerate(ids_list):
+            prefixo = self.cached_prefix(ids) if self.prefix_cache else None
+            grupos.setdefault(prefixo, []).append(i)
+
+        respostas = [None] * len(ids_list)
+
+        for prefixo, indices in grupos.items():
+            # O generate assistido só aceita um prompt por vez.
+            lotes = [[i] for i in indices] if speculative else [indices]
+
+            for lote in lotes:
+                adapters = [adapter[i] for i in lote] if isinstance(adapter, (list, tuple)) else adapter
+                geradas = self._generate([ids_list[i] for i in lote], adapters, generation, prefixo, grammar, speculative)
+
+                for i, resposta in zip(lote, geradas):
+                    respostas[i] = resposta
+
+        return respostas
+
+    def generate(self, prompts, adapter=True, **generation):
+        return self.generate_ids(self.encode(prompts), adapter, **generation)
+
+    def generate_ab(self, ids_list, single_pass=True, **generation):
+        """
+        (respostas com o adaptador, respostas do modelo base) dos mesmos
+        prompts já tokenizados. Com single_pass, os dois braços vão no
+        mesmo generate; senão, um depois do outro.
+        """
+
+        n = len(ids_list)
+
+        if single_pass:
+            respostas = self.generate_ids(list(ids_list) * 2, [True] * n + [False] * n, **generation)
+            return respostas[:n], respostas[n:]
+
+        return (
+            self.generate_ids(ids_list, True, **generation),
+            self.generate_ids(ids_list, False, **generation),
+        )
+
+
+def length_buckets(lengths, batch_size=BATCH_SIZE):
+    """
+    Lotes de índices com prompts de tamanhos parecidos. Os mais longos
+    vêm primeiro: falta de memória aparece já no primeiro lote.
+    """
+
+    ordem = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+
+    return [ordem[k:k + batch_size] for k in range(0, len(ordem), batch_size)]
+
+
+# ============================================================
+# ENTRADA E SAÍDA
+# ============================================================
+
+def book_fields(row):
+    """Campos do template a partir de uma linha da entrada."""
+
+    row = {
+        str(chave).strip().lower(): valor
+        for chave, valor in row.items()
+        if chave is not None
+    }
+
+    fields = {}
+
+    for campo, colunas in INPUT_COLUMNS.items():
+        valor = next((row[c] for c in colunas if row.get(c)), "")
+        fields[campo] = str(valor).strip()
+
+    return fields
+
+
+def book_id(row, linha):
+    for coluna in ID_COLUMNS:
+        if row.get(coluna) not in (None, ""):
+            return str(row[coluna])
+
+    return str(linha)
+
+
+def read_books(path):
+    """(id, campos do template) de cada livro de um CSV ou JSONL."""
+
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            rows = (json.loads(linha) for linha in f if linha.strip())
+        else:
+            rows = csv.DictReader(f)
+
+        for linha, row in enumerate(rows, 1):
+            yield book_id(row, linha), book_fields(row)
+
+
+def load_done(output_path):
+    """
+    IDs que já estão na saída. Uma última linha incompleta (execução
+    interrompida no meio da gravação) é removida do arquivo.
+    """
+
+    done = set()
+
+    if not os.path.isfile(output_path):
+        return done
+
+    validos = 0
+
+    with open(output_path, "rb") as f:
+        for linha in f:
+            if not linha.endswith(b"\n"):
+                break
+
+            validos += len(linha)
+
+            try:
+                done.add(str(json.loads(linha)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    if validos < os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(validos)
+
+    return done
+
+
+def catalog_file(input_path, output_path, engine, batch_size=BATCH_SIZE, window=BUCKET_WINDOW):
+    """
+    Cataloga os livros de input_path que ainda não estão em output_path,
+    acrescentando uma linha JSON por livro: {"id", campos, "marc"}.
+    Retorna quantos livros foram catalogados nesta execução.
+    """
+
+    done = load_done(output_path)
+
+    if done:
+        print(f"Retomando: {len(done):,} livro(s) já catalogado(s) em {output_path}")
+
+    pendentes = (
+        (livro_id, fields)
+        for livro_id, fields in read_books(input_path)
+        if livro_id not in done
+    )
+
+    total = 0
+
+    with open(output_path, "a", encoding="utf-8") as out, tqdm(desc="Catalogando", unit=" livro") as pbar:
+        while True:
+            janela = list(islice(pendentes, batch_size * window))
+
+            if not janela:
+                break
+
+            ids = engine.encode([engine.prompt(fields) for _, fields in janela])
+
+            for lote in length_buckets([len(x) for x in ids], batch_size):
+                respostas = engine.generate_ids([ids[i] for i in lote])
+
+                for i, marc in zip(lote, respostas):
+                    livro_id, fields = janela[i]
+                    out.write(json.dumps({"id": livro_id, **fields, "marc": marc}, ensure_ascii=False) + "\n")
+
+                # Cada lote fica gravado antes do próximo começar.
+                out.flush()
+                pbar.update(len(lote))
+                total += len(lote)
+
+    return total
+
+
+if __name__ == "__main__":
+    entrada, saida = sys.argv[1], sys.argv[2]
+
+    torch.manual_seed(SEED)
+
+    print("Iniciando o carregamento do modelo (Isso pode levar um minuto)...")
+    model, tokenizer = load_model()
+    print(f"✅ Modelo carregado ({resolve_device()})\n")
+
+    draft_model = load_draft_model() if DRAFT_MODEL else None
+
+    engine = CatalogEngine(model, tokenizer, draft_model=draft_model)
+    total = catalog_file(entrada, saida, engine)
+
+    print(f"\n📚 {total:,} livro(s) catalogado(s) em {saida}")
+
+    stats = engine.stats()
+
+    if stats["generated_tokens"]:
+        print(f"⚡ {stats['generated_tokens']:,} tokens gerados, {stats['tokens_per_second']} tokens/s")
+
+    if stats.get("acceptance_rate") is not None:
+        print(
+            f"🎯 Rascunho ({engine.speculative}): {stats['accepted_tokens']:,} de "
+            f"{stats['draft_tokens']:,} tokens aceitos ({stats['acceptance_rate']:.1%}), "
+            f"{stats['tokens_per_step']} tokens por forward"
+        )
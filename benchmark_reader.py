@@ -0,0 +1,51 @@
+# Compara a vazão (registros/s) do leitor antigo, por linhas, com o
+# leitor iterparse de marc_reader.py (com pymarc.Record e com LiteRecord)
+# sobre o mesmo arquivo XML/XML.GZ.
+#
+# Uso: python benchmark_reader.py arquivo.xml [max_registros]
+
+import sys
+import time
+
+import preparation
+from marc_reader import element_to_lite_record, iter_marc_records
+
+
+def medir(nome, records, limite):
+    inicio = time.perf_counter()
+    total = 0
+
+    for record in records:
+        preparation.format_marc_record(record)
+        total += 1
+
+        if total >= limite:
+            break
+
+    segundos = time.perf_counter() - inicio
+    print(f"{nome:<10} {total:>10,} reg  {segundos:8.2f} s  {total / segundos:10,.0f} reg/s")
+    return total / segundos
+
+
+if __name__ == "__main__":
+    arquivo = sys.argv[1]
+    limite = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+
+    state_linhas = {"errors": 0}
+    state_iter = {"errors": 0}
+    state_lite = {"errors": 0}
+
+    antigo = medir("linhas", preparation.iter_records_por_linhas(arquivo, state_linhas), limite)
+    novo = medir("iterparse", iter_marc_records(arquivo, state_iter), limite)
+    lite = medir(
+        "lite",
+        iter_marc_records(arquivo, state_lite, factory=element_to_lite_record),
+        limite,
+    )
+
+    print(
+        f"\nErros: linhas={state_linhas['errors']:,} "
+        f"iterparse={state_iter['errors']:,} lite={state_lite['errors']:,}"
+    )
+    print(f"Ganho iterparse: {novo / antigo:.2f}x")
+    print(f"Ganho lite:      {lite / antigo:.2f}x")
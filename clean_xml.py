@@ -1,16 +1,46 @@
+import mmap
 import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
+from dataset_writer import compression_from_path, open_binary_reader, open_binary_writer
+
 # =====================================================
 # CONFIGURAÇÃO
 # =====================================================
 ARQUIVO_SUJO = '/workspace/inputs/lc_data.xml'
 ARQUIVO_LIMPO = '/workspace/inputs/lc_data_clean.xml'
+# Entrada e saída podem ser .xml.gz ou .xml.zst (compressão pela extensão).
+
+# Sanitizador: "bytes" (blocos grandes, sem decodificar o texto válido)
+# ou "linhas" (versão original, linha a linha em str). A saída é a mesma.
+MODO = "bytes"
+
+# Tamanho de cada bloco lido do disco no modo "bytes".
+BLOCO_BYTES = 64 * 1024 * 1024
+
+# Processos do modo "bytes". Com 1 os blocos são limpos no próprio
+# processo; com mais, cada processo limpa uma faixa do arquivo e a
+# escrita junta os resultados na ordem original (mesma saída).
+NUM_WORKERS = 1
 
 filtro_invisiveis = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1F\uD800-\uDFFF\uFFFE\uFFFF]')
 
-def sanitizar_marcxml(input_file, output_file):
+# Mesmos caracteres de controle do filtro_invisiveis, como bytes a apagar
+# com bytes.translate. Surrogates (ED A0..BF ..) já são UTF-8 inválido.
+BYTES_INVISIVEIS = bytes(range(0x00, 0x09)) + b'\x0b\x0c' + bytes(range(0x0e, 0x20))
+# U+FFFE e U+FFFF em UTF-8.
+NAO_CARACTERES = (b'\xef\xbf\xbe', b'\xef\xbf\xbf')
+
+# Linhas de abertura/fechamento repetidas quando vários dumps são concatenados.
+MARCA_XML_DECL = b'<?xml'
+MARCA_COLLECTION = b'<collection'
+MARCA_FECHA_COLLECTION = b'</collection>'
+
+
+def sanitizar_marcxml_linhas(input_file, output_file):
     print(f"Iniciando varredura a laser no arquivo: {input_file}...")
     
     # Pega o tamanho exato do arquivo no disco (instantâneo)
@@ -59,5 +89,343 @@ def sanitizar_marcxml(input_file, output_file):
         
     print(f"\n✅ Sanitização extrema concluída! Arquivo perfeito salvo em: {output_file}")
 
+
+# =====================================================
+# MODO "bytes"
+# =====================================================
+
+def limpar_bloco(bloco):
+    """
+    Aplica ao bloco (terminado em fim de linha ou em '>', ou o fim do
+    arquivo) as mesmas regras do modo "linhas", mas em bytes.
+
+    Blocos em UTF-8 válido (o caso normal) não são decodificados para
+    escrita: a validação é só um decode descartado, e os controles são
+    apagados com bytes.translate. Blocos com UTF-8 inválido (inclusive
+    surrogates codificados) passam pelo mesmo decode com
+    errors='ignore' da versão original, que descarta os bytes ruins
+    antes de os controles serem apagados.
+    """
+
+    try:
+        bloco.decode('utf-8')
+    except UnicodeDecodeError:
+        bloco = bloco.decode('utf-8', errors='ignore').encode('utf-8')
+
+    # Quebras de linha universais, como no open() em modo texto (que as
+    # converte depois do decode: '\r' + byte inválido + '\n' é uma só).
+    if b'\r' in bloco:
+        bloco = bloco.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    bloco = bloco.translate(None, BYTES_INVISIVEIS)
+
+    # Teste de um byte só (memchr) antes de procurar as sequências.
+    if b'\xef' in bloco:
+        for nao_caractere in NAO_CARACTERES:
+            bloco = bloco.replace(nao_caractere, b'')
+
+    return bloco
+
+
+def marcas_do_bloco(bloco):
+    """
+    Linhas do bloco limpo que começam (ignorando espaços) por <?xml,
+    <collection ou </collection>: lista ordenada de (início, fim, tipo),
+    com fim logo depois do '\\n' da linha.
+    """
+
+    marcas = []
+
+    for tipo, marca in (
+        ('xml_decl', MARCA_XML_DECL),
+        ('collection', MARCA_COLLECTION),
+        ('fecha_collection', MARCA_FECHA_COLLECTION),
+    ):
+        pos = bloco.find(marca)
+
+        while pos >= 0:
+            inicio = bloco.rfind(b'\n', 0, pos) + 1
+
+            # Mesmo critério do strip() em str (o bloco já é UTF-8 válido).
+            if not bloco[inicio:pos].decode('utf-8').strip():
+                fim = bloco.find(b'\n', pos)
+                fim = len(bloco) if fim < 0 else fim + 1
+                marcas.append((inicio, fim, tipo))
+
+            pos = bloco.find(marca, pos + len(marca))
+
+    marcas.sort()
+
+    return marcas
+
+
+def remover_marcas(bloco, marcas, estado):
+    """
+    Bloco sem as linhas <?xml e <collection repetidas (só a primeira de
+    cada no arquivo fica, conforme `estado`) e sem as </collection>.
+
+    Um bloco que não termina em '\\n' (iter_blocos cortou uma linha
+    longa num '>') tem a linha continuada no bloco seguinte: lá o
+    começo do bloco não é começo de linha, e o resto de uma linha
+    removida também sai.
+    """
+
+    if marcas is None or not bloco:
+        return bloco
+
+    partes = []
+    pos = 0
+
+    if estado['meio_da_linha']:
+        marcas = [marca for marca in marcas if marca[0] > 0]
+
+        if estado['removendo']:
+            pos = bloco.find(b'\n') + 1 or len(bloco)
+
+    for inicio, fim, tipo in marcas:
+
+        if tipo != 'fecha_collection' and not estado[tipo]:
+            estado[tipo] = True
+            continue
+
+        partes.append(bloco[pos:inicio])
+        pos = fim
+
+    fim_de_linha = bloco.endswith(b'\n')
+    estado['meio_da_linha'] = not fim_de_linha
+    estado['removendo'] = not fim_de_linha and pos == len(bloco)
+
+    if pos == 0:
+        return bloco
+
+    partes.append(bloco[pos:])
+
+    return b''.join(partes)
+
+
+def escrever_bloco(fout, bloco, marcas, estado):
+    """Escreve o bloco limpo, sem as linhas de remover_marcas."""
+
+    fout.write(remover_marcas(bloco, marcas, estado))
+
+
+def iter_blocos(fin, tamanho_bloco=BLOCO_BYTES, raw=None):
+    """
+    Lê o arquivo em blocos de ~tamanho_bloco que terminam sempre em
+    '\\n' (o resto da última linha vai para o bloco seguinte), para
+    que nenhum caractere UTF-8 nem linha fique dividido entre blocos.
+    Uma linha maior que o bloco (dump inteiro numa linha só) é cortada
+    depois do último '>', que é ASCII e não divide caractere UTF-8 nem
+    quebra de linha; remover_marcas trata a linha continuada.
+    Devolve (bloco, bytes lidos do arquivo); com entrada comprimida,
+    `raw` é o arquivo em disco e os bytes lidos são os comprimidos.
+    """
+
+    pendentes = []
+    posicao = raw.tell() if raw is not None else 0
+    lidos = 0
+
+    while True:
+        dados = fin.read(tamanho_bloco)
+
+        if raw is not None:
+            lidos += raw.tell() - posicao
+            posicao = raw.tell()
+        else:
+            lidos += len(dados)
+
+        if not dados:
+            resto = b''.join(pendentes)
+            if resto:
+                yield resto, lidos
+            return
+
+        corte = dados.rfind(b'\n') + 1
+
+        if corte == 0:
+            corte = dados.rfind(b'>') + 1
+
+        if corte == 0:
+            # Nem '>' no bloco: continua acumulando.
+            pendentes.append(dados)
+            continue
+
+        pendentes.append(dados[:corte])
+        yield b''.join(pendentes), lidos
+        pendentes = [dados[corte:]]
+        lidos = 0
+
+
+def limpar_bloco_lido(tarefa):
+    """(bloco limpo, marcas, bytes lidos) de um bloco de iter_blocos."""
+
+    bloco, lidos = tarefa
+    bloco = limpar_bloco(bloco)
+
+    return bloco, marcas_do_bloco(bloco), lidos
+
+
+def iter_blocos_limpos(fin, tamanho_bloco=BLOCO_BYTES, raw=None):
+    """(bloco limpo, marcas, bytes lidos) de cada bloco, em sequência."""
+
+    for tarefa in iter_blocos(fin, tamanho_bloco, raw):
+        yield limpar_bloco_lido(tarefa)
+
+
+def abrir_entrada(input_file):
+    """
+    Abre a entrada (.xml, .xml.gz ou .xml.zst) para leitura binária.
+    Retorna (leitor, arquivo em disco ou None se não houver compressão).
+    """
+
+    if compression_from_path(input_file) is None:
+        return open(input_file, 'rb', buffering=0), None
+
+    raw = open(input_file, 'rb')
+
+    return open_binary_reader(input_file, raw), raw
+
+
+# =====================================================
+# MODO "bytes" EM PARALELO
+# =====================================================
+
+def planejar_faixas(input_file, tamanho_bloco=BLOCO_BYTES):
+    """
+    Divide o arquivo em faixas (início, fim) de ~tamanho_bloco que
+    terminam logo depois de um '\\n' (ou no fim do arquivo), como os
+    blocos do modo sequencial. Sem '\\n' no bloco seguinte, a faixa
+    termina depois de um '>'.
+    """
+
+    tamanho_total = os.path.getsize(input_file)
+
+    if tamanho_total == 0:
+        return []
+
+    faixas = []
+
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        inicio = 0
+
+        while inicio < tamanho_total:
+            alvo = min(inicio + tamanho_bloco, tamanho_total) - 1
+            fim = mm.find(b'\n', alvo, alvo + tamanho_bloco) + 1
+
+            if fim == 0:
+                fim = mm.find(b'>', alvo) + 1
+
+            fim = tamanho_total if fim == 0 else fim
+            faixas.append((inicio, fim))
+            inicio = fim
+
+    return faixas
+
+
+def limpar_faixa(tarefa):
+    """Lê e limpa uma faixa do arquivo (roda nos processos)."""
+
+    input_file, inicio, fim = tarefa
+
+    with open(input_file, 'rb') as f:
+        f.seek(inicio)
+        bloco = limpar_bloco(f.read(fim - inicio))
+
+    return bloco, marcas_do_bloco(bloco), fim - inicio
+
+
+def iter_em_ordem(funcao, tarefas, num_workers=NUM_WORKERS):
+    """
+    funcao(tarefa) para cada tarefa, em `num_workers` processos, com os
+    resultados na ordem das tarefas. No máximo 2 * num_workers tarefas
+    ficam em andamento (memória limitada mesmo com a escrita mais lenta
+    que a limpeza).
+    """
+
+    tarefas = iter(tarefas)
+    em_andamento = deque()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+
+        while True:
+
+            while len(em_andamento) < 2 * num_workers:
+                tarefa = next(tarefas, None)
+
+                if tarefa is None:
+                    break
+
+                em_andamento.append(executor.submit(funcao, tarefa))
+
+            if not em_andamento:
+                return
+
+            yield em_andamento.popleft().result()
+
+
+def iter_faixas_limpas(input_file, tamanho_bloco=BLOCO_BYTES, num_workers=NUM_WORKERS):
+    """
+    Mesmo resultado de iter_blocos_limpos, com as faixas limpas em
+    `num_workers` processos (cada um lê a sua faixa do arquivo).
+    """
+
+    return iter_em_ordem(
+        limpar_faixa,
+        ((input_file, inicio, fim) for inicio, fim in planejar_faixas(input_file, tamanho_bloco)),
+        num_workers,
+    )
+
+
+def blocos_limpos(input_file, fin, raw=None, tamanho_bloco=BLOCO_BYTES, num_workers=NUM_WORKERS):
+    """
+    (bloco limpo, marcas, bytes lidos) de cada bloco da entrada aberta
+    com abrir_entrada. Em paralelo, um arquivo sem compressão é
+    dividido em faixas lidas pelos próprios processos; um comprimido
+    só pode ser lido em sequência, e os blocos descomprimidos aqui são
+    enviados aos processos.
+    """
+
+    if num_workers <= 1:
+        return iter_blocos_limpos(fin, tamanho_bloco, raw)
+
+    if raw is None:
+        return iter_faixas_limpas(input_file, tamanho_bloco, num_workers)
+
+    return iter_em_ordem(limpar_bloco_lido, iter_blocos(fin, tamanho_bloco, raw), num_workers)
+
+
+def sanitizar_marcxml(input_file, output_file, tamanho_bloco=BLOCO_BYTES, num_workers=NUM_WORKERS):
+    if MODO == "linhas":
+        return sanitizar_marcxml_linhas(input_file, output_file)
+
+    print(f"Iniciando varredura a laser no arquivo: {input_file}...")
+
+    if num_workers > 1:
+        print(f"Modo paralelo: {num_workers} processo(s).")
+
+    tamanho_total = os.path.getsize(input_file)
+    estado = {'xml_decl': False, 'collection': False, 'meio_da_linha': False, 'removendo': False}
+
+    fin, raw = abrir_entrada(input_file)
+
+    with fin, open_binary_writer(output_file, compression_from_path(output_file)) as fout:
+
+        # Progresso pelo offset de leitura (no arquivo em disco), sem recodificar nada.
+        with tqdm(total=tamanho_total, unit='B', unit_scale=True, unit_divisor=1024, desc="Sanitizando", colour="yellow") as pbar:
+
+            # A primeira <?xml e a primeira <collection do arquivo
+            # dependem dos blocos anteriores: decididas aqui, em ordem.
+            for bloco, marcas, lidos in blocos_limpos(input_file, fin, raw, tamanho_bloco, num_workers):
+                escrever_bloco(fout, bloco, marcas, estado)
+                pbar.update(lidos)
+
+        # Garante o fechamento perfeito do arquivo ao final do loop
+        fout.write(b'\n</collection>\n')
+
+    if raw is not None:
+        raw.close()
+
+    print(f"\n✅ Sanitização extrema concluída! Arquivo perfeito salvo em: {output_file}")
+
 if __name__ == "__main__":
-    sanitizar_marcxml(ARQUIVO_SUJO, ARQUIVO_LIMPO)
\ No newline at end of file
+    sanitizar_marcxml(ARQUIVO_SUJO, ARQUIVO_LIMPO)
@@ -1,41 +1,16 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
+from model_client import SERVER_URL, generate
 
 # =====================================================
-# CONFIGURAÇÕES DE CAMINHO
+# SERVIDOR DO MODELO
 # =====================================================
-MODEL_NAME = "mistralai/Mistral-7B-v0.1"
-ADAPTER_PATH = "./outputs"  # A pasta onde o seu modelo treinado foi salvo
+# O modelo base e o adaptador (o seu treinamento de 17h) ficam
+# carregados no model_server.py: as duas inferências abaixo vão num
+# único pedido e num único lote, com o LoRA ligado só na primeira.
+# Para comparar muitos livros, use o ab_compare.py.
+print(f"Usando o servidor do modelo em {SERVER_URL}\n")
 
-print("Carregando a rede neural na GPU (Isso pode levar um minuto)...\n")
-
-# =====================================================
-# 1. CARREGAR O MODELO BASE (O cérebro original)
-# =====================================================
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True,
-)
-
-base_model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    quantization_config=bnb_config,
-    device_map="auto",
-)
-
-tokenizer = AutoTokenizer.from_pretrained(ADAPTER_PATH)
-
-# =====================================================
-# 2. ACOPLAR O ADAPTADOR (O seu treinamento de 17h)
 # =====================================================
-model = PeftModel.from_pretrained(base_model, ADAPTER_PATH)
-model.eval()
-
-# =====================================================
-# 3. DADOS DE TESTE INÉDITOS
+# 1. DADOS DE TESTE INÉDITOS
 # =====================================================
 titulo_teste = "Statistical prediction and machine learning"
 autor_teste = "John Tuhao Chen, Lincy Y. Chen, Clement Lee"
@@ -85,19 +60,19 @@ Responda **APENAS** com o registro MARC completo (todos os campos necessarios, c
 <|im_start|>assistant
 """
 
-# Função auxiliar para gerar o texto e não repetir código
-def gerar_catalogacao(modelo_ativo):
-    inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
-    with torch.no_grad():
-        outputs = modelo_ativo.generate(
-            **inputs,
-            max_new_tokens=512,
-            temperature=0.1,
-            top_p=0.9,
-            do_sample=True,
-            eos_token_id=tokenizer.eos_token_id
-        )
-    return tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True).strip()
+# Os dois modelos de uma vez: mesmo prompt, com e sem o adaptador
+def gerar_catalogacao():
+    respostas = generate(
+        [prompt, prompt],
+        adapter=[True, False],
+        max_new_tokens=512,
+        temperature=0.1,
+        top_p=0.9,
+        do_sample=True,
+    )
+    return [r.strip() for r in respostas]
+
+resposta_treinada, resposta_pura = gerar_catalogacao()
 
 print("-" * 70)
 print(f"📚 Obra em Análise: {titulo_teste}\n")
@@ -106,7 +81,6 @@ print(f"📚 Obra em Análise: {titulo_teste}\n")
 # INFERÊNCIA 1: O MODELO TREINADO (COM ADAPTADOR)
 # =====================================================
 print("🤖 1. RESULTADO DO MISTRAL COM FINE-TUNING (O seu modelo):")
-resposta_treinada = gerar_catalogacao(model)
 print(resposta_treinada)
 print("-" * 70)
 
@@ -114,8 +88,6 @@ print("-" * 70)
 # INFERÊNCIA 2: O MODELO PURO (SEM ADAPTADOR)
 # =====================================================
 print("🧠 2. RESULTADO DO MISTRAL PURO (Desativando o treinamento):")
-# O comando genialmente simples que "desliga" temporariamente o LoRA
-with model.disable_adapter():
-    resposta_pura = gerar_catalogacao(model)
+# O servidor "desliga" o LoRA só na linha deste prompt no lote
 print(resposta_pura)
 print("-" * 70)
\ No newline at end of file
@@ -1,16 +1,305 @@
-def contar_registros_sujo(caminho_arquivo):
-    contador = 0
-    # Abrimos como texto puro para evitar o parser de XML
-    with open(caminho_arquivo, 'r', encoding='utf-8', errors='ignore') as f:
-        for linha in f:
-            # Procuramos pela tag de abertura do registro MARCXML
-            # O strip() ajuda caso haja espaços, e o lower() previne variação de caixa
-            if '<record' in linha.lower():
-                contador += 1
-    return contador
+"""
+Contagem de registros MARCXML em arquivos (ou pastas) grandes.
+
+Três formas de contar, da mais barata para a mais cara:
+
+- índice (record_index.py): se o arquivo já tem um .idx.npz válido, a
+  contagem é só o tamanho do índice;
+- "estimativa": conta os <record> em algumas janelas espalhadas pelo
+  arquivo (AMOSTRA_BYTES no total) e extrapola pelo tamanho em disco.
+  Em .gz/.zst a amostra é o começo do fluxo e a extrapolação usa os
+  bytes comprimidos consumidos. Leva segundos mesmo em dezenas de GB;
+- "exato": conta as aberturas de <record> do arquivo inteiro, direto
+  nos bytes (mmap + busca vetorizada com numpy, sem decodificar texto),
+  opcionalmente com várias threads sobre faixas do arquivo.
+
+A contagem exata sem índice inclui os registros truncados (é a
+contagem de aberturas); contar_registros mantém a contagem do índice,
+que separa os truncados.
+
+Uso: python countRegister.py arquivo_ou_pasta [exato|estimativa] [threads]
+"""
+
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clean_xml import abrir_entrada, iter_blocos
+from dataset_writer import XML_EXTENSIONS, compression_from_path
+from marc_reader import RECORD_DELIMITERS, RECORD_START
+from record_index import get_index, load_index, scan_records_partial
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+ARQUIVO = 'lc_data.xml'
+
+# Tamanho de cada faixa da contagem exata (e de cada leitura dos
+# arquivos comprimidos).
+JANELA_BYTES = 64 * 1024 * 1024
+
+# Threads da contagem exata de arquivos sem compressão (numpy libera
+# o GIL nas comparações, então as faixas rodam de fato em paralelo).
+NUM_THREADS = 1
+
+# Bytes lidos pela estimativa, divididos em AMOSTRA_JANELAS janelas.
+AMOSTRA_BYTES = 8 * 1024 * 1024
+AMOSTRA_JANELAS = 16
+
+MODOS = ("exato", "estimativa")
+
+_TAG = np.frombuffer(RECORD_START, dtype=np.uint8)
+
+# Byte que pode vir depois de "<record" (ignora <records>, <recordInfo>...)
+_DELIMITADOR = np.zeros(256, dtype=bool)
+_DELIMITADOR[list(RECORD_DELIMITERS)] = True
+
+
+# ============================================================
+# BUSCA VETORIZADA
+# ============================================================
+
+def contar_tags(arr, inicio=0, fim=None):
+    """
+    Quantos <record> começam em arr[inicio:fim] (arr é um array uint8).
+    Os bytes depois de `fim` só são olhados para completar uma tag que
+    começa antes dele; no fim de arr, tag sem delimitador conta.
+    """
+
+    fim = len(arr) if fim is None else fim
+    janela = arr[inicio:min(fim + len(_TAG) + 1, len(arr))]
+
+    # Candidatos: cada '<' da faixa com espaço para a tag inteira.
+    pos = np.flatnonzero(janela[:fim - inicio] == _TAG[0])
+    pos = pos[pos + len(_TAG) <= len(janela)]
+
+    for k in range(1, len(_TAG)):
+        pos = pos[janela[pos + k] == _TAG[k]]
+
+    seguinte = pos + len(_TAG)
+    no_fim = seguinte >= len(janela)
+
+    return int(np.count_nonzero(no_fim | _DELIMITADOR[janela[np.minimum(seguinte, len(janela) - 1)]]))
+
+
+def contar_mmap(caminho_arquivo, num_threads=NUM_THREADS, janela=JANELA_BYTES):
+    """Contagem exata de um arquivo sem compressão, por faixas do mmap."""
+
+    tamanho = os.path.getsize(caminho_arquivo)
+
+    if tamanho == 0:
+        return 0
+
+    faixas = [(ini, min(ini + janela, tamanho)) for ini in range(0, tamanho, janela)]
+
+    with open(caminho_arquivo, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        arr = np.frombuffer(mm, dtype=np.uint8)
+
+        try:
+            if num_threads <= 1 or len(faixas) == 1:
+                return sum(contar_tags(arr, ini, fim) for ini, fim in faixas)
+
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                return sum(executor.map(lambda faixa: contar_tags(arr, *faixa), faixas))
+        finally:
+            # O mmap só pode ser fechado sem arrays apontando para ele.
+            del arr
+
+
+def contar_fluxo(fin, limite=None, janela=JANELA_BYTES):
+    """
+    Conta os <record> de um fluxo lido em blocos. Os últimos bytes de
+    cada bloco (onde uma tag pode estar cortada) passam para o seguinte.
+    Com `limite`, para depois de ler ~limite bytes. Retorna (contagem,
+    bytes lidos).
+    """
+
+    total = lidos = 0
+    resto = b''
+
+    while limite is None or lidos < limite:
+        dados = fin.read(janela if limite is None else min(janela, limite - lidos))
+
+        if not dados:
+            break
+
+        lidos += len(dados)
+        buf = resto + dados
+        corte = max(len(buf) - len(_TAG), 0)
+
+        total += contar_tags(np.frombuffer(buf, dtype=np.uint8), 0, corte)
+        resto = buf[corte:]
+
+    if resto and (limite is None or lidos < limite):
+        total += contar_tags(np.frombuffer(resto, dtype=np.uint8))
+
+    return total, lidos
+
+
+# ============================================================
+# CONTAGEM POR ARQUIVO
+# ============================================================
+
+def estimar_registros(caminho_arquivo, amostra=AMOSTRA_BYTES, janelas=AMOSTRA_JANELAS):
+    """
+    Estimativa do número de registros pela densidade de <record> em
+    ~amostra bytes, extrapolada para o tamanho do arquivo em disco.
+    """
+
+    tamanho = os.path.getsize(caminho_arquivo)
+
+    if compression_from_path(caminho_arquivo) is not None:
+        fin, raw = abrir_entrada(caminho_arquivo)
+
+        with fin, raw:
+            contagem, lidos = contar_fluxo(fin, limite=amostra)
+            comprimidos = raw.tell()
+
+        # Fluxo inteiro lido: a contagem já é exata.
+        if lidos < amostra or comprimidos >= tamanho:
+            return contagem
+
+        return round(contagem * tamanho / max(comprimidos, 1))
+
+    if tamanho <= amostra:
+        return contar_mmap(caminho_arquivo, num_threads=1)
+
+    # Janelas do mesmo tamanho, espalhadas de forma uniforme (a
+    # primeira no início e a última terminando no fim do arquivo).
+    largura = amostra // janelas
+    inicios = np.linspace(0, tamanho - largura, janelas).astype(np.int64)
+
+    with open(caminho_arquivo, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        arr = np.frombuffer(mm, dtype=np.uint8)
+
+        try:
+            contagem = sum(contar_tags(arr, int(ini), int(ini) + largura) for ini in inicios)
+        finally:
+            del arr
+
+    return round(contagem * tamanho / (largura * janelas))
+
+
+def contar_registros_sujo(caminho_arquivo, num_threads=NUM_THREADS):
+    """
+    Contagem exata das aberturas de <record>, direto nos bytes, sem
+    decodificar o texto nem montar o índice (.gz/.zst em sequência).
+    """
+
+    if compression_from_path(caminho_arquivo) is not None:
+        fin, raw = abrir_entrada(caminho_arquivo)
+
+        with fin, raw:
+            return contar_fluxo(fin)[0]
+
+    return contar_mmap(caminho_arquivo, num_threads)
+
+
+def contar_rapido(caminho_arquivo, modo="estimativa", num_threads=NUM_THREADS):
+    """
+    Registros de um arquivo pelo caminho mais barato: o índice, se já
+    existir e estiver atualizado; senão a estimativa ou a contagem
+    exata. Retorna (registros, exato).
+    """
+
+    if modo not in MODOS:
+        raise ValueError(f"Modo desconhecido: {modo!r} (use {', '.join(MODOS)})")
+
+    if compression_from_path(caminho_arquivo) is None:
+        index = load_index(caminho_arquivo)
+
+        if index is not None:
+            return len(index), True
+
+    if modo == "estimativa":
+        return estimar_registros(caminho_arquivo), False
+
+    return contar_registros_sujo(caminho_arquivo, num_threads), True
+
+
+def listar_xmls(caminho):
+    """O próprio arquivo, ou os .xml/.xml.gz/.xml.zst de uma pasta."""
+
+    if not os.path.isdir(caminho):
+        return [caminho]
+
+    return sorted(
+        os.path.join(caminho, nome)
+        for nome in os.listdir(caminho)
+        if nome.lower().endswith(XML_EXTENSIONS)
+        and os.path.isfile(os.path.join(caminho, nome))
+    )
+
+
+def contar_arquivos(caminhos, modo="estimativa", num_threads=NUM_THREADS):
+    """
+    {arquivo: (registros, exato)} de um arquivo, de uma pasta ou de uma
+    lista deles (ex.: para o total da barra de progresso). Arquivos que
+    não podem ser lidos (ex.: .gz corrompido) ficam fora do resultado.
+    """
+
+    if isinstance(caminhos, (str, os.PathLike)):
+        caminhos = [caminhos]
+
+    contagens = {}
+
+    for caminho in caminhos:
+        for arquivo in listar_xmls(os.fspath(caminho)):
+            try:
+                contagens[arquivo] = contar_rapido(arquivo, modo, num_threads)
+
+            except Exception as exc:
+                print(f"[AVISO] Não foi possível contar '{arquivo}': {exc}")
+
+    return contagens
+
+
+def contar_registros_comprimido(caminho_arquivo):
+    # Arquivos .gz/.zst: uma leitura descomprimindo em blocos (sempre
+    # terminados em fim de linha), com as mesmas regras do índice.
+    total = truncados = 0
+    pendente = b''
+    fin, raw = abrir_entrada(caminho_arquivo)
+    with fin, raw:
+        for bloco, _ in iter_blocos(fin, raw=raw):
+            buf = pendente + bloco if pendente else bloco
+            offsets, _, truncados_bloco, aberto = scan_records_partial(buf)
+            total += len(offsets)
+            truncados += truncados_bloco
+            pendente = buf[aberto:] if aberto is not None else b''
+    return total, truncados + (1 if pendente else 0)
+
+
+def contar_registros(caminho_arquivo):
+    # Usa o índice de registros (arquivo.xml.idx.npz): a primeira contagem
+    # varre o arquivo uma vez; as seguintes só leem o índice.
+    # Arquivos comprimidos não são indexáveis e são lidos em sequência.
+    if compression_from_path(caminho_arquivo) is not None:
+        return contar_registros_comprimido(caminho_arquivo)
+
+    index = get_index(caminho_arquivo)
+    return len(index), index.truncados
+
 
 # Execução
-arquivo = 'lc_data.xml'
-print("Iniciando contagem de registros no arquivo sujo...")
-total = contar_registros_sujo(arquivo)
-print(f"Total de registros encontrados: {total}")
\ No newline at end of file
+if __name__ == "__main__":
+    caminho = sys.argv[1] if len(sys.argv) > 1 else ARQUIVO
+    modo = sys.argv[2] if len(sys.argv) > 2 else "exato"
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else NUM_THREADS
+
+    print(f"Contando registros ({modo}) em {caminho}...")
+
+    contagens = contar_arquivos(caminho, modo, num_threads)
+
+    for arquivo, (total, exato) in contagens.items():
+        print(f"  {os.path.basename(arquivo)}: {'' if exato else '~'}{total:,}")
+
+    total = sum(total for total, _ in contagens.values())
+    exato = all(exato for _, exato in contagens.values())
+
+    print(f"Total de registros encontrados: {'' if exato else '~'}{total:,}")
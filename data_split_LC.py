@@ -1,51 +1,73 @@
 # Código para separar os MARC do arquivo gigante em pequenos arquivos individuias.
 
-from lxml import etree
-import pandas as pd
 import os
 import sys
 
+from dataset_writer import COMPRESSION_EXTENSIONS, compression_from_path
+from pipeline_xml import processar_dump
+from record_index import get_index
+from split_xml import escritores_para, gravar_partes
+
 input_file = "/workspace/inputs_lc/final_output_file.xml"
+output_dir = "/workspace/outputs"
 output_prefix = 'marc_chunk_'
-records_size = 0
 records_limits = 100000
 chunk_num = 5000
-current_records = []
-
-# Cabeçalho XML básico (ajuste se o seu arquivo tiver namespace específico)
-header = '''<?xml version="1.0" encoding="UTF-8"?>
-<collection xmlns="http://www.loc.gov/MARC21/slim">
-'''
-footer = '</collection>'
-parser = etree.XMLParser(recover=True)
-context = etree.iterparse(input_file, events=('end',), tag='{http://www.loc.gov/MARC21/slim}record', recover=True)  # ou sem namespace se não tiver
-
-for event, element in context:
-  # Converte o <record> pra string
-  record_str = etree.tostring(element, encoding='unicode', pretty_print=True)
-  # Adiciona ao chunk atual
-  current_records.append(record_str)
-  # Limpa o elemento pra economizar memória
-  element.clear()
-
-  if records_size <= records_limits:
-    # Escreve o chunk
-        output_file = f"/workspace/outputs/{output_prefix}{chunk_num:03d}.xml"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(header)
-            f.writelines(current_records)
-            f.write(footer)
-        print(f"Chunk {chunk_num} salvo: {output_file} (com um total de {records_size} registros)")
 
+# Alternativa a records_limits: número fixo de chunks com a mesma
+# quantidade de registros (None = chunks de records_limits)
+num_chunks = None
+
+# Compressão dos chunks: None, "gzip" ou "zstd" (a entrada pode ser .gz/.zst)
+compression = None
+
+# Rodapé usado se o arquivo original não tiver nada depois do último </record>
+footer = b'</collection>\n'
+
+if compression_from_path(input_file) is not None:
+    # Arquivo comprimido não tem índice: chunks em uma leitura sequencial.
+    resumo = processar_dump(
+        input_file,
+        output_dir,
+        nome_parte=output_prefix + "{:03d}.xml",
+        max_bytes=None,
+        max_registros=records_limits,
+        compressao=compression,
+        primeira_parte=chunk_num,
+        limpar=False,
+        manifesto=None,
+    )
+    for parte in resumo["partes"]:
+        print(f"Chunk {chunk_num} salvo: {parte['arquivo']} (com um total de {parte['registros']} registros)")
         chunk_num += 1
-        current_records = []
-        records_size +=1
-
-# Último chunk se sobrar
-if current_records:
-    output_file = f"/workspace/outputs/{output_prefix}{chunk_num:03d}.xml"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(header)
-        f.writelines(current_records)
-        f.write(footer)
-    print(f"Último chunk salvo: {output_file}")
\ No newline at end of file
+    sys.exit()
+
+# Índice dos <record> (final_output_file.xml.idx.npz): cada chunk é uma
+# cópia direta dos bytes dos seus registros, sem reparsear o XML.
+index = get_index(input_file)
+
+if num_chunks:
+    grupos = index.split_into(num_chunks, by="records")
+else:
+    grupos = index.split_by_count(records_limits)
+
+output_files = [
+    f"{output_dir}/{output_prefix}{chunk_num + i:03d}.xml{COMPRESSION_EXTENSIONS[compression]}"
+    for i in range(len(grupos))
+]
+
+# Cabeçalho e rodapé originais (declaração XML e <collection> com o namespace)
+# em cada chunk; vários chunks ao mesmo tempo se a saída estiver em outro disco.
+gravar_partes(
+    index,
+    grupos,
+    output_files,
+    compression,
+    escritores_para(input_file, output_dir, len(grupos)),
+    rodape=footer,
+)
+
+for output_file, (primeiro, fim) in zip(output_files, grupos):
+    print(f"Chunk {chunk_num} salvo: {output_file} (com um total de {fim - primeiro} registros)")
+
+    chunk_num += 1
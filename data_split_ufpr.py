@@ -1,30 +1,30 @@
 # Code to separate a large XML file into smaller chunks of approximately 5 GB each, based on the size of the records. 
 # Each chunk will be saved as a separate XML file with a proper header and footer. 
-# The script uses the lxml library to parse the XML efficiently and manage memory usage.
+# The script uses the record boundary index (record_index.py) to copy whole records
+# straight from the source bytes, without reparsing the XML.
 
-from lxml import etree
-import pandas as pd
 import os
 import sys
 from pathlib import Path
 
+from dataset_writer import COMPRESSION_EXTENSIONS, XML_EXTENSIONS, compression_from_path
+from pipeline_xml import processar_dump
+from record_index import get_index
+from split_xml import escritores_para, gravar_partes, grupos_por_tamanho
+
 # Configurations
 
 input_folder = "/workspace/inputs_ufpr"  # Folder containing the large XML files
 #input_file = r"P:\Artigos\Nova pasta\codigo\marc.xml"  # Path to the large XML file
 output_prefix = 'marc_chunk_'
 target_size_bytes = 2 * (1024**3) # 2 GB
-current_size = 0
 chunk_num = 1
-current_records = []
 
+# Compression of the chunks: None, "gzip" or "zstd" (inputs may be .xml.gz / .xml.zst)
+compression = None
 
 # Create the directory
-try:
-    out_put_folder_path = Path("/workspace/marc_chunks") # Folder to save the chunked XML files
-    print(f"Directory '{out_put_folder_path}' created successfully.")
-except FileExistsError:
-    print(f"Directory '{out_put_folder_path}' already exists.")    
+out_put_folder_path = Path("/workspace/marc_chunks") # Folder to save the chunked XML files
 try:
     out_put_folder_path.mkdir()
     print(f"Directory '{out_put_folder_path}' created successfully.")
@@ -33,48 +33,57 @@ except FileExistsError:
 
 
 directory_path = Path(input_folder) # Use the Path class to handle the directory path
-# Use a list comprehension to filter only files and get their names
-file_names = [file.name for file in directory_path.iterdir() if file.is_file()]
+# Use a list comprehension to filter only the XML files (.xml/.xml.gz/.xml.zst) and get their
+# names, skipping sidecars such as the .idx.npz index and the .strata.npz counts of sampling.py
+file_names = [
+    file.name for file in directory_path.iterdir()
+    if file.is_file() and file.name.lower().endswith(XML_EXTENSIONS)
+]
 
 for file_name in file_names:
     input_file = directory_path / file_name
 
-    # Cabeçalho XML básico (ajuste se o seu arquivo tiver namespace específico)
-    header = '<collection>'
-    footer = '</collection>'
-    parser = etree.XMLParser(recover=True) # Create an XML parser that can recover from errors
-    # Passando recover=True diretamente para o iterparse
-    context = etree.iterparse(str(input_file), events=('end',), tag='record', recover=True)
+    # Compressed inputs cannot be indexed: split them in one sequential pass
+    if compression_from_path(file_name) is not None:
+        resumo = processar_dump(
+            str(input_file),
+            str(out_put_folder_path),
+            nome_parte=output_prefix + "{:03d}.xml",
+            max_bytes=target_size_bytes,
+            max_registros=None,
+            compressao=compression,
+            primeira_parte=chunk_num,
+            limpar=False,
+            manifesto=None,
+        )
+        for parte in resumo["partes"]:
+            print(f"Chunk {chunk_num} salvo: {parte['arquivo']} (~{parte['bytes'] / (1024**3):.2f} GB)")
+            chunk_num += 1
+        continue
+
+    # Offsets of every <record> (built once, then reused from file.xml.idx.npz)
+    index = get_index(str(input_file))
 
-    for event, element in context:
-        # Converte o <record> pra string
-        record_str = etree.tostring(element, encoding='unicode', pretty_print=True)
-        # Adiciona ao chunk atual
-        current_records.append(record_str)
-        # Estima tamanho (aprox, em bytes)
-        current_size += len(record_str.encode('utf-8'))
-        # Limpa o elemento pra economizar memória
-        element.clear()
+    # Groups of consecutive records with ~target_size_bytes each (header and footer included)
+    grupos = grupos_por_tamanho(index, target_size_bytes, rodape=b'</collection>')
+    output_files = [
+        str(out_put_folder_path / f"{output_prefix}{chunk_num + i:03d}.xml{COMPRESSION_EXTENSIONS[compression]}")
+        for i in range(len(grupos))
+    ]
 
-        if current_size >= target_size_bytes:
-            # Escreve o chunk
-                output_file = out_put_folder_path / f"{output_prefix}{chunk_num:03d}.xml"
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(header)
-                    f.writelines(current_records)
-                    f.write(footer)
-                print(f"Chunk {chunk_num} salvo: {output_file} (~{current_size / (1024**3):.2f} GB)")
+    # Original header/footer (so the namespace of <collection> is kept) around
+    # the raw bytes of each group; several chunks at once if the output folder
+    # is on another device
+    sizes = gravar_partes(
+        index,
+        grupos,
+        output_files,
+        compression,
+        escritores_para(str(input_file), str(out_put_folder_path), len(grupos)),
+        rodape=b'</collection>',
+    )
 
-                # Reseta os contadores para o próximo chunk
-                chunk_num += 1
-                current_records = []
-                current_size = 0
+    for output_file, current_size in zip(output_files, sizes):
+        print(f"Chunk {chunk_num} salvo: {output_file} (~{current_size / (1024**3):.2f} GB)")
 
-        # Último chunk se sobrar
-        if current_records:
-            output_file = out_put_folder_path / f"{output_prefix}{chunk_num:03d}.xml"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(header)
-                f.writelines(current_records)
-                f.write(footer)
-            print(f"Último chunk salvo: {output_file}")
\ No newline at end of file
+        chunk_num += 1
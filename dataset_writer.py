@@ -0,0 +1,630 @@
+"""
+Escrita do dataset de treino: JSONL único, shards JSONL (opcionalmente
+comprimidos) ou shards Arrow/Parquet.
+
+Em vez de um único train_dataset.jsonl de dezenas de GB, os exemplos
+podem ser distribuídos em arquivos limitados por número de registros
+e/ou por bytes (train-00000.jsonl.zst, train-00001.jsonl.zst, ...). Um
+index.json lista os shards com suas contagens, e os loaders (ex.: o
+load_dataset do train.py) podem ler os shards em paralelo.
+
+Todos os escritores recebem exemplos por write_example(line, meta, text):
+`line` é a linha JSONL já serializada ({"text": ...}), `meta` traz os
+campos estruturados (META_FIELDS), usados apenas pelos formatos
+colunares (needs_meta = True), e `text`, opcional, é o texto da linha
+quando quem chama já o tem, para os formatos colunares não precisarem
+desserializar `line`.
+"""
+
+import gzip
+import io
+import json
+import os
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+INDEX_FILENAME = "index.json"
+
+# Buffer do arquivo de saída (dados ainda não comprimidos).
+WRITE_BUFFER = 16 * 1024 * 1024
+
+# Quantas linhas acumular antes de cada write().
+BATCH_LINES = 1024
+
+COMPRESSION_EXTENSIONS = {
+    None: "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# Extensões de XML aceitas como entrada (sem compressão ou comprimido).
+XML_EXTENSIONS = tuple(".xml" + ext for ext in COMPRESSION_EXTENSIONS.values())
+
+# Linhas por RecordBatch nos formatos Arrow/Parquet.
+BATCH_ROWS = 8192
+
+# Colunas além de "text" nos formatos Arrow/Parquet.
+META_FIELDS = (
+    "source",
+    "record_id",
+    "full_title",
+    "author_prompt",
+    "year",
+    "edition",
+    "imprint",
+)
+
+
+# ============================================================
+# ABERTURA DOS ARQUIVOS
+# ============================================================
+
+def compression_from_path(path):
+    """Compressão indicada pela extensão: "gzip" (.gz), "zstd" (.zst) ou None."""
+
+    lower = path.lower()
+
+    for compression, ext in COMPRESSION_EXTENSIONS.items():
+        if ext and lower.endswith(ext):
+            return compression
+
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise ImportError(
+            "Compressão zstd requer o pacote 'zstandard' "
+            "(pip install zstandard)."
+        ) from exc
+
+    return zstandard
+
+
+def open_binary_writer(path, compression=None, level=None):
+    """
+    Abre `path` para escrita binária com a compressão pedida.
+
+    compression: None, "gzip" ou "zstd". O zstd usa todos os núcleos
+    disponíveis e exige o pacote `zstandard`.
+    """
+
+    if compression is None:
+        return open(path, "wb", buffering=WRITE_BUFFER)
+
+    if compression == "gzip":
+        raw = gzip.open(
+            path,
+            "wb",
+            compresslevel=6 if level is None else level,
+        )
+
+    elif compression == "zstd":
+        cctx = _zstandard().ZstdCompressor(
+            level=3 if level is None else level,
+            threads=-1,
+        )
+
+        raw = cctx.stream_writer(open(path, "wb"), closefd=True)
+
+    else:
+        raise ValueError(f"Compressão desconhecida: {compression}")
+
+    return io.BufferedWriter(raw, buffer_size=WRITE_BUFFER)
+
+
+def open_text_writer(path, compression=None, level=None):
+    """
+    Abre `path` para escrita de texto UTF-8 com a compressão pedida
+    (como open_binary_writer).
+    """
+
+    if compression is None:
+        return open(path, "w", encoding="utf-8", buffering=WRITE_BUFFER)
+
+    return io.TextIOWrapper(
+        open_binary_writer(path, compression, level),
+        encoding="utf-8",
+    )
+
+
+def open_binary_reader(path, fileobj=None):
+    """
+    Abre para leitura binária um arquivo .gz, .zst ou sem compressão.
+
+    `fileobj` (o próprio `path` já aberto em "rb") permite acompanhar
+    quantos bytes comprimidos já foram lidos, com fileobj.tell().
+    """
+
+    compression = compression_from_path(path)
+
+    if compression == "gzip":
+        if fileobj is not None:
+            return gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+        return gzip.open(path, "rb")
+
+    if compression == "zstd":
+        # read_across_frames: arquivos com vários frames concatenados
+        # (ex.: partes comprimidas separadamente e unidas com cat).
+        return _zstandard().ZstdDecompressor().stream_reader(
+            fileobj if fileobj is not None else open(path, "rb"),
+            closefd=fileobj is None,
+            read_across_frames=True,
+        )
+
+    return fileobj if fileobj is not None else open(path, "rb")
+
+
+def open_text_reader(path):
+    """Abre para leitura de texto UTF-8 um arquivo .gz, .zst ou plano."""
+
+    return io.TextIOWrapper(
+        io.BufferedReader(open_binary_reader(path), buffer_size=WRITE_BUFFER),
+        encoding="utf-8",
+    )
+
+
+# ============================================================
+# AUXILIARES
+# ============================================================
+
+def clear_shards(output_dir, prefix):
+    """Cria output_dir e remove shards e índice de uma execução anterior."""
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    for filename in os.listdir(output_dir):
+        if filename == INDEX_FILENAME or filename.startswith(f"{prefix}-"):
+            os.remove(os.path.join(output_dir, filename))
+
+
+def write_index(output_dir, index):
+    """Grava o index.json de forma atômica (tmp + rename)."""
+
+    tmp_path = os.path.join(output_dir, INDEX_FILENAME + ".tmp")
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+
+    os.replace(tmp_path, os.path.join(output_dir, INDEX_FILENAME))
+
+
+# ============================================================
+# JSONL ÚNICO
+# ============================================================
+
+class JsonlWriter:
+    """Um único arquivo JSONL, escrito com buffer grande."""
+
+    needs_meta = False
+
+    def __init__(self, path):
+        self._file = open(
+            path,
+            "w",
+            encoding="utf-8",
+            buffering=WRITE_BUFFER,
+        )
+
+    def write(self, line):
+        self._file.write(line)
+
+    def write_example(self, line, meta=None, text=None):
+        self._file.write(line)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ============================================================
+# ESCRITOR EM SHARDS
+# ============================================================
+
+class ShardedJsonlWriter:
+    """
+    Escreve linhas JSONL em shards limitados por registros/bytes.
+
+    max_records e max_bytes podem ser usados juntos; o shard é
+    fechado quando qualquer um é atingido. O tamanho é medido em
+    caracteres antes da compressão (≈ bytes, sem custo de encode).
+    Ao fechar o escritor, o index.json é gravado em output_dir.
+    """
+
+    needs_meta = False
+    formato = "jsonl"
+
+    def __init__(
+        self,
+        output_dir,
+        prefix="train",
+        max_records=None,
+        max_bytes=None,
+        compression=None,
+        level=None,
+    ):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Compressão desconhecida: {compression}")
+
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.level = level
+
+        self.shards = []
+        self._file = None
+        self._pending = []
+        self._records = 0
+        self._bytes = 0
+
+        clear_shards(output_dir, prefix)
+
+    # --------------------------------------------------------
+    # Interface de arquivo
+    # --------------------------------------------------------
+
+    def write(self, line):
+        """Recebe uma linha JSONL completa, terminada em "\\n"."""
+
+        if self._file is None:
+            self._open_shard()
+
+        self._pending.append(line)
+        self._records += 1
+
+        # Conta caracteres: barato e suficiente para limitar o shard.
+        self._bytes += len(line)
+
+        if len(self._pending) >= BATCH_LINES:
+            self._flush_pending()
+
+        if (
+            (self.max_records and self._records >= self.max_records)
+            or (self.max_bytes and self._bytes >= self.max_bytes)
+        ):
+            self._close_shard()
+
+    def write_example(self, line, meta=None, text=None):
+        self.write(line)
+
+    def write_items(self, items):
+        """Serializa e escreve vários exemplos (dicts) de uma vez."""
+
+        for item in items:
+            self.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def close(self):
+        """Fecha o shard atual e grava o index.json."""
+
+        self._close_shard()
+
+        write_index(
+            self.output_dir,
+            {
+                "formato": self.formato,
+                "compressao": self.compression,
+                "total_records": sum(s["records"] for s in self.shards),
+                "shards": self.shards,
+            },
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --------------------------------------------------------
+    # Shards
+    # --------------------------------------------------------
+
+    def _shard_name(self):
+        ext = COMPRESSION_EXTENSIONS[self.compression]
+        return f"{self.prefix}-{len(self.shards):05d}.jsonl{ext}"
+
+    def _open_shard(self):
+        self._name = self._shard_name()
+        self._file = open_text_writer(
+            os.path.join(self.output_dir, self._name),
+            self.compression,
+            self.level,
+        )
+        self._records = 0
+        self._bytes = 0
+
+    def _flush_pending(self):
+        self._file.write("".join(self._pending))
+        self._pending = []
+
+    def _close_shard(self):
+
+        if self._file is None:
+            return
+
+        self._flush_pending()
+        self._file.close()
+        self._file = None
+
+        self.shards.append(
+            {
+                "arquivo": self._name,
+                "records": self._records,
+                "chars": self._bytes,
+            }
+        )
+
+
+class CompactJsonlWriter(ShardedJsonlWriter):
+    """
+    Shards JSONL no formato compacto: cada linha guarda só o ID do
+    template e os campos variáveis do exemplo (o `meta`), sem o texto
+    fixo do prompt. O texto é montado por prompt_template.render_example.
+    """
+
+    needs_meta = True
+    formato = "compact"
+
+    def write_example(self, line, meta=None, text=None):
+        self.write(json.dumps(meta, ensure_ascii=False) + "\n")
+
+
+# ============================================================
+# ARROW / PARQUET
+# ============================================================
+
+class ArrowDatasetWriter:
+    """
+    Escreve os exemplos em shards colunares com schema fixo:
+    text + META_FIELDS, todas as colunas string.
+
+    fmt="arrow" grava Arrow IPC em formato stream, o mesmo do cache
+    do `datasets`: o train.py abre os shards com Dataset.from_file
+    (memory-map, sem conversão). fmt="parquet" gera arquivos menores
+    (compressão zstd por padrão), convertidos pelo load_dataset.
+    """
+
+    needs_meta = True
+
+    def __init__(
+        self,
+        output_dir,
+        prefix="train",
+        fmt="arrow",
+        max_records=None,
+        compression="zstd",
+    ):
+        try:
+            import pyarrow
+        except ImportError as exc:
+            raise ImportError(
+                "Saída Arrow/Parquet requer o pacote 'pyarrow'."
+            ) from exc
+
+        if fmt not in ("arrow", "parquet"):
+            raise ValueError(f"Formato desconhecido: {fmt}")
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema(
+            [("text", pyarrow.string())]
+            + [(name, pyarrow.string()) for name in META_FIELDS]
+        )
+
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.fmt = fmt
+        self.max_records = max_records
+        self.compression = compression
+
+        self.shards = []
+        self._writer = None
+        self._columns = None
+        self._records = 0
+
+        clear_shards(output_dir, prefix)
+
+    def write_example(self, line, meta=None, text=None):
+        """
+        Acrescenta um exemplo. Sem `text`, ele é lido de `line`
+        (ex.: linhas que voltam das partes gravadas em disco).
+        """
+
+        if text is None:
+            text = json.loads(line)["text"]
+
+        self.write_text(text, meta)
+
+    def write_items(self, items):
+        """Escreve vários exemplos (dicts com "text" e META_FIELDS) de uma vez."""
+
+        for item in items:
+            self.write_text(item["text"], item)
+
+    def write_text(self, text, meta=None):
+
+        if self._writer is None:
+            self._open_shard()
+
+        meta = meta or {}
+
+        self._columns["text"].append(text)
+
+        for name in META_FIELDS:
+            self._columns[name].append(meta.get(name, "") or "")
+
+        self._records += 1
+
+        if len(self._columns["text"]) >= BATCH_ROWS:
+            self._flush_batch()
+
+        if self.max_records and self._records >= self.max_records:
+            self._close_shard()
+
+    def close(self):
+
+        self._close_shard()
+
+        write_index(
+            self.output_dir,
+            {
+                "formato": self.fmt,
+                "compressao": self.compression if self.fmt == "parquet" else None,
+                "colunas": self.schema.names,
+                "total_records": sum(s["records"] for s in self.shards),
+                "shards": self.shards,
+            },
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _empty_columns(self):
+        return {name: [] for name in self.schema.names}
+
+    def _open_shard(self):
+
+        self._name = f"{self.prefix}-{len(self.shards):05d}.{self.fmt}"
+        path = os.path.join(self.output_dir, self._name)
+
+        if self.fmt == "parquet":
+            import pyarrow.parquet
+
+            self._writer = pyarrow.parquet.ParquetWriter(
+                path,
+                self.schema,
+                compression=self.compression or "none",
+            )
+
+        else:
+            self._sink = self.pa.OSFile(path, "wb")
+            self._writer = self.pa.ipc.new_stream(self._sink, self.schema)
+
+        self._columns = self._empty_columns()
+        self._records = 0
+
+    def _flush_batch(self):
+
+        if not self._columns["text"]:
+            return
+
+        batch = self.pa.record_batch(
+            [self.pa.array(self._columns[name], self.pa.string()) for name in self.schema.names],
+            schema=self.schema,
+        )
+
+        self._writer.write_batch(batch)
+        self._columns = self._empty_columns()
+
+    def _close_shard(self):
+
+        if self._writer is None:
+            return
+
+        self._flush_batch()
+        self._writer.close()
+
+        if self.fmt == "arrow":
+            self._sink.close()
+
+        self._writer = None
+
+        self.shards.append(
+            {
+                "arquivo": self._name,
+                "records": self._records,
+            }
+        )
+
+
+# ============================================================
+# LEITURA DO ÍNDICE
+# ============================================================
+
+def read_index(path):
+    """
+    Lê o index.json de um dataset em shards.
+
+    `path` pode ser o diretório dos shards ou o próprio index.json.
+    Retorna (index, lista de caminhos dos shards).
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, INDEX_FILENAME)
+
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+
+    base = os.path.dirname(path)
+
+    return index, [
+        os.path.join(base, shard["arquivo"])
+        for shard in index["shards"]
+    ]
+
+
+# ============================================================
+# LEITURA DO DATASET PREPARADO
+# ============================================================
+
+def dataset_files(path):
+    """
+    Arquivos de dados de um dataset preparado: o próprio JSONL ou os
+    shards listados no index.json do diretório.
+    """
+
+    if os.path.isdir(path):
+        return read_index(path)[1]
+
+    return [path]
+
+
+def load_prepared_dataset(path):
+    """
+    Carrega com a biblioteca datasets a saída do preparation.py:
+    JSONL único ou diretório de shards (jsonl, compact, arrow, parquet).
+
+    Retorna (dataset, formatting_func). formatting_func é None quando
+    os exemplos já têm a coluna "text"; no formato "compact" é o
+    prompt_template.render_example, que monta o texto sob demanda.
+    """
+
+    from datasets import Dataset, concatenate_datasets, load_dataset
+
+    if not os.path.isdir(path):
+        return load_dataset("json", data_files=path, split="train"), None
+
+    index, data_files = read_index(path)
+    formatting_func = None
+
+    if index["formato"] == "compact":
+        from prompt_template import render_example
+
+        formatting_func = render_example
+
+    if index["formato"] == "arrow":
+        # Shards Arrow IPC já estão no formato do cache: memory-map direto.
+        print(f"Dataset em {len(data_files)} shard(s) Arrow (memory-map)")
+        dataset = concatenate_datasets([Dataset.from_file(f) for f in data_files])
+    else:
+        # JSONL/Parquet são convertidos para Arrow em paralelo, um processo por arquivo.
+        num_proc = max(1, min(os.cpu_count() or 1, len(data_files)))
+        print(f"Dataset em {len(data_files)} shard(s), lendo com {num_proc} processo(s)")
+        builder = "parquet" if index["formato"] == "parquet" else "json"
+        dataset = load_dataset(builder, data_files=data_files, split="train", num_proc=num_proc)
+
+    return dataset, formatting_func
@@ -0,0 +1,318 @@
+"""
+Eliminação de registros duplicados durante a preparação.
+
+Os exports da LC e da UFPR se sobrepõem: a mesma obra aparece em
+vários catálogos e em reimpressões. Cada registro é reduzido aos campos
+que identificam a obra (245, 100 e 260/264), normalizados (sem acentos,
+pontuação ou diferença de caixa), e:
+
+- modo "exact": registros com o mesmo texto normalizado (hash de 64
+  bits) são descartados depois do primeiro;
+- modo "minhash": além disso, registros quase iguais (ex.: só a data
+  ou a editora mudam) são descartados por MinHash + LSH. As chaves
+  ficam em um filtro de Bloom de tamanho fixo, então a memória
+  não cresce com o número de registros (ao custo de uma pequena taxa
+  de falsos positivos, controlada pelo tamanho do filtro).
+
+Registros sem nenhum desses campos (texto normalizado vazio) não têm
+como ser comparados e nunca são descartados.
+
+O hash e as bandas são calculados nos processos de extração
+(dedup_meta); a decisão fica com Deduplicator, na concatenação das
+partes, sempre na mesma ordem, então o resultado é reproduzível.
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Subcampos usados de cada campo na chave da obra.
+DEDUP_FIELDS = (
+    ("245", "abnpc"),
+    ("100", "a"),
+    ("260", "abc"),
+)
+
+# 264 substitui o 260 quando este não existe (registros RDA).
+FALLBACK_FIELDS = {
+    "260": "264",
+}
+
+# MinHash: permutações, bandas do LSH (linhas por banda =
+# MINHASH_PERMS / MINHASH_BANDS) e tamanho dos shingles de caracteres.
+# Com 64 permutações em 8 bandas de 8 linhas, pares com similaridade
+# de Jaccard acima de ~0,77 tendem a cair em uma mesma banda.
+MINHASH_PERMS = 64
+MINHASH_BANDS = 8
+SHINGLE_SIZE = 5
+MINHASH_SEED = 42
+
+# Funções de hash do filtro de Bloom por chave de banda.
+BLOOM_HASHES = 7
+
+# Campos de dedup_meta, removidos do meta antes da saída.
+DEDUP_META_FIELDS = ("dedup_key", "dedup_bands")
+
+_NAO_ALFANUMERICO = re.compile(r"[\W_]+")
+
+
+# ============================================================
+# CHAVES (PROCESSOS DE EXTRAÇÃO)
+# ============================================================
+
+def normalize_text(text):
+    """Minúsculas, sem acentos e só com letras/dígitos separados por espaço."""
+
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+
+    return " ".join(_NAO_ALFANUMERICO.sub(" ", text.lower()).split())
+
+
+def dedup_text(record):
+    """
+    Texto normalizado que identifica a obra: 245, 100 e 260 (ou 264),
+    separados por "|". Funciona com pymarc.Record e LiteRecord.
+    """
+
+    partes = []
+
+    for tag, codes in DEDUP_FIELDS:
+        field = record.get(tag)
+
+        if field is None and tag in FALLBACK_FIELDS:
+            field = record.get(FALLBACK_FIELDS[tag])
+
+        valores = []
+
+        if field is not None:
+            for code in codes:
+                value = field.get(code)
+
+                if value:
+                    valores.append(value)
+
+        partes.append(normalize_text(" ".join(valores)))
+
+    return "|".join(partes)
+
+
+def exact_key(text):
+    """Hash de 64 bits (hex) do texto normalizado."""
+
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _permutations():
+    rng = np.random.default_rng(MINHASH_SEED)
+
+    a = rng.integers(0, 1 << 64, size=MINHASH_PERMS, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 64, size=MINHASH_PERMS, dtype=np.uint64)
+
+    return a, b
+
+
+_PERM_A, _PERM_B = _permutations()
+
+
+def minhash_signature(text):
+    """Assinatura MinHash (MINHASH_PERMS valores) dos shingles do texto."""
+
+    text = text.replace("|", " ")
+
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {
+            text[i:i + SHINGLE_SIZE]
+            for i in range(len(text) - SHINGLE_SIZE + 1)
+        }
+
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+    # Multiply-shift para todas as permutações de uma vez: os 32 bits
+    # altos de (a * x + b) mod 2^64 (o uint64 já dá a volta sozinho).
+    valores = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+
+    return valores.min(axis=1)
+
+
+def minhash_bands(text):
+    """Chaves (inteiros de 64 bits) de cada banda LSH da assinatura."""
+
+    bandas = minhash_signature(text).reshape(MINHASH_BANDS, -1)
+
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                i.to_bytes(2, "little") + banda.tobytes(),
+                digest_size=8,
+            ).digest(),
+            "little",
+        )
+        for i, banda in enumerate(bandas)
+    ]
+
+
+def dedup_meta(record, mode):
+    """
+    Campos de deduplicação gravados no .meta.jsonl de cada registro:
+    "dedup_key" sempre e "dedup_bands" no modo "minhash".
+
+    Sem 245, 100 e 260/264 o texto fica vazio e todos esses registros
+    teriam a mesma chave: dedup_key é None e o registro é mantido.
+    """
+
+    text = dedup_text(record)
+
+    if not text.replace("|", ""):
+        return {"dedup_key": None}
+
+    meta = {"dedup_key": exact_key(text)}
+
+    if mode == "minhash":
+        meta["dedup_bands"] = minhash_bands(text)
+
+    return meta
+
+
+# ============================================================
+# FILTRO DE BLOOM
+# ============================================================
+
+class BloomFilter:
+    """Filtro de Bloom de `size_bytes` bytes para inteiros de 64 bits."""
+
+    def __init__(self, size_bytes, num_hashes=BLOOM_HASHES):
+        self.bits = bytearray(size_bytes)
+        self.num_bits = size_bytes * 8
+        self.num_hashes = num_hashes
+
+    def _positions(self, key):
+        # Hashing duplo: as k posições saem das duas metades da chave.
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+
+        return [
+            (h1 + i * h2) % self.num_bits
+            for i in range(self.num_hashes)
+        ]
+
+    def __contains__(self, key):
+        bits = self.bits
+
+        return all(
+            bits[p >> 3] & (1 << (p & 7))
+            for p in self._positions(key)
+        )
+
+    def add(self, key):
+        bits = self.bits
+
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+
+
+# ============================================================
+# DECISÃO (CONCATENAÇÃO DAS PARTES)
+# ============================================================
+
+class Deduplicator:
+    """
+    Decide, na ordem da saída, quais registros são duplicatas.
+
+    check(meta) devolve None para registros novos ou o motivo do
+    descarte ("exata" ou "quase"). Os descartes são contados em
+    `dropped` e, com report_path, listados em um JSONL (origem, 001,
+    motivo e título).
+
+    O modo "exact" guarda um inteiro por registro único (~50 bytes);
+    o modo "minhash" guarda tudo (chaves exatas e bandas) só no filtro
+    de Bloom de lsh_memory_mb, com memória fixa.
+    """
+
+    def __init__(self, mode, report_path=None, lsh_memory_mb=256):
+        if mode not in ("exact", "minhash"):
+            raise ValueError(f"Modo de deduplicação desconhecido: {mode!r}")
+
+        self.mode = mode
+
+        if mode == "minhash":
+            # Chaves exatas e de bandas dividem o mesmo filtro.
+            self.lsh = BloomFilter(lsh_memory_mb * 1024 ** 2)
+            self.seen = self.lsh
+        else:
+            self.lsh = None
+            self.seen = set()
+
+        self.dropped = {"exata": 0, "quase": 0}
+        self.report = (
+            open(report_path, "w", encoding="utf-8")
+            if report_path
+            else None
+        )
+
+    def check(self, meta):
+        if meta["dedup_key"] is None:
+            return None
+
+        key = int(meta["dedup_key"], 16)
+
+        if key in self.seen:
+            return self._drop(meta, "exata")
+
+        if self.lsh is not None:
+            bands = meta["dedup_bands"]
+
+            if any(band in self.lsh for band in bands):
+                return self._drop(meta, "quase")
+
+            for band in bands:
+                self.lsh.add(band)
+
+        self.seen.add(key)
+
+        return None
+
+    def _drop(self, meta, motivo):
+        self.dropped[motivo] += 1
+
+        if self.report is not None:
+            self.report.write(
+                json.dumps(
+                    {
+                        "source": meta.get("source"),
+                        "record_id": meta.get("record_id"),
+                        "motivo": motivo,
+                        "full_title": meta.get("full_title"),
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+        return motivo
+
+    def close(self):
+        if self.report is not None:
+            self.report.close()
+            self.report = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
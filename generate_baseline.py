@@ -1,37 +1,14 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from model_client import SERVER_URL, generate
 
 # =====================================================
-# CONFIGURAÇÕES DE CAMINHO
+# SERVIDOR DO MODELO
 # =====================================================
-MODEL_NAME = "mistralai/Mistral-7B-v0.1"
-
-print("Iniciando o carregamento do Mistral PURO (Baseline)...")
+# O Mistral PURO (Baseline) é o modelo do model_server.py com o
+# adaptador LoRA desligado durante a geração (adapter=False).
+print(f"Usando o servidor do modelo em {SERVER_URL} (Baseline, sem adaptador)\n")
 
 # =====================================================
-# 1. CARREGAR O MODELO BASE (Sem o adaptador LoRA)
-# =====================================================
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True,
-)
-
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    quantization_config=bnb_config,
-    device_map="auto",
-)
-
-# ATENÇÃO: O tokenizer agora vem do modelo original, não da sua pasta outputs
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model.eval() 
-
-print("✅ Modelo puro carregado com sucesso!\n")
-
-# =====================================================
-# 2. DADOS DO LIVRO PARA TESTE
+# 1. DADOS DO LIVRO PARA TESTE
 # =====================================================
 titulo_teste = "Adaptive filter: theory and applications"
 autor_teste = "Farhang-Boroujeny, B"
@@ -40,7 +17,7 @@ edicao_teste = ""
 imprenta_teste = " Chichester: J. Wiley"
 
 # =====================================================
-# 3. CONSTRUÇÃO DO PROMPT
+# 2. CONSTRUÇÃO DO PROMPT
 # =====================================================
 prompt = f"""<|im_start|>user
 Você é um catalogador profissional do SiBi/UFPR e deve seguir **rigorosamente** o Manual de Catalogação do SiBi/UFPR versão 2025.
@@ -82,24 +59,18 @@ Responda **APENAS** com o registro MARC completo (todos os campos necessários,
 """
 
 # =====================================================
-# 4. GERAÇÃO DO REGISTRO
+# 3. GERAÇÃO DO REGISTRO
 # =====================================================
 print(f"📚 Baseline tentando catalogar a obra: {titulo_teste}\n")
 print("-" * 60)
 
-inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
-
-with torch.no_grad():
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=512, 
-        temperature=0.1,    
-        top_p=0.9,
-        do_sample=True,
-        eos_token_id=tokenizer.eos_token_id
-    )
-
-resposta = tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+resposta = generate(
+    [prompt],
+    adapter=False,
+    max_new_tokens=512, 
+    temperature=0.1,    
+    top_p=0.9,
+    do_sample=True,
+)[0]
 
-print(resposta.strip())
-print("-" * 60)
\ No newline at end of file
+print(resposta.strip())
\ No newline at end of file
@@ -1,43 +1,20 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
+from model_client import SERVER_URL, generate, health
 
 # =====================================================
-# CONFIGURAÇÕES DE CAMINHO
+# SERVIDOR DO MODELO
 # =====================================================
-MODEL_NAME = "mistralai/Mistral-7B-v0.1"
-ADAPTER_PATH = "./outputs"  # A pasta onde o seu modelo treinado foi salvo
+# O Mistral-7B com o adaptador (ADAPTER_PATH) fica carregado no
+# model_server.py; este script só envia o prompt:
+#   python model_server.py   (em outro terminal, uma vez)
+print(f"Usando o servidor do modelo em {SERVER_URL}\n")
 
-print("Iniciando o carregamento do modelo (Isso pode levar um minuto)...")
+# Geração especulativa: "prompt_lookup" (rascunho copiado do próprio
+# prompt), "draft" (modelo pequeno, DRAFT_MODEL no servidor) ou None
+# (o padrão do servidor).
+GERACAO_ESPECULATIVA = None
 
 # =====================================================
-# 1. CARREGAR O MODELO BASE EM 4-BIT (Obrigatório no QLoRA)
-# =====================================================
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True,
-)
-
-base_model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    quantization_config=bnb_config,
-    device_map="auto",
-)
-
-tokenizer = AutoTokenizer.from_pretrained(ADAPTER_PATH)
-
-# =====================================================
-# 2. ACOPLAR O ADAPTADOR TREINADO (O Conhecimento MARC)
-# =====================================================
-model = PeftModel.from_pretrained(base_model, ADAPTER_PATH)
-model.eval() # Coloca o modelo em modo de inferência (desliga o cálculo de gradientes)
-
-print("✅ Modelo carregado com sucesso!\n")
-
-# =====================================================
-# 3. DADOS DO LIVRO PARA TESTE
+# 1. DADOS DO LIVRO PARA TESTE
 # =====================================================
 # Altere estes dados para testar obras diferentes para o seu artigo
 titulo_teste = "Adaptive filter theory"
@@ -47,7 +24,7 @@ edicao_teste = "3rd ed."
 imprenta_teste = "Prentice Hall"
 
 # =====================================================
-# 4. CONSTRUÇÃO DO PROMPT EXATO DO TREINAMENTO
+# 2. CONSTRUÇÃO DO PROMPT EXATO DO TREINAMENTO
 # =====================================================
 prompt = f"""<|im_start|>user
 Você é um catalogador profissional do SiBi/UFPR e deve seguir **rigorosamente** o Manual de Catalogação do SiBi/UFPR versão 2025.
@@ -89,25 +66,29 @@ Responda **APENAS** com o registro MARC completo (todos os campos necessários,
 """
 
 # =====================================================
-# 5. GERAÇÃO DO REGISTRO
+# 3. GERAÇÃO DO REGISTRO
 # =====================================================
 print(f"📚 Catalogando a obra: {titulo_teste}\n")
 print("-" * 60)
 
-inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
+# A resposta já vem só com o texto gerado (sem o prompt de entrada).
+resposta = generate(
+    [prompt],
+    adapter=True,
+    max_new_tokens=512, # Limite de tamanho da resposta
+    temperature=0.1,    # Baixa temperatura = respostas mais determinísticas e precisas (ideal para catalogação)
+    top_p=0.9,
+    do_sample=True,
+    speculative=GERACAO_ESPECULATIVA,
+)[0]
+
+print(resposta.strip())
+print("-" * 60)
 
-with torch.no_grad():
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=512, # Limite de tamanho da resposta
-        temperature=0.1,    # Baixa temperatura = respostas mais determinísticas e precisas (ideal para catalogação)
-        top_p=0.9,
-        do_sample=True,
-        eos_token_id=tokenizer.eos_token_id
-    )
+# Taxa de aceitação do rascunho e velocidade (acumuladas no servidor).
+estado = health()
 
-# Decodifica apenas a resposta gerada pelo modelo, ignorando o prompt gigante de entrada
-resposta = tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+if estado.get("acceptance_rate") is not None:
+    print(f"🎯 Rascunho aceito: {estado['acceptance_rate']:.1%} ({estado['tokens_per_step']} tokens por forward)")
 
-print(resposta.strip())
-print("-" * 60)
\ No newline at end of file
+print(f"⚡ {estado['tokens_per_second']} tokens/s")
\ No newline at end of file
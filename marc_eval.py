@@ -0,0 +1,585 @@
+"""
+Avaliação offline do modelo de catalogação.
+
+compare.py e generate_baseline.py mostram um único registro. Aqui o
+modelo cataloga os exemplos de teste do dataset preparado (a mesma
+separação do train.py e do pretokenize.py, split_indices) e cada
+registro gerado é comparado com o de referência:
+
+- os registros (formato MARCMaker, como str(record)) viram tabelas numpy
+  com um campo por linha (registro, tag, hash do conteúdo normalizado);
+- precisão e revocação por tag contam os campos idênticos com operações
+  vetorizadas (np.unique / np.intersect1d / np.bincount): pontuar 100 mil
+  registros leva segundos. Os totais (field_*) deixam de fora os campos de
+  controle (001, 005, 008...), com números e datas da catalogação que o
+  modelo não tem como acertar; eles continuam na tabela por tag;
+- acerto exato dos campos 245, 100 e 260 (EXACT_TAGS) e sobreposição
+  dos assuntos 650 (precisão, revocação e Jaccard por registro).
+
+Para acompanhar regressões entre checkpoints do adaptador:
+
+- tudo o que depende dos exemplos de teste fica em EVAL_DIR/<assinatura>/,
+  onde a assinatura identifica o dataset, a separação e MAX_EXAMPLES: as
+  tabelas de referência (gold.npz), refeitas só se o dataset mudar, e as
+  respostas de cada checkpoint (<checkpoint>/predictions.jsonl), que usam
+  a posição do exemplo no dataset como id e por isso nunca são
+  reaproveitadas para outro dataset;
+- as respostas são gravadas lote a lote: uma avaliação interrompida
+  continua de onde parou e pontuar de novo um checkpoint já gerado não
+  carrega o modelo;
+- o modelo base é carregado uma vez e cada checkpoint entra como mais um
+  adaptador (load_adapter), sem recarregar os 7B;
+- cada resultado vai para EVAL_DIR/history.jsonl e é comparado com o
+  melhor checkpoint anterior; quedas maiores que REGRESSION_TOLERANCE
+  são apontadas.
+
+Uso: DATA_PATH=./train_dataset.jsonl python marc_eval.py [checkpoint ...]
+     (pastas de adaptador, ex.: outputs/checkpoint-500, ou "base" para o
+     modelo sem adaptador; sem argumentos, ADAPTER_PATH)
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from dataset_writer import load_prepared_dataset
+from pretokenize import SPLIT_SEED, TEST_SIZE, source_signature, split_indices
+from prompt_template import render_example
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Mesmo DATA_PATH do train.py: JSONL único ou diretório de shards.
+DATA_PATH = os.getenv("DATA_PATH", "./train_dataset.jsonl")
+EVAL_DIR = os.getenv("EVAL_DIR", "./eval")
+ADAPTER_PATH = os.getenv("ADAPTER_PATH", "./outputs")
+
+# Checkpoint que avalia o modelo sem adaptador.
+BASE_CHECKPOINT = "base"
+
+# Exemplos de teste avaliados (0 = todos). São sempre os primeiros da
+# separação de teste, os mesmos para todos os checkpoints.
+MAX_EXAMPLES = int(os.getenv("MAX_EXAMPLES", "0"))
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+
+# Geração determinística: diferenças entre checkpoints vêm dos pesos.
+GENERATION_CONFIG = {"do_sample": False}
+
+# Campos com acerto exato medido e campo de assuntos.
+EXACT_TAGS = ("245", "100", "260")
+SUBJECT_TAG = "650"
+# Subcampos que formam o cabeçalho de assunto (a -- x -- y -- z -- v).
+SUBJECT_CODES = "axyzv"
+
+# Métricas acompanhadas entre checkpoints e queda tolerada em cada uma.
+HEADLINE_METRICS = (
+    "parsed",
+    "field_precision",
+    "field_recall",
+    "field_f1",
+    *(f"exact_{tag}" for tag in EXACT_TAGS),
+    "subject_precision",
+    "subject_recall",
+    "subject_jaccard",
+)
+REGRESSION_TOLERANCE = 0.005
+
+# Muda quando a forma de pontuar muda (invalida as tabelas salvas).
+EVAL_VERSION = 2
+
+# Campos de controle (00X) ficam fora dos totais field_*.
+FIRST_DATA_TAG = 10
+
+HISTORY_FILENAME = "history.jsonl"
+
+RESPONSE_MARKER = "<|im_start|>assistant\n"
+RESPONSE_END = "<|im_end|>"
+
+
+# ============================================================
+# REGISTROS MARC
+# ============================================================
+
+_LINHA = re.compile(r"=(\d{3})  (.*)")
+
+# Indicador em branco: "\" no MARCMaker; o modelo às vezes usa " " ou "-".
+_INDICADOR_VAZIO = str.maketrans(" -#", "\\\\\\")
+
+_PONTUACAO_FINAL = " /:;,.="
+
+
+def normalize(texto):
+    """Valor comparável: espaços colapsados, sem pontuação final, casefold."""
+
+    return " ".join(texto.split()).rstrip(_PONTUACAO_FINAL).casefold()
+
+
+def parse_marc_text(texto):
+    """
+    Campos de um registro MARCMaker, sem o leader: (tag, indicadores,
+    [(código, valor), ...]). Campos de controle (00X) têm indicadores
+    "" e um único valor com código "". Linhas fora do formato são
+    ignoradas.
+    """
+
+    campos = []
+
+    for linha in texto.splitlines():
+        m = _LINHA.fullmatch(linha.rstrip())
+
+        if not m:
+            continue
+
+        tag, resto = m.groups()
+
+        if tag < "010":
+            campos.append((tag, "", [("", resto)]))
+            continue
+
+        indicadores = resto[:2].translate(_INDICADOR_VAZIO)
+        subcampos = [(s[0], s[1:]) for s in resto[2:].split("$")[1:] if s]
+
+        campos.append((tag, indicadores, subcampos))
+
+    return campos
+
+
+def _hash(texto):
+    """Hash estável de 64 bits (o mesmo em qualquer execução)."""
+
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+# ============================================================
+# TABELAS
+# ============================================================
+
+# Uma linha por campo (ou assunto): chave = registro * 1000 + tag para
+# os campos e chave = registro para os assuntos.
+ROW_DTYPE = np.dtype([("chave", "<i8"), ("hash", "<i8")])
+
+
+def marc_tables(textos):
+    """
+    Tabelas numpy de uma lista de registros MARCMaker:
+
+        campos   (chave, hash) de cada campo: indicadores + subcampos normalizados
+        assuntos (registro, hash) de cada cabeçalho 650
+        exatos   hash do primeiro campo de cada EXACT_TAGS por registro (0 = ausente)
+        legivel  registro com pelo menos um campo reconhecido
+    """
+
+    campos = []
+    assuntos = []
+    exatos = np.zeros((len(textos), len(EXACT_TAGS)), dtype=np.int64)
+    legivel = np.zeros(len(textos), dtype=bool)
+    coluna_exata = {tag: j for j, tag in enumerate(EXACT_TAGS)}
+
+    for i, texto in enumerate(textos):
+        registro = parse_marc_text(texto or "")
+        legivel[i] = bool(registro)
+
+        for tag, indicadores, subcampos in registro:
+            h = _hash(indicadores + "".join(f"${c}{normalize(v)}" for c, v in subcampos))
+            campos.append((i * 1000 + int(tag), h))
+
+            j = coluna_exata.get(tag)
+
+            if j is not None and not exatos[i, j]:
+                exatos[i, j] = h
+
+            if tag == SUBJECT_TAG:
+                cabecalho = " -- ".join(normalize(v) for c, v in subcampos if c in SUBJECT_CODES)
+
+                if cabecalho:
+                    assuntos.append((i, _hash(cabecalho)))
+
+    return {
+        "campos": np.array(campos, dtype=ROW_DTYPE),
+        "assuntos": np.array(assuntos, dtype=ROW_DTYPE),
+        "exatos": exatos,
+        "legivel": legivel,
+    }
+
+
+def _casados(referencia, gerado):
+    """
+    Linhas (chave, hash) presentes nas duas tabelas, contando repetições
+    (o mínimo das duas contagens). Retorna (chaves, quantidades).
+    """
+
+    ur, cr = np.unique(referencia, return_counts=True)
+    ug, cg = np.unique(gerado, return_counts=True)
+
+    comuns, ir, ig = np.intersect1d(ur, ug, assume_unique=True, return_indices=True)
+
+    return comuns["chave"], np.minimum(cr[ir], cg[ig])
+
+
+def _razao(a, b):
+    return round(float(a) / float(b), 4) if b else None
+
+
+# ============================================================
+# PONTUAÇÃO
+# ============================================================
+
+def score(gold, pred):
+    """
+    Métricas das respostas (pred) contra as referências (gold), tabelas
+    de marc_tables com os registros na mesma ordem. Os totais field_*
+    contam só os campos de dados (tag >= FIRST_DATA_TAG).
+    """
+
+    n = len(gold["legivel"])
+
+    # Campos por tag: um campo gerado acerta se há um campo idêntico
+    # (mesma tag, indicadores e subcampos) no registro de referência.
+    chaves, casados = _casados(gold["campos"], pred["campos"])
+
+    acertos = np.bincount(chaves % 1000, weights=casados, minlength=1000)
+    na_referencia = np.bincount(gold["campos"]["chave"] % 1000, minlength=1000)
+    gerados = np.bincount(pred["campos"]["chave"] % 1000, minlength=1000)
+
+    por_tag = {}
+    dados = slice(FIRST_DATA_TAG, None)
+
+    for tag in np.flatnonzero(na_referencia + gerados):
+        # F1 = 2 * acertos / (campos na referência + campos gerados).
+        por_tag[f"{tag:03d}"] = {
+            "gold": int(na_referencia[tag]),
+            "pred": int(gerados[tag]),
+            "matched": int(acertos[tag]),
+            "precision": _razao(acertos[tag], gerados[tag]),
+            "recall": _razao(acertos[tag], na_referencia[tag]),
+            "f1": _razao(2 * acertos[tag], na_referencia[tag] + gerados[tag]),
+        }
+
+    summary = {
+        "examples": n,
+        "parsed": _razao(pred["legivel"].sum(), n),
+        "field_precision": _razao(acertos[dados].sum(), gerados[dados].sum()),
+        "field_recall": _razao(acertos[dados].sum(), na_referencia[dados].sum()),
+        "field_f1": _razao(2 * acertos[dados].sum(), na_referencia[dados].sum() + gerados[dados].sum()),
+    }
+
+    # Acerto exato: entre os registros que têm o campo na referência.
+    tem = gold["exatos"] != 0
+    iguais = (gold["exatos"] == pred["exatos"]) & tem
+
+    for j, tag in enumerate(EXACT_TAGS):
+        summary[f"exact_{tag}"] = _razao(iguais[:, j].sum(), tem[:, j].sum())
+
+    # Assuntos 650: cabeçalhos em comum por registro.
+    registros, casados = _casados(gold["assuntos"], pred["assuntos"])
+
+    comuns = np.bincount(registros, weights=casados, minlength=n)
+    na_referencia = np.bincount(gold["assuntos"]["chave"], minlength=n)
+    gerados = np.bincount(pred["assuntos"]["chave"], minlength=n)
+
+    com_assunto = na_referencia > 0
+    jaccard = comuns[com_assunto] / (na_referencia + gerados - comuns)[com_assunto]
+
+    summary.update({
+        "subject_precision": _razao(comuns.sum(), gerados.sum()),
+        "subject_recall": _razao(comuns.sum(), na_referencia.sum()),
+        "subject_jaccard": round(float(jaccard.mean()), 4) if jaccard.size else None,
+    })
+
+    return {"summary": summary, "per_tag": por_tag}
+
+
+# ============================================================
+# EXEMPLOS DE TESTE
+# ============================================================
+
+def gold_signature(data_path=DATA_PATH, max_examples=MAX_EXAMPLES):
+    """Identifica o conjunto de referência: dataset, separação e tamanho."""
+
+    dados = {
+        "fonte": source_signature(data_path),
+        "test_size": TEST_SIZE,
+        "split_seed": SPLIT_SEED,
+        "max_examples": max_examples,
+        "versao": EVAL_VERSION,
+    }
+
+    return hashlib.sha256(json.dumps(dados, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def held_out_examples(data_path=DATA_PATH, max_examples=MAX_EXAMPLES):
+    """
+    (id, prompt, registro de referência) dos exemplos MARC da separação
+    de teste. O id é a posição do exemplo no dataset preparado.
+    """
+
+    dataset, _ = load_prepared_dataset(data_path)
+    teste = split_indices(len(dataset))["test"]
+
+    exemplos = []
+
+    for i, exemplo in zip(teste.tolist(), dataset.select(teste)):
+        texto = render_example(exemplo)
+        corte = texto.rfind(RESPONSE_MARKER)
+
+        if corte < 0:
+            continue
+
+        corte += len(RESPONSE_MARKER)
+        referencia = texto[corte:].rsplit(RESPONSE_END, 1)[0].strip()
+
+        # Exemplos de PDF (pdf-v1) não são registros.
+        if not referencia.startswith("=LDR"):
+            continue
+
+        exemplos.append((str(i), texto[:corte], referencia))
+
+        if max_examples and len(exemplos) >= max_examples:
+            break
+
+    return exemplos
+
+
+def load_gold(data_path=DATA_PATH, max_examples=MAX_EXAMPLES, eval_dir=EVAL_DIR):
+    """
+    (assinatura, ids, tabelas de referência, exemplos). As tabelas vêm
+    de EVAL_DIR/<assinatura>/gold.npz quando o dataset não mudou; nesse
+    caso os exemplos (prompts) são None e só são lidos se faltar gerar
+    alguma resposta.
+    """
+
+    assinatura = gold_signature(data_path, max_examples)
+    path = os.path.join(eval_dir, assinatura, "gold.npz")
+
+    if os.path.isfile(path):
+        with np.load(path) as dados:
+            tabelas = {nome: dados[nome] for nome in ("campos", "assuntos", "exatos", "legivel")}
+            return assinatura, dados["ids"].tolist(), tabelas, None
+
+    exemplos = held_out_examples(data_path, max_examples)
+    ids = [livro_id for livro_id, _, _ in exemplos]
+    tabelas = marc_tables([referencia for _, _, referencia in exemplos])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, ids=np.array(ids), **tabelas)
+
+    return assinatura, ids, tabelas, exemplos
+
+
+# ============================================================
+# RESPOSTAS DO MODELO
+# ============================================================
+
+def checkpoint_name(checkpoint):
+    """Nome do checkpoint nas pastas de EVAL_DIR e como nome de adaptador."""
+
+    if checkpoint == BASE_CHECKPOINT:
+        return BASE_CHECKPOINT
+
+    return re.sub(r"\W+", "_", os.path.normpath(checkpoint)).strip("_")
+
+
+def read_predictions(path):
+    """Respostas já gravadas (id -> registro). Uma última linha incompleta é ignorada."""
+
+    respostas = {}
+
+    if not os.path.isfile(path):
+        return respostas
+
+    with open(path, encoding="utf-8") as f:
+        for linha in f:
+            if not linha.endswith("\n"):
+                break
+
+            try:
+                dados = json.loads(linha)
+                respostas[str(dados["id"])] = dados["marc"]
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    return respostas
+
+
+def activate_checkpoint(model, checkpoint):
+    """
+    (modelo, adapter) para gerar com o checkpoint: o adaptador é
+    acoplado ao modelo base na primeira vez e ativado nas seguintes.
+    """
+
+    from peft import PeftModel
+
+    if checkpoint == BASE_CHECKPOINT:
+        return model, False
+
+    nome = checkpoint_name(checkpoint)
+
+    if not isinstance(model, PeftModel):
+        model = PeftModel.from_pretrained(model, checkpoint, adapter_name=nome)
+    elif nome not in model.peft_config:
+        model.load_adapter(checkpoint, adapter_name=nome)
+
+    model.set_adapter(nome)
+    model.eval()
+
+    return model, True
+
+
+def generate_predictions(exemplos, engine, adapter, path, batch_size=BATCH_SIZE):
+    """Gera e acrescenta em path as respostas dos exemplos que ainda não estão lá."""
+
+    from tqdm import tqdm
+
+    from batch_inference import length_buckets, load_done
+
+    feitos = load_done(path)
+    pendentes = [exemplo for exemplo in exemplos if exemplo[0] not in feitos]
+
+    if not pendentes:
+        return
+
+    ids = engine.encode([prompt for _, prompt, _ in pendentes])
+
+    with open(path, "a", encoding="utf-8") as out, tqdm(total=len(pendentes), desc="Gerando", unit=" registro") as pbar:
+        for lote in length_buckets([len(x) for x in ids], batch_size):
+            respostas = engine.generate_ids([ids[i] for i in lote], adapter)
+
+            for i, marc in zip(lote, respostas):
+                out.write(json.dumps({"id": pendentes[i][0], "marc": marc}, ensure_ascii=False) + "\n")
+
+            out.flush()
+            pbar.update(len(lote))
+
+
+# ============================================================
+# HISTÓRICO
+# ============================================================
+
+def read_history(eval_dir=EVAL_DIR):
+    path = os.path.join(eval_dir, HISTORY_FILENAME)
+
+    if not os.path.isfile(path):
+        return []
+
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+def record_history(entrada, eval_dir=EVAL_DIR):
+    """Grava o resultado no histórico, no lugar de um anterior do mesmo checkpoint e referência."""
+
+    historico = [
+        h for h in read_history(eval_dir)
+        if (h["checkpoint"], h["gold"]) != (entrada["checkpoint"], entrada["gold"])
+    ]
+    historico.append(entrada)
+
+    with open(os.path.join(eval_dir, HISTORY_FILENAME), "w", encoding="utf-8") as f:
+        for h in historico:
+            f.write(json.dumps(h, ensure_ascii=False) + "\n")
+
+
+def regressions(entrada, historico, tolerance=REGRESSION_TOLERANCE):
+    """
+    Métricas em que o checkpoint ficou abaixo do melhor checkpoint
+    anterior com a mesma referência: [(métrica, valor, melhor, checkpoint)].
+    """
+
+    anteriores = [
+        h for h in historico
+        if h["gold"] == entrada["gold"] and h["checkpoint"] != entrada["checkpoint"]
+    ]
+
+    quedas = []
+
+    for metrica in HEADLINE_METRICS:
+        valores = [(h[metrica], h["checkpoint"]) for h in anteriores if h.get(metrica) is not None]
+
+        if not valores or entrada.get(metrica) is None:
+            continue
+
+        melhor, checkpoint = max(valores)
+
+        if entrada[metrica] < melhor - tolerance:
+            quedas.append((metrica, entrada[metrica], melhor, checkpoint))
+
+    return quedas
+
+
+# ============================================================
+# AVALIAÇÃO
+# ============================================================
+
+def evaluate(checkpoints, data_path=DATA_PATH, max_examples=MAX_EXAMPLES, eval_dir=EVAL_DIR):
+    """Avalia cada checkpoint; retorna {checkpoint: métricas}."""
+
+    assinatura, ids, gold, exemplos = load_gold(data_path, max_examples, eval_dir)
+    print(f"Referência: {len(ids):,} registro(s) de teste ({os.path.join(eval_dir, assinatura)})")
+
+    model = tokenizer = None
+    resultados = {}
+
+    for checkpoint in checkpoints:
+        nome = checkpoint_name(checkpoint)
+        pasta = os.path.join(eval_dir, assinatura, nome)
+        path = os.path.join(pasta, "predictions.jsonl")
+
+        os.makedirs(pasta, exist_ok=True)
+
+        respostas = read_predictions(path)
+
+        if any(i not in respostas for i in ids):
+            from batch_inference import CatalogEngine, load_model
+
+            if exemplos is None:
+                exemplos = held_out_examples(data_path, max_examples)
+
+            if model is None:
+                # O modelo base uma vez; os checkpoints entram como adaptadores.
+                print("Iniciando o carregamento do modelo (Isso pode levar um minuto)...")
+                model, tokenizer = load_model(adapter_path="")
+
+            print(f"\n🔎 {checkpoint}")
+            model, adapter = activate_checkpoint(model, checkpoint)
+            engine = CatalogEngine(model, tokenizer, generation_config=GENERATION_CONFIG)
+
+            generate_predictions(exemplos, engine, adapter, path)
+            respostas = read_predictions(path)
+
+        metricas = score(gold, marc_tables([respostas.get(i, "") for i in ids]))
+
+        with open(os.path.join(pasta, "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump({"checkpoint": checkpoint, "gold": assinatura, **metricas}, f, ensure_ascii=False, indent=2)
+
+        entrada = {
+            "checkpoint": checkpoint,
+            "gold": assinatura,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            **metricas["summary"],
+        }
+
+        quedas = regressions(entrada, read_history(eval_dir))
+        record_history(entrada, eval_dir)
+
+        resultados[checkpoint] = metricas
+
+        print(f"\n📊 {checkpoint}")
+        for metrica in HEADLINE_METRICS:
+            print(f"   {metrica:<18} {entrada[metrica]}")
+
+        for metrica, valor, melhor, anterior in quedas:
+            print(f"   ⚠️  Regressão em {metrica}: {valor} (melhor: {melhor}, {anterior})")
+
+    return resultados
+
+
+if __name__ == "__main__":
+    evaluate(sys.argv[1:] or [ADAPTER_PATH])
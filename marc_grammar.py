@@ -0,0 +1,341 @@
+"""
+Decodificação restrita ao formato MARC dos registros de treino.
+
+As respostas do modelo são registros no formato MARCMaker, como
+str(record) no preparation.py:
+
+    =LDR  00000nam a2200000 a 4500
+    =008  850101s1980\\\\xx ...
+    =245  10$aTítulo$bsubtítulo$cresponsabilidade
+    (linha em branco)
+
+Sem restrição, o generate só para no EOS ou em max_new_tokens: o modelo
+gasta tokens depois do fim do registro (o "<|im_end|>" do template não
+é um token especial do Mistral) ou deriva para texto livre. Aqui um
+LogitsProcessor só deixa passar tokens que mantêm a resposta dentro da
+gramática de linhas MARC:
+
+- a primeira linha é o =LDR com 24 posições;
+- cada linha seguinte é "=" + tag de 3 dígitos + dois espaços e então,
+  em campos de controle (00X), os dados até o fim da linha; nos demais,
+  dois indicadores (dígito ou \\) e um ou mais subcampos "$" + código
+  (a-z, 0-9) + valor não vazio;
+- as tags aceitas são as citadas nas regras do prompt (mais
+  EXTRA_TAGS), ou qualquer tag com tags=None;
+- a linha em branco fecha o registro, e a partir daí só o EOS é aceito:
+  a geração de cada linha do lote para assim que o registro termina.
+
+A gramática é um autômato de caracteres. Para cada estado, a máscara
+dos tokens do vocabulário que ele aceita é calculada uma vez (o texto de
+cada token é percorrido no autômato) e reaproveitada; depois das
+primeiras respostas, restringir um passo custa uma consulta a um
+dicionário por linha do lote.
+"""
+
+import re
+
+import torch
+from transformers import LogitsProcessor
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Tags sempre aceitas, além das citadas no prompt: campos de controle e
+# identificação presentes em praticamente todo registro do treino.
+EXTRA_TAGS = ("001", "003", "005", "008", "020", "040")
+
+INDICADORES = frozenset("0123456789\\")
+CODIGOS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789")
+
+TAMANHO_LEADER = 24
+
+# Tags citadas nas regras: início das linhas "- 090 0 ?:" ou
+# "- 260/264 ? ?:", "usar 110 ou 111", "usar apenas o 710", "(tags 650)"
+# e "O tag 082".
+_TAG_REGRA = re.compile(r"^- (\d{3}(?:/\d{3})*)", re.M)
+_TAG_CITADA = re.compile(r"(?:usar (?:apenas o )?|tags? )(\d{3})(?: ou (\d{3}))?")
+
+
+def prompt_tags(texto, extra=EXTRA_TAGS):
+    """Tags citadas nas regras de um prompt, mais `extra`."""
+
+    tags = set(extra)
+
+    for grupo in _TAG_REGRA.findall(texto):
+        tags.update(grupo.split("/"))
+
+    for citada in _TAG_CITADA.findall(texto):
+        tags.update(t for t in citada if t)
+
+    return frozenset(tags)
+
+
+# ============================================================
+# AUTÔMATO
+# ============================================================
+
+# Estados (tuplas, para servirem de chave dos caches):
+#   ("ldr", k)         k caracteres de "=LDR  " já escritos
+#   ("leader", n)      n posições do leader já escritas
+#   ("linha", campos)  início de linha; campos=True depois do 1º campo
+#   ("tag", parcial)   dígitos da tag já escritos
+#   ("sep", ctrl, k)   k espaços depois da tag (ctrl: campo de controle)
+#   ("dado", tem)      dados de um campo de controle
+#   ("ind", k)         k indicadores já escritos
+#   ("dolar",)         espera o "$" do primeiro subcampo
+#   ("codigo",)        espera o código do subcampo
+#   ("valor", tem)     valor do subcampo (tem: já há algum caractere)
+#   FIM                registro completo: só o EOS
+
+INICIO = ("ldr", 0)
+FIM = ("fim",)
+
+_ABERTURA_LDR = "=LDR  "
+
+
+class MarcGrammar:
+    """Autômato de caracteres das linhas MARC (ver docstring do módulo)."""
+
+    def __init__(self, tags=None):
+        self.tags = frozenset(tags) if tags is not None else None
+
+        # Prefixos válidos das tags ("", "2", "24", ...).
+        if self.tags is not None:
+            self.prefixos = {t[:i] for t in self.tags for i in range(3)}
+
+    def passo(self, estado, c):
+        """Próximo estado depois do caractere c, ou None se c não cabe."""
+
+        tipo = estado[0]
+
+        if tipo == "valor":
+            if c == "\n":
+                return ("linha", True) if estado[1] else None
+            if c == "$":
+                return ("codigo",) if estado[1] else None
+            return ("valor", True)
+
+        if tipo == "dado":
+            if c == "\n":
+                return ("linha", True) if estado[1] else None
+            return ("dado", True)
+
+        if tipo == "linha":
+            if c == "=":
+                return ("tag", "")
+            if c == "\n" and estado[1]:
+                return FIM
+            return None
+
+        if tipo == "tag":
+            if not c.isdigit() or not c.isascii():
+                return None
+
+            parcial = estado[1] + c
+
+            if len(parcial) < 3:
+                if self.tags is not None and parcial not in self.prefixos:
+                    return None
+                return ("tag", parcial)
+
+            if self.tags is not None and parcial not in self.tags:
+                return None
+
+            return ("sep", parcial < "010", 0)
+
+        if tipo == "sep":
+            if c != " ":
+                return None
+            if estado[2] == 0:
+                return ("sep", estado[1], 1)
+            return ("dado", False) if estado[1] else ("ind", 0)
+
+        if tipo == "ind":
+            if c not in INDICADORES:
+                return None
+            return ("ind", 1) if estado[1] == 0 else ("dolar",)
+
+        if tipo == "dolar":
+            return ("codigo",) if c == "$" else None
+
+        if tipo == "codigo":
+            return ("valor", False) if c in CODIGOS else None
+
+        if tipo == "ldr":
+            if c != _ABERTURA_LDR[estado[1]]:
+                return None
+            if estado[1] + 1 < len(_ABERTURA_LDR):
+                return ("ldr", estado[1] + 1)
+            return ("leader", 0)
+
+        if tipo == "leader":
+            if estado[1] < TAMANHO_LEADER:
+                return None if c == "\n" else ("leader", estado[1] + 1)
+            return ("linha", False) if c == "\n" else None
+
+        return None
+
+    def avancar(self, estado, texto):
+        """Estado depois de `texto` inteiro, ou None se algum caractere não cabe."""
+
+        for c in texto:
+            estado = self.passo(estado, c)
+
+            if estado is None:
+                return None
+
+        return estado
+
+    def completo(self, texto):
+        """True se `texto` é um registro inteiro (até a linha em branco)."""
+
+        return self.avancar(INICIO, texto) == FIM
+
+
+# ============================================================
+# VOCABULÁRIO
+# ============================================================
+
+def token_texts(tokenizer):
+    """
+    Texto que cada token acrescenta à resposta. Tokens SentencePiece
+    perdem o espaço inicial quando decodificados sozinhos, por isso cada
+    um é decodificado depois de uma âncora, que é descontada. Tokens
+    especiais ficam como None.
+    """
+
+    ancora = tokenizer.encode("a", add_special_tokens=False)
+    texto_ancora = tokenizer.decode(ancora)
+    especiais = set(tokenizer.all_special_ids)
+
+    textos = []
+
+    for i in range(len(tokenizer)):
+        if i in especiais:
+            textos.append(None)
+            continue
+
+        texto = tokenizer.decode(ancora + [i])
+
+        if texto.startswith(texto_ancora):
+            texto = texto[len(texto_ancora):]
+        else:
+            texto = tokenizer.decode([i])
+
+        textos.append(texto)
+
+    return textos
+
+
+class MarcVocab:
+    """
+    Textos dos tokens de um tokenizer, com as máscaras e transições de
+    cada estado da gramática calculadas sob demanda e guardadas.
+    """
+
+    def __init__(self, tokenizer, grammar, textos=None):
+        self.grammar = grammar
+        self.eos_id = tokenizer.eos_token_id
+        # token_texts é o passo caro: pode ser calculado uma vez e
+        # compartilhado entre gramáticas do mesmo tokenizer.
+        self.textos = textos if textos is not None else token_texts(tokenizer)
+
+        self._mascaras = {}
+        self._transicoes = {}
+
+    def mascara(self, estado, tamanho, device):
+        """Tokens aceitos no estado (tensor bool de `tamanho` posições)."""
+
+        chave = (estado, tamanho, str(device))
+
+        if chave not in self._mascaras:
+            aceitos = torch.zeros(tamanho, dtype=torch.bool)
+
+            if estado == FIM or estado is None:
+                aceitos[self.eos_id] = True
+            else:
+                for i, texto in enumerate(self.textos[:tamanho]):
+                    if texto and self.grammar.avancar(estado, texto) is not None:
+                        aceitos[i] = True
+
+                # Fim de linha depois de um campo também fecha o registro.
+                if estado == ("linha", True) or not aceitos.any():
+                    aceitos[self.eos_id] = True
+
+            self._mascaras[chave] = aceitos.to(device)
+
+        return self._mascaras[chave]
+
+    def avancar(self, estado, token_id):
+        """Estado depois do token (None para o EOS ou token fora da gramática)."""
+
+        chave = (estado, token_id)
+
+        if chave not in self._transicoes:
+            texto = self.textos[token_id] if token_id < len(self.textos) else None
+
+            if token_id == self.eos_id or not texto or estado in (FIM, None):
+                proximo = None
+            else:
+                proximo = self.grammar.avancar(estado, texto)
+
+            self._transicoes[chave] = proximo
+
+        return self._transicoes[chave]
+
+
+class MarcLogitsProcessor(LogitsProcessor):
+    """
+    LogitsProcessor do generate: em cada passo, descarta (-inf) os
+    tokens que sairiam da gramática, linha a linha do lote. Linhas que
+    já geraram o EOS ficam só com o EOS (o generate completa com pad).
+
+    O estado de cada linha vem dos tokens gerados até ali, guardados com
+    o estado depois de cada um: a geração especulativa chama o processor
+    para posições de um rascunho que pode ser descartado, e o processor
+    volta ao último token em comum.
+    """
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.inicio = None
+        self.tokens = None
+        self.estados = None
+
+    def _estado(self, linha, gerados):
+        tokens = self.tokens[linha]
+        estados = self.estados[linha]
+
+        if gerados[:len(tokens)] != tokens:
+            comum = 0
+            while comum < min(len(tokens), len(gerados)) and tokens[comum] == gerados[comum]:
+                comum += 1
+            del tokens[comum:]
+            del estados[comum + 1:]
+
+        for token in gerados[len(tokens):]:
+            estados.append(self.vocab.avancar(estados[-1], token))
+            tokens.append(token)
+
+        return estados[-1]
+
+    def __call__(self, input_ids, scores):
+        if self.inicio is None:
+            # Primeira chamada: nada gerado ainda.
+            self.inicio = input_ids.shape[1]
+            self.tokens = [[] for _ in range(input_ids.shape[0])]
+            self.estados = [[INICIO] for _ in range(input_ids.shape[0])]
+
+        estados = [
+            self._estado(linha, gerados)
+            for linha, gerados in enumerate(input_ids[:, self.inicio:].tolist())
+        ]
+
+        mascara = torch.stack([
+            self.vocab.mascara(estado, scores.shape[-1], scores.device)
+            for estado in estados
+        ])
+
+        return scores.masked_fill(~mascara, float("-inf"))
@@ -0,0 +1,564 @@
+"""
+Leitura em streaming de MARCXML com lxml.
+
+Substitui o caminho antigo de preparation.py, que varria o arquivo
+linha a linha procurando "<record" e depois chamava
+parse_xml_to_array (um parser novo) para cada registro.
+
+Aqui há uma única passada incremental de iterparse sobre o arquivo
+inteiro (ou sobre uma faixa de bytes dele). Os registros pymarc são
+montados direto a partir dos elementos, que são liberados logo em
+seguida para manter a memória constante.
+
+Observação sobre recover=True: depois do primeiro erro recuperado,
+a libxml2 passa a descartar entidades (&amp;, &lt;, ...) no resto
+do documento, corrompendo silenciosamente os registros seguintes.
+Por isso o iterparse roda em modo estrito e, se o arquivo tiver um
+trecho malformado, a leitura continua a partir do registro com erro
+em modo de recuperação: os <record> são recortados direto nos bytes
+e cada um passa por um único XMLParser reaproveitado. Registros
+quebrados são descartados individualmente, como antes.
+"""
+
+from lxml import etree
+from pymarc import Field, Record, Subfield
+from pymarc.field import Indicators
+from pymarc.leader import Leader
+
+from dataset_writer import compression_from_path, open_binary_reader
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Cabeçalho/rodapé usados quando a leitura começa ou termina no
+# meio do arquivo (faixas de bytes do modo paralelo).
+CABECALHO_FAKE = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<collection xmlns="http://www.loc.gov/MARC21/slim">'
+)
+
+RODAPE_FAKE = b"</collection>"
+
+# Tamanho dos blocos lidos do disco.
+READ_SIZE = 4 * 1024 * 1024
+
+RECORD_START = b"<record"
+RECORD_END = b"</record>"
+
+# Bytes que podem vir logo depois de "<record" em uma tag <record>.
+# Evita confundir com <records>, <recordInfo> etc.
+RECORD_DELIMITERS = b" >\t\r\n/"
+
+
+# ============================================================
+# FONTE DE BYTES
+# ============================================================
+
+class RangeReader:
+    """
+    Objeto "file-like" que entrega a faixa [start, end) de um
+    arquivo, cercada por uma collection artificial quando a faixa
+    não começa no início ou não vai até o fim do arquivo.
+    """
+
+    def __init__(self, fileobj, start=0, end=None):
+        self.fileobj = fileobj
+
+        # Fluxos comprimidos (ex.: zstd) não aceitam seek; só são lidos inteiros.
+        if start:
+            self.fileobj.seek(start)
+
+        self.restante = None if end is None else end - start
+
+        self.prefixo = CABECALHO_FAKE if start > 0 else b""
+        self.sufixo = RODAPE_FAKE if end is not None else b""
+
+    def read(self, size=READ_SIZE):
+
+        if size is None or size < 0:
+            size = READ_SIZE
+
+        if self.prefixo:
+            dados, self.prefixo = self.prefixo, b""
+            return dados
+
+        if self.restante is None:
+            dados = self.fileobj.read(size)
+
+        elif self.restante > 0:
+            dados = self.fileobj.read(min(size, self.restante))
+            self.restante -= len(dados)
+
+        else:
+            dados = b""
+
+        if dados:
+            return dados
+
+        dados, self.sufixo = self.sufixo, b""
+        return dados
+
+
+def open_binary_file(filepath):
+    """Abre XML normal, .xml.gz ou .xml.zst em modo binário."""
+
+    return open_binary_reader(filepath)
+
+
+# ============================================================
+# CONVERSÃO ELEMENTO -> pymarc.Record
+# ============================================================
+
+def _local_name(element):
+    """Nome da tag sem namespace; None para comentários/PIs."""
+
+    tag = element.tag
+
+    if not isinstance(tag, str):
+        return None
+
+    return tag.rpartition("}")[2]
+
+
+def element_to_record(element):
+    """
+    Monta um pymarc.Record a partir de um elemento <record>.
+
+    Reproduz o que o XmlHandler do pymarc faz para o mesmo XML.
+    """
+
+    record = Record()
+
+    for child in element:
+
+        name = _local_name(child)
+
+        if name == "datafield":
+
+            subfields = [
+                Subfield(sub.attrib["code"], sub.text or "")
+                for sub in child
+                if _local_name(sub) == "subfield"
+            ]
+
+            record.add_field(
+                Field(
+                    child.attrib["tag"],
+                    Indicators(
+                        child.get("ind1", " "),
+                        child.get("ind2", " "),
+                    ),
+                    subfields,
+                )
+            )
+
+        elif name == "controlfield":
+            record.add_field(
+                Field(child.attrib["tag"], data=child.text or "")
+            )
+
+        elif name == "leader":
+            record.leader = Leader(child.text or "")
+
+    return record
+
+
+# ============================================================
+# REGISTRO COMPACTO
+# ============================================================
+
+# Leader padrão de pymarc.Record() quando o XML não tem <leader>.
+LEADER_PADRAO = " " * 10 + "22" + " " * 8 + "4500"
+
+
+def _normalize_tag(tag):
+    """Normaliza a tag como pymarc.Field ("1" -> "001")."""
+
+    if tag.isdigit() and len(tag) != 3:
+        return f"{int(tag):03}"
+
+    return tag
+
+
+def _is_control_tag(tag):
+    """Mesma regra do pymarc: tags numéricas menores que 010."""
+
+    return tag < "010" and tag.isdigit()
+
+
+class LiteField:
+    """
+    Campo MARC compacto, compatível com o uso de pymarc.Field em
+    format_marc_record: get(code), field[code] e `code in field`.
+
+    Os subcampos ficam em uma única tupla plana
+    (code1, valor1, code2, valor2, ...). Em campos de controle,
+    `data` guarda o conteúdo e `subfields` fica vazio.
+    """
+
+    __slots__ = ("tag", "ind1", "ind2", "data", "subfields")
+
+    def __init__(self, tag, ind1=" ", ind2=" ", data=None, subfields=()):
+        self.tag = tag
+        self.ind1 = ind1
+        self.ind2 = ind2
+        self.data = data
+        self.subfields = subfields
+
+    @property
+    def control_field(self):
+        return _is_control_tag(self.tag)
+
+    def get(self, code, default=None):
+
+        subfields = self.subfields
+
+        for i in range(0, len(subfields), 2):
+            if subfields[i] == code:
+                return subfields[i + 1]
+
+        return default
+
+    def __getitem__(self, code):
+
+        subfields = self.subfields
+
+        for i in range(0, len(subfields), 2):
+            if subfields[i] == code:
+                return subfields[i + 1]
+
+        raise KeyError(code)
+
+    def __contains__(self, code):
+        return code in self.subfields[::2]
+
+    def __str__(self):
+        """Mesmo formato MARCMaker de pymarc.Field.__str__."""
+
+        if self.control_field:
+            data = self.data.replace(" ", "\\") if self.data else ""
+            return f"={self.tag}  {data}"
+
+        ind1 = "\\" if self.ind1 in (" ", "\\") else self.ind1
+        ind2 = "\\" if self.ind2 in (" ", "\\") else self.ind2
+
+        subfields = self.subfields
+
+        partes = [
+            f"${subfields[i]}{subfields[i + 1]}"
+            for i in range(0, len(subfields), 2)
+        ]
+
+        return f"={self.tag}  {ind1}{ind2}{''.join(partes)}"
+
+
+class LiteRecord:
+    """
+    Registro MARC compacto, alternativa leve ao pymarc.Record.
+
+    Suporta get(tag), record[tag] e str(record), com a mesma saída
+    em texto do pymarc, que é tudo o que a preparação precisa.
+    """
+
+    __slots__ = ("leader", "fields")
+
+    def __init__(self, leader=LEADER_PADRAO, fields=None):
+        self.leader = leader
+        self.fields = fields if fields is not None else []
+
+    def get(self, tag, default=None):
+
+        for field in self.fields:
+            if field.tag == tag:
+                return field
+
+        return default
+
+    def __getitem__(self, tag):
+
+        for field in self.fields:
+            if field.tag == tag:
+                return field
+
+        raise KeyError(tag)
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def __str__(self):
+
+        linhas = [f"=LDR  {self.leader}"]
+        linhas.extend(str(field) for field in self.fields)
+
+        return "\n".join(linhas) + "\n"
+
+
+def element_to_lite_record(element):
+    """
+    Monta um LiteRecord a partir de um elemento <record>.
+
+    Segue as mesmas regras de element_to_record, inclusive a
+    rejeição de leaders que não têm 24 caracteres.
+    """
+
+    record = LiteRecord()
+    fields = record.fields
+
+    for child in element:
+
+        name = _local_name(child)
+
+        if name == "datafield":
+
+            tag = _normalize_tag(child.attrib["tag"])
+
+            if _is_control_tag(tag):
+                fields.append(LiteField(tag))
+                continue
+
+            subfields = []
+
+            for sub in child:
+                if _local_name(sub) == "subfield":
+                    subfields.append(sub.attrib["code"])
+                    subfields.append(sub.text or "")
+
+            fields.append(
+                LiteField(
+                    tag,
+                    child.get("ind1", " "),
+                    child.get("ind2", " "),
+                    subfields=tuple(subfields),
+                )
+            )
+
+        elif name == "controlfield":
+
+            tag = _normalize_tag(child.attrib["tag"])
+
+            if _is_control_tag(tag):
+                fields.append(LiteField(tag, data=child.text or ""))
+            else:
+                fields.append(LiteField(tag))
+
+        elif name == "leader":
+
+            leader = child.text or ""
+
+            if len(leader) != len(LEADER_PADRAO):
+                raise ValueError(f"Leader inválido: {leader!r}")
+
+            record.leader = leader
+
+    return record
+
+
+# ============================================================
+# LEITURA
+# ============================================================
+
+def iter_record_elements(source):
+    """
+    Itera os elementos <record> de um arquivo ou objeto file-like
+    com uma única passada de iterparse (modo estrito).
+
+    Cada elemento é limpo (junto com os irmãos anteriores) assim
+    que o consumidor pede o próximo, então o uso de memória não
+    cresce com o tamanho do arquivo.
+
+    Levanta etree.XMLSyntaxError no primeiro trecho malformado.
+    """
+
+    context = etree.iterparse(
+        source,
+        events=("end",),
+        tag="{*}record",
+        huge_tree=True,
+    )
+
+    for _, element in context:
+
+        yield element
+
+        element.clear()
+
+        parent = element.getparent()
+
+        while element.getprevious() is not None:
+            del parent[0]
+
+    del context
+
+
+def iter_record_chunks(source, skip=0, state=None):
+    """
+    Recorta os bytes de cada <record>...</record> de `source`.
+
+    Os primeiros `skip` registros completos são pulados. Um <record>
+    que começa antes do fechamento do anterior (registro truncado) é
+    sempre descartado e contado em state["errors"], mesmo entre os
+    pulados: ele não entra na contagem de `skip`, assim como não é
+    entregue pelo iterparse (ver iter_marc_records).
+    """
+
+    buffer = b""
+    pos = 0
+    vistos = 0
+
+    while True:
+
+        inicio = buffer.find(RECORD_START, pos)
+
+        # Ignora <records>, <recordInfo> etc.
+        fim_tag = inicio + len(RECORD_START)
+
+        if (
+            inicio >= 0
+            and fim_tag < len(buffer)
+            and buffer[fim_tag] not in RECORD_DELIMITERS
+        ):
+            pos = fim_tag
+            continue
+
+        if inicio >= 0 and fim_tag < len(buffer):
+
+            fim = buffer.find(RECORD_END, inicio)
+
+            if fim >= 0:
+
+                proximo = buffer.find(RECORD_START, fim_tag, fim)
+
+                if proximo >= 0:
+                    if state is not None:
+                        state["errors"] += 1
+
+                    pos = proximo
+                    continue
+
+                fim += len(RECORD_END)
+                pos = fim
+
+                if vistos >= skip:
+                    yield buffer[inicio:fim]
+
+                vistos += 1
+                continue
+
+        dados = source.read(READ_SIZE)
+
+        if not dados:
+            break
+
+        # Mantém apenas o registro incompleto (ou o final do buffer,
+        # caso um "<record" esteja cortado entre dois blocos).
+        if inicio >= 0:
+            manter = inicio
+        else:
+            manter = max(pos, len(buffer) - len(RECORD_START))
+
+        buffer = buffer[manter:] + dados
+        pos = 0
+
+
+def parse_chunk(chunk, parser):
+    """
+    Faz o parsing dos bytes de um <record>.
+
+    Bytes UTF-8 inválidos são descartados e o parsing é refeito,
+    como no leitor antigo (decode com errors="ignore"), em vez de
+    perder o registro inteiro.
+    """
+
+    try:
+        return etree.fromstring(chunk, parser)
+
+    except etree.XMLSyntaxError:
+        limpo = chunk.decode("utf-8", errors="ignore").encode("utf-8")
+
+        if limpo == chunk:
+            raise
+
+        return etree.fromstring(limpo, parser)
+
+
+def iter_marc_records(filepath, state, start=0, end=None, factory=None):
+    """
+    Itera os registros MARC válidos de um XML/XML.GZ.
+
+    Registros que não podem ser lidos ou convertidos incrementam
+    state["errors"] e são pulados, como no leitor antigo.
+
+    start/end limitam a leitura a uma faixa de bytes (apenas em
+    XML não comprimido), que deve começar em um <record>.
+
+    factory converte o elemento em registro; o padrão é
+    element_to_record (pymarc.Record).
+    """
+
+    if factory is None:
+        factory = element_to_record
+
+    if (start or end is not None) and compression_from_path(filepath) is not None:
+        raise ValueError(
+            f"Faixas de bytes não são suportadas em arquivos comprimidos: {filepath}"
+        )
+
+    lidos = 0
+
+    with open_binary_file(filepath) as f:
+
+        # ----------------------------------------------------
+        # Caminho rápido: uma passada estrita de iterparse.
+        # ----------------------------------------------------
+
+        try:
+            for element in iter_record_elements(RangeReader(f, start, end)):
+
+                lidos += 1
+
+                try:
+                    record = factory(element)
+
+                except Exception:
+                    state["errors"] += 1
+                    continue
+
+                yield record
+
+            return
+
+        except etree.XMLSyntaxError:
+            pass
+
+    # ----------------------------------------------------
+    # Recuperação: continua do primeiro registro não lido,
+    # agora registro a registro. O arquivo é reaberto em vez
+    # de voltar com seek, que os fluxos zstd não aceitam.
+    #
+    # `lidos` conta os <record> fechados que o iterparse
+    # entregou. Um registro truncado nunca é fechado (os
+    # seguintes ficam aninhados nele e ainda são entregues),
+    # por isso iter_record_chunks só conta registros completos
+    # no `skip`.
+    # ----------------------------------------------------
+
+    parser = etree.XMLParser(huge_tree=True)
+
+    with open_binary_file(filepath) as f:
+
+        for chunk in iter_record_chunks(
+            RangeReader(f, start, end),
+            skip=lidos,
+            state=state,
+        ):
+
+            try:
+                record = factory(parse_chunk(chunk, parser))
+
+            except Exception:
+                state["errors"] += 1
+                continue
+
+            yield record
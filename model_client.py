@@ -0,0 +1,80 @@
+"""
+Cliente do servidor do modelo (model_server.py).
+
+Só usa a biblioteca padrão: os scripts que apenas pedem respostas ao
+modelo não precisam importar torch nem transformers, e rodam em
+segundos com o servidor já carregado.
+"""
+
+import json
+import os
+import urllib.error
+import urllib.request
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+SERVER_URL = os.getenv("MODEL_SERVER_URL", "http://127.0.0.1:8765")
+
+# A geração de um lote pode levar minutos.
+TIMEOUT = 1800
+
+
+# ============================================================
+# PEDIDOS
+# ============================================================
+
+def _pedir(rota, dados=None, server_url=SERVER_URL, timeout=TIMEOUT):
+    corpo = None if dados is None else json.dumps(dados, ensure_ascii=False).encode("utf-8")
+
+    pedido = urllib.request.Request(
+        server_url.rstrip("/") + rota,
+        data=corpo,
+        headers={"Content-Type": "application/json"},
+    )
+
+    try:
+        with urllib.request.urlopen(pedido, timeout=timeout) as resposta:
+            return json.loads(resposta.read())
+    except urllib.error.HTTPError as exc:
+        try:
+            erro = json.loads(exc.read()).get("error", exc.reason)
+        except ValueError:
+            erro = exc.reason
+        raise RuntimeError(f"Erro do servidor do modelo ({exc.code}): {erro}") from None
+    except urllib.error.URLError as exc:
+        raise ConnectionError(
+            f"Servidor do modelo indisponível em {server_url} ({exc.reason}). "
+            f"Inicie-o com: python model_server.py"
+        ) from None
+
+
+def health(server_url=SERVER_URL):
+    """Estado do servidor (modelo, adaptador, lotes atendidos, tokens/s)."""
+
+    return _pedir("/health", server_url=server_url, timeout=10)
+
+
+def generate(prompts, adapter=True, server_url=SERVER_URL, **generation):
+    """
+    Respostas do modelo para prompts já montados. adapter=False usa o
+    modelo base (LoRA desligado); uma lista de bools escolhe prompt a
+    prompt, no mesmo lote. `generation` aceita max_new_tokens,
+    temperature, top_p, top_k, do_sample, repetition_penalty, grammar
+    (decodificação restrita ao formato MARC) e speculative
+    ("prompt_lookup" ou "draft"; False desliga).
+    """
+
+    dados = {"prompts": list(prompts), "adapter": adapter, "generation": generation}
+
+    return _pedir("/generate", dados, server_url)["responses"]
+
+
+def catalog(books, adapter=True, server_url=SERVER_URL, **generation):
+    """Registros MARC de livros ({title, author, year, edition, imprint})."""
+
+    dados = {"books": list(books), "adapter": adapter, "generation": generation}
+
+    return _pedir("/generate", dados, server_url)["responses"]
@@ -0,0 +1,359 @@
+"""
+Servidor local do modelo de catalogação.
+
+inference.py, compare.py e generate_baseline.py recarregavam o
+Mistral-7B (e o adaptador LoRA) do zero a cada execução, para gerar uma
+única resposta. Aqui um processo de longa duração carrega o modelo base
+uma vez, mantém o adaptador acoplado e atende pedidos por HTTP em
+127.0.0.1; os scripts viram clientes (model_client.py).
+
+Cada prompt recebido vai para uma fila. Uma única thread de geração
+pega o primeiro da fila, espera até MAX_WAIT_MS por outros (até
+BATCH_SIZE) e gera todos juntos com um generate em lote, com padding à
+esquerda (CatalogEngine do batch_inference.py), a partir do cache KV
+do bloco fixo de instruções de cada prompt, calculado uma só vez. Pedidos que chegam
+juntos de vários clientes viram um só lote, inclusive os que pedem o
+modelo base (adapter=false: o LoRA fica desligado só nas linhas deles);
+só são separados os que pedem parâmetros de geração diferentes.
+
+Rotas:
+    GET  /health    {"status": "ok", "model", "adapter", "device",
+                     "batches", "prompts", "prefill_tokens", "prefill_tokens_saved",
+                     "generated_tokens", "tokens_per_second", e, com geração
+                     especulativa, "draft_tokens", "accepted_tokens",
+                     "acceptance_rate", "tokens_per_step"}
+    POST /generate  {"prompts": [...] ou "books": [{title, author, ...}],
+                     "adapter": true (ou um bool por prompt),
+                     "generation": {"max_new_tokens", ...}}
+                    -> {"responses": [...]}
+
+"books" usa o template do treino (prompt_template.py); "prompts" são
+enviados como estão (os scripts mantêm os próprios prompts).
+
+Uso: python model_server.py   (MODEL_NAME, ADAPTER_PATH, DEVICE,
+BATCH_SIZE, SPECULATIVE e DRAFT_MODEL como no batch_inference.py; HOST e
+PORT para o endereço)
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from batch_inference import (
+    ADAPTER_PATH,
+    BATCH_SIZE,
+    DRAFT_MODEL,
+    MODEL_NAME,
+    SEED,
+    CatalogEngine,
+    book_fields,
+    load_draft_model,
+    load_model,
+    resolve_device,
+)
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8765"))
+
+# Quanto o primeiro prompt da fila espera por outros para formar um lote.
+MAX_WAIT_MS = 20
+
+# Tempo máximo de um pedido (segundos), da fila até a resposta.
+REQUEST_TIMEOUT = 1800
+
+# Parâmetros de geração que os clientes podem mudar.
+GENERATION_KEYS = (
+    "max_new_tokens",
+    "temperature",
+    "top_p",
+    "top_k",
+    "do_sample",
+    "repetition_penalty",
+    "grammar",
+    "speculative",
+)
+
+
+# ============================================================
+# MICRO-LOTES
+# ============================================================
+
+class Pedido:
+    """Um prompt na fila, com o Future que recebe a resposta."""
+
+    def __init__(self, ids, adapter, generation):
+        self.ids = ids
+        self.adapter = adapter
+        self.generation = generation
+        self.future = Future()
+
+    @property
+    def chave(self):
+        # Só prompts com a mesma chave podem ir para o mesmo generate; o
+        # adaptador é escolhido linha a linha.
+        return tuple(sorted(self.generation.items()))
+
+
+class MicroBatcher:
+    """
+    Fila de prompts atendida por uma única thread de geração, que junta
+    em um lote os prompts que chegam com até max_wait segundos entre o
+    primeiro e o último.
+    """
+
+    def __init__(self, engine, batch_size=BATCH_SIZE, max_wait=MAX_WAIT_MS / 1000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.fila = queue.Queue()
+        self.lotes = 0
+        self.prompts = 0
+
+        self.thread = threading.Thread(target=self._loop, name="geracao", daemon=True)
+        self.thread.start()
+
+    def submit(self, ids_list, adapter=True, generation=None):
+        """
+        Enfileira os prompts (já tokenizados); retorna um Future por
+        prompt. adapter pode ser um bool por prompt.
+        """
+
+        if not isinstance(adapter, (list, tuple)):
+            adapter = [adapter] * len(ids_list)
+
+        pedidos = [Pedido(ids, a, generation or {}) for ids, a in zip(ids_list, adapter)]
+
+        for pedido in pedidos:
+            self.fila.put(pedido)
+
+        return [pedido.future for pedido in pedidos]
+
+    def _coletar(self):
+        """Primeiro pedido da fila mais os que chegarem dentro do prazo."""
+
+        pedidos = [self.fila.get()]
+        prazo = time.monotonic() + self.max_wait
+
+        while len(pedidos) < self.batch_size:
+            restante = prazo - time.monotonic()
+
+            # Passado o prazo, só entra o que já está na fila.
+            try:
+                if restante > 0:
+                    pedidos.append(self.fila.get(timeout=restante))
+                else:
+                    pedidos.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+
+        return pedidos
+
+    def _loop(self):
+        while True:
+            pedidos = self._coletar()
+
+            # A thread de geração é uma só: um erro inesperado falha os
+            # pedidos deste lote, nunca a thread (e os pedidos seguintes).
+            try:
+                self._gerar(pedidos)
+            except Exception as exc:
+                for pedido in pedidos:
+                    if not pedido.future.done():
+                        pedido.future.set_exception(exc)
+
+    def _gerar(self, pedidos):
+        grupos = {}
+
+        for pedido in pedidos:
+            grupos.setdefault(pedido.chave, []).append(pedido)
+
+        for grupo in grupos.values():
+            try:
+                respostas = self.engine.generate_ids(
+                    [pedido.ids for pedido in grupo],
+                    [pedido.adapter for pedido in grupo],
+                    **grupo[0].generation,
+                )
+            except Exception as exc:
+                for pedido in grupo:
+                    pedido.future.set_exception(exc)
+                continue
+
+            self.lotes += 1
+            self.prompts += len(grupo)
+
+            for pedido, resposta in zip(grupo, respostas):
+                pedido.future.set_result(resposta)
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+class ErroPedido(ValueError):
+    """Corpo do pedido inválido (resposta 400)."""
+
+
+def ler_pedido(corpo, engine):
+    """(prompts, adapter, generation) de um corpo JSON de /generate."""
+
+    try:
+        dados = json.loads(corpo or b"{}")
+    except ValueError as exc:
+        raise ErroPedido(f"JSON inválido: {exc}")
+
+    if not isinstance(dados, dict):
+        raise ErroPedido("O corpo deve ser um objeto JSON.")
+
+    erro_prompts = 'Envie "prompts" (lista de textos) ou "books" (lista de livros).'
+
+    if "books" in dados:
+        livros = dados["books"]
+
+        if not isinstance(livros, list) or not all(isinstance(livro, dict) for livro in livros):
+            raise ErroPedido(erro_prompts)
+
+        prompts = [engine.prompt(book_fields(livro)) for livro in livros]
+    else:
+        prompts = dados.get("prompts")
+
+    if (
+        not isinstance(prompts, list)
+        or not prompts
+        or not all(isinstance(p, str) for p in prompts)
+    ):
+        raise ErroPedido(erro_prompts)
+
+    generation = dados.get("generation") or {}
+
+    if not isinstance(generation, dict):
+        raise ErroPedido('"generation" deve ser um objeto JSON.')
+
+    desconhecidos = set(generation) - set(GENERATION_KEYS)
+
+    if desconhecidos:
+        raise ErroPedido(f"Parâmetros de geração não aceitos: {', '.join(sorted(desconhecidos))}")
+
+    # Só valores simples: a geração agrupa os pedidos por esses valores.
+    compostos = sorted(
+        nome
+        for nome, valor in generation.items()
+        if not isinstance(valor, (str, int, float, bool, type(None)))
+    )
+
+    if compostos:
+        raise ErroPedido(f"Parâmetros de geração devem ser valores simples: {', '.join(compostos)}")
+
+    adapter = dados.get("adapter", True)
+
+    if isinstance(adapter, list):
+        if len(adapter) != len(prompts):
+            raise ErroPedido('"adapter" deve ter um valor por prompt.')
+        adapter = [bool(a) for a in adapter]
+    else:
+        adapter = bool(adapter)
+
+    return prompts, adapter, generation
+
+
+def make_handler(engine, batcher, info):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _responder(self, status, dados):
+            corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._responder(404, {"error": "rota desconhecida"})
+
+            self._responder(200, {
+                "status": "ok",
+                **info,
+                "batches": batcher.lotes,
+                "prompts": batcher.prompts,
+                "prefill_tokens": engine.prefill_tokens,
+                "prefill_tokens_saved": engine.prefill_tokens_saved,
+                **engine.stats(),
+            })
+
+        def do_POST(self):
+            if self.path != "/generate":
+                return self._responder(404, {"error": "rota desconhecida"})
+
+            corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            try:
+                prompts, adapter, generation = ler_pedido(corpo, engine)
+            except ErroPedido as exc:
+                return self._responder(400, {"error": str(exc)})
+
+            try:
+                # A tokenização roda na thread do pedido, em paralelo com a
+                # geração dos lotes anteriores.
+                futures = batcher.submit(engine.encode(prompts), adapter, generation)
+                respostas = [f.result(timeout=REQUEST_TIMEOUT) for f in futures]
+            except Exception as exc:
+                return self._responder(500, {"error": f"{type(exc).__name__}: {exc}"})
+
+            self._responder(200, {"responses": respostas})
+
+        def log_message(self, format, *args):
+            # Sem uma linha por pedido no terminal.
+            pass
+
+    return Handler
+
+
+def serve(engine, host=HOST, port=PORT, batch_size=BATCH_SIZE, info=None):
+    """Atende pedidos até Ctrl+C."""
+
+    # Escolhe o modo do PrefixTokenizer antes dos pedidos concorrentes.
+    engine.encode([engine.prompt(book_fields({"title": "Teste"}))])
+
+    batcher = MicroBatcher(engine, batch_size)
+    server = ThreadingHTTPServer((host, port), make_handler(engine, batcher, info or {}))
+
+    print(f"✅ Servidor pronto em http://{host}:{port} (lotes de até {batch_size})")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nEncerrando o servidor...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    torch.manual_seed(SEED)
+
+    print("Iniciando o carregamento do modelo (Isso pode levar um minuto)...")
+    model, tokenizer = load_model()
+    draft_model = load_draft_model() if DRAFT_MODEL else None
+
+    serve(
+        CatalogEngine(model, tokenizer, draft_model=draft_model),
+        info={
+            "model": MODEL_NAME,
+            "adapter": ADAPTER_PATH or None,
+            "device": resolve_device(),
+            "draft_model": DRAFT_MODEL or None,
+        },
+    )
@@ -0,0 +1,380 @@
+"""
+Limpeza, divisão e contagem de um dump MARCXML em uma única leitura.
+
+O fluxo antigo lia (e quase sempre regravava) o dump inteiro em cada
+etapa:
+
+    clean_xml.py        lê o dump sujo, grava o limpo
+    split_xml.py        lê o limpo, grava as partes
+    countRegister.py    lê as partes (índice)
+    preparation.py      lê as partes (índice + extração)
+
+Aqui o dump é lido uma vez e as partes já saem prontas:
+
+- cada bloco passa pela mesma limpeza do clean_xml.py (modo "bytes",
+  em paralelo com NUM_WORKERS > 1), inclusive a remoção das linhas
+  <?xml/<collection repetidas;
+- os <record> são localizados no bloco limpo com as mesmas regras do
+  record_index.py (registros truncados ficam de fora e são contados)
+  e, com VALIDAR_XML, cada registro ainda passa pelo lxml;
+- os registros são gravados em partes bem formadas (cabeçalho original
+  do dump + registros + </collection>) limitadas em bytes e/ou em
+  número de registros;
+- o índice de cada parte (<parte>.xml.idx.npz) é gravado junto, então
+  countRegister.py, sampling.py e o planejamento de faixas do
+  preparation.py não precisam varrer as partes de novo;
+- o dump pode ser .xml.gz ou .xml.zst, e as partes podem ser gravadas
+  comprimidas (COMPRESSAO_SAIDA; partes comprimidas não têm índice);
+- o manifesto (manifest.json) resume a execução: registros, truncados,
+  malformados, bytes removidos pela limpeza e a lista de partes.
+
+Uso: python pipeline_xml.py dump.xml pasta_saida
+"""
+
+import json
+import os
+import sys
+import time
+from array import array
+from contextlib import ExitStack
+
+import numpy as np
+from lxml import etree
+from tqdm import tqdm
+
+from clean_xml import (
+    BLOCO_BYTES,
+    abrir_entrada,
+    blocos_limpos,
+    iter_blocos,
+    remover_marcas,
+)
+from dataset_writer import COMPRESSION_EXTENSIONS, compression_from_path, open_binary_writer
+from marc_reader import CABECALHO_FAKE, RODAPE_FAKE
+from record_index import RecordIndex, save_index, scan_records_partial
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+ARQUIVO_ENTRADA = "/workspace/inputs/lc_data.xml"
+PASTA_SAIDA = "/workspace/marc_chunks"
+# Nome de cada parte, numerada a partir de 1.
+NOME_PARTE = "marc_chunk_{:03d}.xml"
+
+# Compressão das partes: None, "gzip" ou "zstd" (extensão acrescentada
+# ao nome). O zstd comprime com todos os núcleos.
+COMPRESSAO_SAIDA = None
+
+# Limites de cada parte (None desliga o limite). Uma parte é fechada
+# antes do registro que ultrapassaria qualquer um deles.
+MAX_BYTES_POR_PARTE = 2 * 1024 ** 3
+MAX_REGISTROS_POR_PARTE = None
+
+# Processos da limpeza (como clean_xml.NUM_WORKERS).
+NUM_WORKERS = 1
+
+# Confere cada registro com o lxml e descarta os malformados
+# (mais lento; sem isso só os limites dos <record> são validados).
+VALIDAR_XML = False
+
+# Grava o índice de registros de cada parte (record_index.py).
+GRAVAR_INDICE = True
+
+MANIFESTO = "manifest.json"
+
+# Cabeçalhos maiores que isso não são cabeçalhos: algo está errado no dump.
+MAX_CABECALHO_BYTES = 1024 ** 2
+
+# Um <record> aberto há mais que isso não vai fechar: é descartado e
+# contado como truncado (sem isso ficaria inteiro na memória).
+MAX_REGISTRO_BYTES = 16 * 1024 ** 2
+
+
+# ============================================================
+# PARTES
+# ============================================================
+
+class EscritorPartes:
+    """
+    Grava registros em partes numeradas, abrindo a próxima quando a
+    atual atingiria MAX_BYTES_POR_PARTE ou MAX_REGISTROS_POR_PARTE
+    (medidos antes da compressão).
+    """
+
+    def __init__(
+        self,
+        pasta,
+        nome_parte,
+        cabecalho,
+        max_bytes=None,
+        max_registros=None,
+        primeira_parte=1,
+        compressao=None,
+    ):
+        self.pasta = pasta
+        self.nome_parte = nome_parte
+        self.cabecalho = cabecalho
+        self.rodape = RODAPE_FAKE + b"\n"
+        self.max_bytes = max_bytes
+        self.max_registros = max_registros
+        self.primeira_parte = primeira_parte
+        self.compressao = compressao
+
+        self.partes = []
+        self.f = None
+
+    def _abrir(self):
+        nome = self.nome_parte.format(self.primeira_parte + len(self.partes))
+        path = os.path.join(self.pasta, nome + COMPRESSION_EXTENSIONS[self.compressao])
+
+        self.f = open_binary_writer(path, self.compressao)
+        self.f.write(self.cabecalho)
+
+        self.path = path
+        self.tamanho = len(self.cabecalho)
+        self.offsets = array("q")
+        self.lengths = array("q")
+        self.registros = 0
+
+    def _fechar(self):
+        self.f.write(self.rodape)
+        self.f.close()
+        self.f = None
+
+        self.tamanho += len(self.rodape)
+
+        # Offsets de um arquivo comprimido não servem para o índice.
+        if GRAVAR_INDICE and self.compressao is None:
+            st = os.stat(self.path)
+            save_index(RecordIndex(
+                self.path,
+                np.frombuffer(self.offsets, dtype=np.int64),
+                np.frombuffer(self.lengths, dtype=np.int64),
+                st.st_size,
+                st.st_mtime_ns,
+            ))
+
+        self.partes.append({
+            "arquivo": os.path.basename(self.path),
+            "registros": self.registros,
+            "bytes": self.tamanho,
+            "bytes_disco": os.path.getsize(self.path),
+        })
+
+    def _cabe(self, tamanho):
+        if self.registros == 0:
+            return True
+
+        if self.max_registros is not None and self.registros >= self.max_registros:
+            return False
+
+        if self.max_bytes is not None and self.tamanho + tamanho + len(self.rodape) > self.max_bytes:
+            return False
+
+        return True
+
+    def write_records(self, buf, offsets, lengths):
+        """Grava os registros buf[offsets[i]:offsets[i] + lengths[i]], um por linha."""
+
+        visao = memoryview(buf)
+
+        for inicio, tamanho in zip(offsets.tolist(), lengths.tolist()):
+
+            if self.f is not None and not self._cabe(tamanho + 1):
+                self._fechar()
+
+            if self.f is None:
+                self._abrir()
+
+            self.f.write(visao[inicio:inicio + tamanho])
+            self.f.write(b"\n")
+
+            self.offsets.append(self.tamanho)
+            self.lengths.append(tamanho)
+            self.tamanho += tamanho + 1
+            self.registros += 1
+
+    def close(self):
+        if self.f is not None:
+            self._fechar()
+
+    @property
+    def bytes_gravados(self):
+        return sum(parte["bytes_disco"] for parte in self.partes)
+
+
+# ============================================================
+# PIPELINE
+# ============================================================
+
+def registros_validos(buf, offsets, lengths, parser):
+    """Máscara dos registros que o lxml consegue ler."""
+
+    validos = np.ones(len(offsets), dtype=bool)
+
+    for i, (inicio, tamanho) in enumerate(zip(offsets.tolist(), lengths.tolist())):
+        try:
+            etree.fromstring(buf[inicio:inicio + tamanho], parser)
+        except etree.XMLSyntaxError:
+            validos[i] = False
+
+    return validos
+
+
+def processar_dump(
+    input_file,
+    output_dir,
+    nome_parte=NOME_PARTE,
+    max_bytes=MAX_BYTES_POR_PARTE,
+    max_registros=MAX_REGISTROS_POR_PARTE,
+    num_workers=NUM_WORKERS,
+    validar_xml=VALIDAR_XML,
+    compressao=COMPRESSAO_SAIDA,
+    primeira_parte=1,
+    limpar=True,
+    manifesto=MANIFESTO,
+    tamanho_bloco=BLOCO_BYTES,
+):
+    """
+    Limpa, valida, conta e divide `input_file` em `output_dir`, lendo o
+    arquivo uma única vez. Retorna o manifesto (também gravado em
+    <output_dir>/<manifesto>, se `manifesto` não for None).
+
+    Com limpar=False os blocos não passam pelo clean_xml: só divide
+    (split_xml.py e data_split_*.py com entrada comprimida).
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    inicio_execucao = time.time()
+    tamanho_total = os.path.getsize(input_file)
+
+    estado = {"xml_decl": False, "collection": False, "meio_da_linha": False, "removendo": False}
+    contagem = {"registros": 0, "truncados": 0, "malformados": 0, "bytes_limpos": 0}
+    parser = etree.XMLParser(huge_tree=True) if validar_xml else None
+
+    # Texto antes do primeiro <record> (declaração e <collection>),
+    # repetido em cada parte; e o <record> ainda sem fechamento.
+    cabecalho = None
+    pendente = b""
+    escritor = None
+
+    with ExitStack() as arquivos:
+        fin, raw = abrir_entrada(input_file)
+
+        # O leitor (descompressão) fecha antes do arquivo em disco.
+        if raw is not None:
+            arquivos.enter_context(raw)
+
+        arquivos.enter_context(fin)
+
+        if limpar:
+            blocos = blocos_limpos(input_file, fin, raw, tamanho_bloco, num_workers)
+        else:
+            blocos = ((bloco, None, lidos) for bloco, lidos in iter_blocos(fin, tamanho_bloco, raw))
+
+        # Progresso pelo arquivo em disco (comprimido ou não).
+        with tqdm(total=tamanho_total, unit="B", unit_scale=True, unit_divisor=1024, desc="Processando", colour="yellow") as pbar:
+
+            for bloco, marcas, lidos in blocos:
+                bloco = remover_marcas(bloco, marcas, estado)
+                contagem["bytes_limpos"] += len(bloco)
+
+                buf = pendente + bloco if pendente else bloco
+                offsets, lengths, truncados, aberto = scan_records_partial(buf)
+
+                if cabecalho is None:
+                    primeiro = offsets[0] if len(offsets) else aberto
+
+                    if primeiro is None and len(buf) <= MAX_CABECALHO_BYTES:
+                        pendente = buf
+                        pbar.update(lidos)
+                        continue
+
+                    cabecalho = bytes(buf[:primeiro or 0]) or CABECALHO_FAKE + b"\n"
+
+                    if len(cabecalho) > MAX_CABECALHO_BYTES:
+                        print(f"Aviso: {len(cabecalho):,} bytes antes do primeiro <record>; usando o cabeçalho padrão.")
+                        cabecalho = CABECALHO_FAKE + b"\n"
+
+                    escritor = EscritorPartes(
+                        output_dir,
+                        nome_parte,
+                        cabecalho,
+                        max_bytes,
+                        max_registros,
+                        primeira_parte,
+                        compressao,
+                    )
+
+                if validar_xml and len(offsets):
+                    validos = registros_validos(buf, offsets, lengths, parser)
+                    contagem["malformados"] += int((~validos).sum())
+                    offsets, lengths = offsets[validos], lengths[validos]
+
+                escritor.write_records(buf, offsets, lengths)
+
+                contagem["registros"] += len(offsets)
+                contagem["truncados"] += truncados
+
+                pendente = buf[aberto:] if aberto is not None else b""
+
+                if len(pendente) > MAX_REGISTRO_BYTES:
+                    contagem["truncados"] += 1
+                    pendente = b""
+
+                pbar.update(lidos)
+
+    # No fim do arquivo, um <record> ainda aberto está truncado.
+    if cabecalho is not None and pendente:
+        contagem["truncados"] += 1
+
+    if escritor is not None:
+        escritor.close()
+        partes = escritor.partes
+        bytes_gravados = escritor.bytes_gravados
+    else:
+        partes = []
+        bytes_gravados = 0
+
+    comprimida = compression_from_path(input_file) is not None
+
+    resumo = {
+        "entrada": os.path.abspath(input_file),
+        "bytes_entrada": tamanho_total,
+        "bytes_limpos": contagem["bytes_limpos"],
+        # Com entrada comprimida, o tamanho descomprimido não é conhecido.
+        "bytes_removidos_limpeza": None if comprimida else tamanho_total - contagem["bytes_limpos"],
+        "bytes_gravados": bytes_gravados,
+        "compressao": compressao,
+        "registros": contagem["registros"],
+        "truncados": contagem["truncados"],
+        "malformados": contagem["malformados"] if validar_xml else None,
+        "limites": {"bytes": max_bytes, "registros": max_registros},
+        "indices": GRAVAR_INDICE and compressao is None,
+        "segundos": round(time.time() - inicio_execucao, 1),
+        "partes": partes,
+    }
+
+    if manifesto is not None:
+        with open(os.path.join(output_dir, manifesto), "w", encoding="utf-8") as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+    return resumo
+
+
+if __name__ == "__main__":
+    entrada = sys.argv[1] if len(sys.argv) > 1 else ARQUIVO_ENTRADA
+    saida = sys.argv[2] if len(sys.argv) > 2 else PASTA_SAIDA
+
+    manifesto = processar_dump(entrada, saida)
+
+    print(f"\n✅ {manifesto['registros']:,} registros em {len(manifesto['partes'])} parte(s) em {saida}")
+
+    if manifesto["truncados"]:
+        print(f"Registros truncados (descartados): {manifesto['truncados']:,}")
+
+    if manifesto["malformados"]:
+        print(f"Registros malformados (descartados): {manifesto['malformados']:,}")
@@ -1,13 +1,47 @@
 import os
 import json
-import gzip
+import hashlib
+import mmap
 import random
-from io import BytesIO
+import shutil
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO, TextIOWrapper
 
+import numpy as np
 import pymupdf
 from pymarc import parse_xml_to_array
 from tqdm import tqdm
 
+from countRegister import contar_arquivos
+from dataset_writer import (
+    INDEX_FILENAME,
+    WRITE_BUFFER,
+    XML_EXTENSIONS,
+    ArrowDatasetWriter,
+    CompactJsonlWriter,
+    JsonlWriter,
+    ShardedJsonlWriter,
+    compression_from_path,
+    open_binary_reader,
+)
+from dedup import (
+    DEDUP_META_FIELDS,
+    MINHASH_BANDS,
+    MINHASH_PERMS,
+    SHINGLE_SIZE,
+    Deduplicator,
+    dedup_meta,
+)
+from marc_reader import (
+    RECORD_DELIMITERS,
+    RECORD_START,
+    element_to_lite_record,
+    iter_marc_records,
+)
+from prompt_template import MARC_TEMPLATE_ID, PDF_TEMPLATE_ID, render_template
+from record_index import load_index
+
 
 # ============================================================
 # CONFIGURAÇÃO
@@ -18,14 +52,86 @@ MARC_FOLDER = os.path.join(BASE_DIR, "datasetsUnzip")
 PDF_FOLDER = MARC_FOLDER
 OUTPUT_JSONL = os.path.join(MARC_FOLDER, "train_dataset.jsonl")
 
+# Formato da saída:
+#   "jsonl"   - um único OUTPUT_JSONL;
+#   "shards"  - vários JSONL em OUTPUT_DIR, listados em um index.json;
+#   "arrow"   - shards Arrow IPC em OUTPUT_DIR (memory-map no train.py);
+#   "parquet" - shards Parquet em OUTPUT_DIR;
+#   "compact" - shards JSONL em OUTPUT_DIR só com os campos variáveis e
+#               o ID do template; o texto é montado no train.py
+#               (prompt_template.render_example).
+# Os formatos colunares têm as colunas text, source, record_id e os
+# campos estruturados do prompt.
+OUTPUT_FORMAT = "jsonl"
+OUTPUT_DIR = os.path.join(MARC_FOLDER, "train_dataset")
+
+# Limites de cada shard (o que for atingido primeiro).
+SHARD_MAX_RECORDS = 200_000
+SHARD_MAX_BYTES = 1024 ** 3
+
+# Compressão dos shards: None, "gzip" ou "zstd" (pacote zstandard).
+OUTPUT_COMPRESSION = None
+
+# Manifesto e partes já extraídas de cada XML. Permite retomar um
+# build interrompido e refazer só os arquivos que mudaram.
+BUILD_DIR = OUTPUT_JSONL + ".build"
+
 # Limite máximo de registros MARC.
 MAX_RECORDS = 5_000_000
 
 # Tamanho dos chunks dos PDFs.
 PDF_CHUNK_SIZE = 6000
 
-# Extensões aceitas.
-XML_EXTENSIONS = (".xml", ".xml.gz")
+# Total da barra de progresso dos XMLs (countRegister.py):
+#   "estimativa" - amostra de alguns MB por arquivo (segundos);
+#   "exato"      - conta os <record> de todos os arquivos;
+#   None         - usa MAX_RECORDS, como antes.
+# Arquivos com índice (.idx.npz) válido são sempre contados por ele.
+PROGRESS_COUNT = "estimativa"
+
+# Número de processos da extração dos XMLs.
+# Com 1 o processamento continua sequencial, como no original.
+NUM_WORKERS = 1
+
+# XMLs não comprimidos maiores que isso são divididos em faixas
+# de bytes (sempre começando em um <record>) entre os processos.
+SHARD_SIZE_BYTES = 512 * 1024 ** 2
+
+# Leitor dos XMLs: "iterparse" (lxml, uma passada por arquivo)
+# ou "linhas" (varredura por linhas + pymarc por registro).
+XML_READER = "iterparse"
+
+# Com o leitor iterparse, monta registros compactos (LiteRecord)
+# em vez de pymarc.Record. A saída gerada é a mesma.
+LITE_RECORDS = True
+
+# Semente do sorteio de inversão de autores, para builds reproduzíveis.
+RANDOM_SEED = 42
+
+# Reaproveita as faixas concluídas em builds anteriores.
+# Com False, o build sempre recomeça do zero.
+RESUME_BUILD = True
+
+# Incrementar quando format_marc_record mudar, para invalidar
+# as partes gravadas por versões anteriores.
+MANIFEST_VERSION = 5
+
+# Um XML é considerado inalterado quando tamanho e mtime batem com o
+# manifesto. Com True, o manifesto guarda também o SHA-256 de cada
+# XML (uma leitura a mais do arquivo inteiro no primeiro build) e um
+# arquivo só "tocado" (mtime diferente, mesmo conteúdo) é reaproveitado.
+MANIFEST_HASH = False
+
+# Eliminação de duplicatas (dedup.py), aplicada na ordem da saída:
+#   None      - mantém todos os registros;
+#   "exact"   - descarta registros com 245/100/260 normalizados iguais;
+#   "minhash" - descarta também quase duplicatas (MinHash + LSH), com
+#               memória fixa de DEDUP_LSH_MEMORY_MB.
+DEDUP_MODE = None
+DEDUP_LSH_MEMORY_MB = 256
+
+# Lista dos registros descartados (origem, 001, motivo e título).
+DEDUP_REPORT = OUTPUT_JSONL + ".dedup.jsonl"
 
 
 # ============================================================
@@ -40,6 +146,10 @@ def validate_paths():
     print(f"MARC_FOLDER:  {MARC_FOLDER}")
     print(f"PDF_FOLDER:   {PDF_FOLDER}")
     print(f"OUTPUT_JSONL: {OUTPUT_JSONL}")
+    print(f"BUILD_DIR:    {BUILD_DIR}")
+
+    if OUTPUT_FORMAT != "jsonl":
+        print(f"OUTPUT_DIR:   {OUTPUT_DIR}")
 
     if not os.path.isdir(MARC_FOLDER):
         raise FileNotFoundError(
@@ -60,11 +170,10 @@ def validate_paths():
 # FORMATAÇÃO DO REGISTRO MARC
 # ============================================================
 
-def format_marc_record(record):
+def extract_prompt_fields(record):
     """
-    Converte um registro pymarc em um exemplo de treinamento.
-
-    A estrutura do prompt original foi preservada.
+    Extrai de um registro pymarc (ou LiteRecord) os campos usados
+    no prompt: full_title, author_prompt, year, edition e imprint.
     """
 
     # --------------------------------------------------------
@@ -166,52 +275,49 @@ def format_marc_record(record):
         pub = record["264"].get("b", "")
         imprint = f"{loc} : {pub}, {year}".strip(" :,")
 
-    # --------------------------------------------------------
-    # Prompt
-    # --------------------------------------------------------
+    return {
+        "full_title": full_title,
+        "author_prompt": author_prompt,
+        "year": year,
+        "edition": edition,
+        "imprint": imprint,
+    }
+
+
+def render_marc_prompt(fields, marc_text):
+    """
+    Monta o texto de treinamento a partir dos campos extraídos
+    (extract_prompt_fields) e do registro em texto (str(record)).
+
+    O texto fixo vem do template MARC_TEMPLATE_ID (prompt_template.py).
+    """
+
+    return render_template(
+        MARC_TEMPLATE_ID,
+        {**fields, "marc_text": marc_text},
+    )
+
+
+def format_marc_record(record):
+    """
+    Converte um registro pymarc (ou LiteRecord) em um exemplo
+    de treinamento.
+    """
+
+    fields = extract_prompt_fields(record)
+
+    return {"text": render_marc_prompt(fields, str(record))}
+
+
+def record_id(record):
+    """Conteúdo do campo 001 do registro, ou "" se ausente."""
+
+    field = record.get("001")
 
-    prompt = f"""<|im_start|>user
-Você é um catalogador profissional do SiBi/UFPR e deve seguir **rigorosamente** o Manual de Catalogação do SiBi/UFPR versão 2025.
-
-Regras obrigatórias:
-  tag indicador 1 indicador 2: descrição da tag
-- 090 0 ?: código de classificação, usar Classificação Decimal de Dewey (CDD) ou Classificação Decimal Universal (CDU) conforme disponível; se ambos, priorizar CDD
-- 100 ? ?: usar subcampos a, c, q, d conforme forma autorizada; se autor corporativo, usar 110 ou 111
-- 240 ? ?: usar para títulos uniformes, com subcampo a para título e subcampo d para data de criação (ex: "Brasil. Ministério da Educação. Secretaria de Educação Superior. Universidade Federal do Paraná. Setor de Ciências Humanas, Letras e Artes. Departamento de História. Curso de História.")
-- 245 ? ?: título principal no subcampo a, subtítulo no subcampo b, responsabilidade no subcampo c; transcrever exatamente sem pontuação extra
-- 250 ? ?: edição ignorar reimpressões; só registrar 1ª edição se aparecer explicitamente
-- 260/264 ? ?: imprenta, usar [S.l.] quando não houver local, [s.n.] quando não houver editora; datas aproximadas entre colchetes [19--], [201-], etc.
-- 300 ? ?: descrição física, usar subcampos a para extensão (ex: "300 p."), b para ilustrações (ex: "il.") e c para dimensões (ex: "21 cm")
-- 490 0 ?: série, usar subcampo a para título da série e subcampo v para número da série (ex: "490 0 $a Coleção UFPR. $v 10")
-- 500 ? ?: notas gerais, usar subcampo a para texto da nota (ex: "500 $a Inclui bibliografia.")
-- 504 ? ?: bibliografia, usar subcampo a para texto da nota (ex: "504 $a Bibliografia: p. 290-300.")
-- 505 ? ?: sumário, usar subcampo a para texto do sumário (ex: "505 $a Capítulo 1: Introdução -- Capítulo 2: Metodologia.")
-- 590 ? ?: notas locais, usar subcampo a para texto da nota (ex: "590 $a Exemplar disponível apenas para consulta local.")
-- 600 ? ?: assuntos, usar subcampos a para assunto principal, x para subdivisão de assunto, z para localidade e y para forma de assunto
-- 650 ? ?: usar LCSH da LC ou DeCS da BIREME, Autoridades da Fundação Biblioteca Nacional, com subcampos a, x, z, y conforme aplicável, em português brasileiro
-- 700 ? ?: autores secundários, usar subcampos a, c, q, d conforme forma autorizada; se autor corporativo, usar apenas o 710
-- 710 ? ?: autores corporativos, usar subcampos a para nome da entidade, c para data de criação, q para qualificação e d para data de extinção
-- 740 ? ?: títulos relacionados, usar subcampo a para título e subcampo d para data de criação. Não usar o 730.
-
-Gere o registro MARC21 completo para este livro aplicando todas as regras acima.
-
-ATENÇÃO ÀS SEGUINTES TAREFAS INTELECTUAIS:
-1. Você deve deduzir e classificar os assuntos (tags 650) em português brasileiro com base no título e autor da obra.
-2. Se não houver informação disponível para um campo específico (ex: sem indicação de edição), apenas omita a tag do registro final. Não gere campos vazios.
-
-Título completo: {full_title}
-Autor: {author_prompt}
-Ano: {year}
-Edição: {edition}
-Imprenta: {imprint}
-
-Responda **APENAS** com o registro MARC completo (todos os campos necessários, com indicadores e subcampos exatos).
-<|im_end|>
-<|im_start|>assistant
-{str(record)}
-<|im_end|>"""
-
-    return {"text": prompt}
+    if field is None:
+        return ""
+
+    return field.data or ""
 
 
 # ============================================================
@@ -220,15 +326,14 @@ Responda **APENAS** com o registro MARC completo (todos os campos necessários,
 
 def open_text_file(filepath):
     """
-    Abre XML normal ou XML.GZ em modo texto.
+    Abre XML normal, .xml.gz ou .xml.zst em modo texto.
 
     Retorna um context manager.
     """
 
-    if filepath.lower().endswith(".gz"):
-        return gzip.open(
-            filepath,
-            mode="rt",
+    if compression_from_path(filepath) is not None:
+        return TextIOWrapper(
+            open_binary_reader(filepath),
             encoding="utf-8",
             errors="ignore",
         )
@@ -272,66 +377,147 @@ def parse_single_marc_record(xml_chunk):
     return None
 
 
-def map_xml_robusto(process_record_func, filepath, pbar_xml, state):
+def iter_xml_lines(filepath, start=0, end=None):
     """
-    Lê XML/XML.GZ registro por registro.
+    Itera as linhas de um XML/XML.GZ já decodificadas.
 
-    Registros XML corrompidos são descartados individualmente,
-    permitindo que o processamento continue.
+    Para XML não comprimido é possível limitar a leitura à faixa
+    de bytes [start, end). A faixa deve começar na linha de um
+    <record>; a leitura para na primeira linha iniciada em `end`.
+    """
 
-    state é um dicionário compartilhado contendo:
-        state["count"]
-        state["errors"]
+    if start == 0 and end is None:
+        with open_text_file(filepath) as f:
+            yield from f
+        return
+
+    if compression_from_path(filepath) is not None:
+        raise ValueError(
+            f"Faixas de bytes não são suportadas em arquivos comprimidos: {filepath}"
+        )
+
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        pos = start
+
+        for raw in f:
+
+            if end is not None and pos >= end:
+                break
+
+            pos += len(raw)
+
+            yield raw.decode("utf-8", errors="ignore")
+
+
+def iter_records_por_linhas(filepath, state, start=0, end=None):
+    """
+    Leitor antigo: varre as linhas procurando <record> e faz o
+    parsing de cada registro separadamente com o pymarc.
+
+    Mantido como alternativa (XML_READER = "linhas") e como
+    referência de desempenho para o leitor iterparse.
     """
 
     record_buffer = []
     in_record = False
 
-    try:
-        with open_text_file(filepath) as f:
+    for line in iter_xml_lines(filepath, start, end):
 
-            for line in f:
+        # Início de um registro.
+        if "<record" in line:
 
-                if state["count"] >= MAX_RECORDS:
-                    break
+            in_record = True
+            record_buffer = [line]
+
+            # Caso <record> e </record> estejam na mesma linha.
+            if "</record>" in line:
+                in_record = False
+
+        elif in_record:
+
+            record_buffer.append(line)
 
-                # Início de um registro.
-                if "<record" in line:
+            if "</record>" in line:
+                in_record = False
 
-                    in_record = True
-                    record_buffer = [line]
+        # Só processa quando encontrou o fechamento.
+        if not in_record and record_buffer:
 
-                    # Caso <record> e </record> estejam na mesma linha.
-                    if "</record>" in line:
-                        in_record = False
+            xml_chunk = "".join(record_buffer)
+            record_buffer = []
 
-                elif in_record:
+            try:
+                record = parse_single_marc_record(xml_chunk)
 
-                    record_buffer.append(line)
+            except Exception:
+                state["errors"] += 1
 
-                    if "</record>" in line:
-                        in_record = False
+                # Mantém o processamento dos demais registros.
+                continue
 
-                # Só processa quando encontrou o fechamento.
-                if not in_record and record_buffer:
+            if record is not None:
+                yield record
 
-                    xml_chunk = "".join(record_buffer)
-                    record_buffer = []
 
-                    try:
-                        record = parse_single_marc_record(xml_chunk)
+def map_xml_robusto(
+    process_record_func,
+    filepath,
+    pbar_xml,
+    state,
+    start=0,
+    end=None,
+    should_stop=None,
+):
+    """
+    Lê XML/XML.GZ registro por registro.
 
-                        if record is not None:
-                            process_record_func(record)
+    Registros XML corrompidos são descartados individualmente,
+    permitindo que o processamento continue.
 
-                    except Exception:
-                        state["errors"] += 1
+    O leitor é escolhido por XML_READER: "iterparse" (padrão, uma
+    única passada do lxml) ou "linhas" (leitor antigo). Com
+    LITE_RECORDS, o iterparse entrega LiteRecord em vez de
+    pymarc.Record.
 
-                        # Mantém o processamento dos demais registros.
-                        continue
+    start/end limitam a leitura a uma faixa de bytes do arquivo
+    (ver iter_xml_lines), usada pelo modo paralelo. should_stop,
+    se informado, é consultado após cada registro e interrompe
+    a leitura quando retorna True.
 
-                if state["count"] >= MAX_RECORDS:
-                    break
+    state é um dicionário compartilhado contendo:
+        state["count"]
+        state["errors"]
+    """
+
+    try:
+        if XML_READER == "linhas":
+            records = iter_records_por_linhas(filepath, state, start, end)
+        else:
+            records = iter_marc_records(
+                filepath,
+                state,
+                start,
+                end,
+                factory=element_to_lite_record if LITE_RECORDS else None,
+            )
+
+        for record in records:
+
+            if state["count"] >= MAX_RECORDS:
+                break
+
+            try:
+                process_record_func(record)
+
+            except Exception:
+                state["errors"] += 1
+
+                # Mantém o processamento dos demais registros.
+                continue
+
+            if should_stop is not None and should_stop():
+                break
 
     except Exception as exc:
         raise RuntimeError(
@@ -345,7 +531,7 @@ def map_xml_robusto(process_record_func, filepath, pbar_xml, state):
 
 def find_xml_files(folder):
     """
-    Localiza arquivos .xml e .xml.gz.
+    Localiza arquivos .xml, .xml.gz e .xml.zst.
 
     Os arquivos são ordenados pelo tamanho, do menor
     para o maior, mantendo a estratégia original.
@@ -369,13 +555,749 @@ def find_xml_files(folder):
     return arquivos_xml
 
 
+# ============================================================
+# FAIXAS DE EXTRAÇÃO
+# ============================================================
+
+# Evento compartilhado que avisa os processos para pararem
+# quando o MAX_RECORDS já foi atingido na saída final.
+_stop_event = None
+
+# Contagem de exemplos já extraídos por faixa (na ordem da saída),
+# compartilhada entre os processos do modo paralelo. Cada faixa só
+# precisa extrair o que falta para o MAX_RECORDS depois das faixas
+# que vêm antes dela na saída.
+_task_counts = None
+
+# De quantos em quantos registros uma faixa relê as contagens das
+# faixas anteriores. Cada faixa extrai no máximo isso além do limite.
+BUDGET_CHECK_EVERY = 256
+
+
+def find_record_offset(mm, offset, index=None):
+    """
+    Retorna o offset da primeira linha com <record a partir de `offset`.
+
+    A linha parcial em `offset` é descartada. Se não houver mais
+    registros, retorna o tamanho do arquivo. Com o índice de registros
+    (record_index.py), o registro vem dele; sem, a tag é procurada
+    direto nos bytes do mmap, a partir de `offset`.
+    """
+
+    nova_linha = mm.find(b"\n", offset)
+
+    if nova_linha < 0:
+        return len(mm)
+
+    if index is not None:
+        i = int(np.searchsorted(index.offsets, nova_linha + 1))
+
+        if i >= len(index):
+            return len(mm)
+
+        inicio = int(index.offsets[i])
+
+    else:
+        pos = nova_linha + 1
+
+        while True:
+            inicio = mm.find(RECORD_START, pos)
+
+            if inicio < 0:
+                return len(mm)
+
+            # Ignora <records>, <recordInfo> etc.
+            fim_tag = inicio + len(RECORD_START)
+
+            if mm[fim_tag:fim_tag + 1] in RECORD_DELIMITERS:
+                break
+
+            pos = fim_tag
+
+    return mm.rfind(b"\n", 0, inicio) + 1
+
+
+def plan_file_ranges(path):
+    """
+    Divide um XML em faixas de bytes (start, end).
+
+    Arquivos comprimidos e menores que SHARD_SIZE_BYTES viram uma
+    faixa só. Um arquivo comprimido não tem ponto de retomada: se o
+    build for interrompido no meio dele, ele é relido do início.
+
+    Os demais são cortados a cada ~SHARD_SIZE_BYTES, sempre no início
+    da linha do <record> seguinte. O corte é achado com um seek e uma
+    busca curta no mmap; o índice de registros só é usado se já
+    existir (não vale varrer o arquivo inteiro só para isso).
+    """
+
+    size = os.path.getsize(path)
+
+    if compression_from_path(path) is not None or size <= SHARD_SIZE_BYTES:
+        return [(0, None)]
+
+    index = load_index(path)
+    cortes = [0]
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        for offset in range(SHARD_SIZE_BYTES, size, SHARD_SIZE_BYTES):
+
+            corte = find_record_offset(mm, offset, index)
+
+            if cortes[-1] < corte < size:
+                cortes.append(corte)
+
+    cortes.append(None)
+
+    return list(zip(cortes, cortes[1:]))
+
+
+def _init_worker(stop_event, task_counts=None):
+    """Inicializa cada processo do pool com o evento de parada e as contagens."""
+
+    global _stop_event, _task_counts
+    _stop_event = stop_event
+    _task_counts = task_counts
+
+
+def process_xml_task(task, pbar_xml=None):
+    """
+    Extrai uma faixa de um XML para o seu arquivo parcial.
+
+    Ao lado de cada parte fica um arquivo .meta.jsonl, linha a linha
+    alinhado com ela, com os campos estruturados de cada exemplo
+    (template, origem, 001, campos do prompt e registro em texto),
+    usados pelas saídas colunares e pelo formato compacto, e as
+    chaves de deduplicação (dedup.dedup_meta).
+
+    task = (path, start, end, part_path, limite, ordem). Roda tanto
+    em um processo do pool quanto no processo principal (modo
+    sequencial). No modo paralelo, ordem é a posição da faixa na
+    saída: a faixa publica sua contagem em _task_counts e para quando
+    ela, somada às das faixas anteriores, chega ao limite.
+
+    Retorna o estado local da faixa: count, errors e completo
+    (True quando a faixa foi lida até o fim, sem ser interrompida
+    pelo limite ou pelo evento de parada). Se a leitura falhar no
+    meio (ex.: .gz corrompido), a faixa fica com os registros lidos
+    até ali, falha recebe a mensagem do erro e ela conta como
+    completa: rodar de novo chegaria ao mesmo erro.
+    """
+
+    path, start, end, part_path, limite, ordem = task
+
+    # Semente por faixa: o resultado não depende do agendamento
+    # nem das demais faixas, o que permite reaproveitá-las.
+    random.seed(f"{RANDOM_SEED}:{os.path.basename(path)}:{start}")
+
+    state = {
+        "count": 0,
+        "errors": 0,
+    }
+
+    # Registros já extraídos pelas faixas anteriores, relidos a cada
+    # BUDGET_CHECK_EVERY registros. Só cresce, então o limite efetivo
+    # da faixa (limite - anteriores) só diminui.
+    budget = {"anteriores": 0, "proxima_leitura": 0, "interrompida": False}
+
+    def should_stop():
+        if _task_counts is not None:
+            _task_counts[ordem] = state["count"]
+
+            if state["count"] >= budget["proxima_leitura"]:
+                budget["anteriores"] = sum(_task_counts[:ordem])
+                budget["proxima_leitura"] = state["count"] + BUDGET_CHECK_EVERY
+
+        budget["interrompida"] = (
+            budget["anteriores"] + state["count"] >= limite
+            or (_stop_event is not None and _stop_event.is_set())
+        )
+
+        return budget["interrompida"]
+
+    source = os.path.basename(path)
+
+    with open(
+        part_path,
+        "w",
+        encoding="utf-8",
+        buffering=WRITE_BUFFER,
+    ) as part_file, open(
+        meta_path(part_path),
+        "w",
+        encoding="utf-8",
+        buffering=WRITE_BUFFER,
+    ) as meta_file:
+
+        def process_record(record):
+
+            if budget["anteriores"] + state["count"] >= limite:
+                return
+
+            fields = extract_prompt_fields(record)
+            marc_text = str(record)
+
+            item = {"text": render_marc_prompt(fields, marc_text)}
+
+            part_file.write(
+                json.dumps(
+                    item,
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+            meta = {
+                "template": MARC_TEMPLATE_ID,
+                "source": source,
+                "record_id": record_id(record),
+                **fields,
+                "marc_text": marc_text,
+                **dedup_meta(record, DEDUP_MODE),
+            }
+
+            meta_file.write(
+                json.dumps(
+                    meta,
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+            state["count"] += 1
+
+            if pbar_xml is not None:
+                pbar_xml.update(1)
+
+        try:
+            map_xml_robusto(
+                process_record,
+                path,
+                pbar_xml,
+                state,
+                start,
+                end,
+                should_stop=should_stop,
+            )
+
+        except RuntimeError as exc:
+            state["falha"] = str(exc)
+
+    state["completo"] = "falha" in state or not budget["interrompida"]
+
+    return state
+
+
+def meta_path(part_path):
+    """Caminho do .meta.jsonl que acompanha um arquivo parcial."""
+
+    return part_path[:-len(".jsonl")] + ".meta.jsonl"
+
+
+def copy_part(part_path, output_file, limite, dedup=None):
+    """
+    Copia até `limite` exemplos de um arquivo parcial para a saída,
+    descartando as duplicatas apontadas por `dedup` (Deduplicator).
+
+    Os metadados só são lidos quando a saída ou a deduplicação
+    precisam deles. Retorna o número de exemplos copiados.
+    """
+
+    copied = 0
+
+    with open(
+        part_path,
+        "r",
+        encoding="utf-8",
+        buffering=WRITE_BUFFER,
+    ) as part_file:
+
+        if not output_file.needs_meta and dedup is None:
+
+            for line in part_file:
+
+                if copied >= limite:
+                    break
+
+                output_file.write_example(line)
+                copied += 1
+
+            return copied
+
+        with open(
+            meta_path(part_path),
+            "r",
+            encoding="utf-8",
+            buffering=WRITE_BUFFER,
+        ) as meta_file:
+
+            for line, meta_line in zip(part_file, meta_file):
+
+                if copied >= limite:
+                    break
+
+                meta = json.loads(meta_line)
+
+                if dedup is not None and dedup.check(meta):
+                    continue
+
+                if output_file.needs_meta:
+                    for name in DEDUP_META_FIELDS:
+                        meta.pop(name, None)
+
+                    output_file.write_example(line, meta)
+                else:
+                    output_file.write_example(line)
+
+                copied += 1
+
+    return copied
+
+
+# ============================================================
+# BUILD INCREMENTAL (MANIFESTO)
+# ============================================================
+
+def manifest_path():
+    return os.path.join(BUILD_DIR, "manifest.json")
+
+
+def build_config():
+    """
+    Parâmetros que mudam o conteúdo das partes.
+
+    Se algum deles mudar, o build recomeça do zero.
+    """
+
+    return {
+        "versao": MANIFEST_VERSION,
+        "random_seed": RANDOM_SEED,
+        "shard_size_bytes": SHARD_SIZE_BYTES,
+        "minhash": (
+            [MINHASH_PERMS, MINHASH_BANDS, SHINGLE_SIZE]
+            if DEDUP_MODE == "minhash"
+            else None
+        ),
+    }
+
+
+def file_content_hash(filepath):
+    """SHA-256 do conteúdo do arquivo, lido em blocos grandes."""
+
+    digest = hashlib.sha256()
+
+    with open(filepath, "rb") as f:
+
+        for bloco in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            digest.update(bloco)
+
+    return digest.hexdigest()
+
+
+def load_manifest():
+    """
+    Carrega o manifesto do build anterior.
+
+    Sem manifesto, com RESUME_BUILD desligado ou com outra
+    configuração, o diretório de build é limpo e um manifesto
+    vazio é retornado.
+    """
+
+    if RESUME_BUILD and os.path.isfile(manifest_path()):
+
+        with open(manifest_path(), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("config") == build_config():
+            return manifest
+
+        print("\nConfiguração do build mudou: recomeçando do zero.")
+
+    shutil.rmtree(BUILD_DIR, ignore_errors=True)
+    os.makedirs(BUILD_DIR, exist_ok=True)
+
+    return {
+        "config": build_config(),
+        "arquivos": {},
+    }
+
+
+def save_manifest(manifest):
+    """Grava o manifesto de forma atômica (tmp + rename)."""
+
+    tmp_path = manifest_path() + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    os.replace(tmp_path, manifest_path())
+
+
+def remove_parts(entry):
+    """Apaga os arquivos parciais de um XML do manifesto."""
+
+    for faixa in entry["faixas"]:
+
+        part_path = os.path.join(BUILD_DIR, faixa["parte"])
+
+        for path in (part_path, meta_path(part_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def is_unchanged(entry, path):
+    """
+    Verifica se um XML continua igual ao do manifesto.
+
+    Tamanho e mtime iguais bastam. Se só o mtime mudou (arquivo
+    copiado ou "tocado"), o hash do conteúdo decide, quando o
+    manifesto tem um (MANIFEST_HASH).
+    """
+
+    stat = os.stat(path)
+
+    if stat.st_size != entry["size"]:
+        return False
+
+    if stat.st_mtime_ns == entry["mtime"]:
+        return True
+
+    if not MANIFEST_HASH or entry.get("hash") is None:
+        return False
+
+    if file_content_hash(path) != entry["hash"]:
+        return False
+
+    entry["mtime"] = stat.st_mtime_ns
+
+    return True
+
+
+def update_file_progress(entry):
+    """
+    Atualiza o progresso agregado de um XML a partir das faixas.
+
+    offset é o ponto do arquivo até onde tudo já foi gravado:
+    o início da primeira faixa incompleta.
+    """
+
+    entry["offset"] = entry["size"]
+
+    for faixa in entry["faixas"]:
+
+        if not faixa["completo"]:
+            entry["offset"] = faixa["start"]
+            break
+
+    entry["records"] = sum(faixa["records"] for faixa in entry["faixas"])
+    entry["completo"] = all(faixa["completo"] for faixa in entry["faixas"])
+
+
+def sync_manifest(manifest, arquivos_xml):
+    """
+    Alinha o manifesto com os XMLs atuais.
+
+    XMLs removidos ou alterados têm suas partes descartadas; XMLs
+    novos ou alterados são (re)planejados em faixas. Retorna a lista
+    ordenada de (path, faixa) a compor a saída.
+    """
+
+    arquivos = manifest["arquivos"]
+
+    for path in list(arquivos):
+
+        if path not in arquivos_xml:
+            remove_parts(arquivos.pop(path))
+
+    tasks = []
+
+    for path in arquivos_xml:
+
+        entry = arquivos.get(path)
+
+        if entry is not None and not is_unchanged(entry, path):
+
+            print(
+                f"Arquivo alterado desde o último build: "
+                f"{os.path.basename(path)}"
+            )
+
+            remove_parts(entry)
+            entry = None
+
+        if entry is None:
+
+            stat = os.stat(path)
+
+            entry = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "hash": file_content_hash(path) if MANIFEST_HASH else None,
+                "faixas": [
+                    {
+                        "start": start,
+                        "end": end,
+                        "parte": (
+                            f"{os.path.basename(path)}."
+                            f"{start:013d}.jsonl"
+                        ),
+                        "records": 0,
+                        "errors": 0,
+                        "completo": False,
+                    }
+                    for start, end in plan_file_ranges(path)
+                ],
+            }
+
+            update_file_progress(entry)
+            arquivos[path] = entry
+
+        for faixa in entry["faixas"]:
+            tasks.append((path, faixa))
+
+    save_manifest(manifest)
+
+    return tasks
+
+
+# ============================================================
+# EXTRAÇÃO DOS XMLs
+# ============================================================
+
+def run_extraction(arquivos_xml, output_file, pbar_xml, state, dedup=None):
+    """
+    Extrai os XMLs faixa a faixa, retomando o build anterior.
+
+    Faixas já concluídas (conforme o manifesto) são reaproveitadas;
+    as demais rodam no próprio processo ou, com NUM_WORKERS > 1, em
+    um pool de processos. Depois de cada faixa o manifesto é gravado.
+
+    As partes são concatenadas na ordem das faixas, então a saída é
+    a mesma a cada execução. A deduplicação (`dedup`) e o limite
+    MAX_RECORDS são aplicados na concatenação; ao atingir o limite,
+    as faixas restantes são canceladas.
+    """
+
+    manifest = load_manifest()
+    tasks = sync_manifest(manifest, arquivos_xml)
+
+    def part_path(faixa):
+        return os.path.join(BUILD_DIR, faixa["parte"])
+
+    def reusable(faixa):
+        return (
+            faixa["completo"]
+            and os.path.isfile(part_path(faixa))
+            and os.path.isfile(meta_path(part_path(faixa)))
+        )
+
+    def record_result(path, faixa, task_state):
+        faixa["records"] = task_state["count"]
+        faixa["errors"] = task_state["errors"]
+        faixa["completo"] = task_state["completo"]
+        faixa["falha"] = task_state.get("falha")
+
+        if faixa["falha"]:
+            print(
+                f"\n[AVISO] Leitura interrompida em "
+                f"{os.path.basename(path)} [{faixa['start']:,}] depois de "
+                f"{faixa['records']:,} registro(s): {faixa['falha']}"
+            )
+
+        update_file_progress(manifest["arquivos"][path])
+        save_manifest(manifest)
+
+    def merge(faixa, contar_progresso):
+        copied = copy_part(
+            part_path(faixa),
+            output_file,
+            MAX_RECORDS - state["count"],
+            dedup,
+        )
+
+        state["count"] += copied
+        state["output_count"] += copied
+        state["errors"] += faixa["errors"]
+
+        if faixa.get("falha"):
+            state["failed_ranges"] += 1
+
+        if contar_progresso:
+            pbar_xml.update(copied)
+
+    reaproveitadas = sum(1 for _, faixa in tasks if reusable(faixa))
+
+    print(
+        f"\n{len(tasks)} faixa(s) de XML; "
+        f"{reaproveitadas} reaproveitada(s) do build anterior."
+    )
+
+    # --------------------------------------------------------
+    # Modo sequencial
+    # --------------------------------------------------------
+
+    if NUM_WORKERS <= 1:
+
+        for index, (path, faixa) in enumerate(tasks):
+
+            if state["count"] >= MAX_RECORDS:
+                break
+
+            if reusable(faixa):
+                merge(faixa, contar_progresso=True)
+                continue
+
+            print(f"\nLendo: {os.path.basename(path)} [{faixa['start']:,}]...")
+
+            # Com deduplicação, parte dos registros pode ser descartada
+            # na concatenação: a faixa não pode parar no que falta.
+            limite = MAX_RECORDS if dedup is not None else MAX_RECORDS - state["count"]
+
+            task_state = process_xml_task(
+                (
+                    path,
+                    faixa["start"],
+                    faixa["end"],
+                    part_path(faixa),
+                    limite,
+                    index,
+                ),
+                pbar_xml,
+            )
+
+            record_result(path, faixa, task_state)
+            merge(faixa, contar_progresso=False)
+
+        return
+
+    # --------------------------------------------------------
+    # Modo paralelo
+    # --------------------------------------------------------
+
+    print(f"Modo paralelo: {NUM_WORKERS} processo(s).")
+
+    stop_event = multiprocessing.Event()
+
+    # Sem deduplicação, cada exemplo extraído chega à saída, então as
+    # faixas podem parar no que falta para o MAX_RECORDS depois das
+    # anteriores. Com deduplicação, parte deles é descartada na
+    # concatenação e cada faixa extrai até MAX_RECORDS.
+    task_counts = None
+
+    if dedup is None:
+        task_counts = multiprocessing.RawArray("q", len(tasks))
+
+        for index, (_, faixa) in enumerate(tasks):
+            if reusable(faixa):
+                task_counts[index] = faixa["records"]
+
+    executor = ProcessPoolExecutor(
+        max_workers=NUM_WORKERS,
+        initializer=_init_worker,
+        initargs=(stop_event, task_counts),
+    )
+
+    futures = {}
+
+    try:
+        for index, (path, faixa) in enumerate(tasks):
+
+            if reusable(faixa):
+                continue
+
+            future = executor.submit(
+                process_xml_task,
+                (
+                    path,
+                    faixa["start"],
+                    faixa["end"],
+                    part_path(faixa),
+                    MAX_RECORDS,
+                    index,
+                ),
+            )
+
+            futures[future] = index
+
+        # Próxima faixa a ser concatenada na saída.
+        proxima = 0
+
+        pendentes = set(futures)
+        concluidas = set()
+
+        while proxima < len(tasks) and state["count"] < MAX_RECORDS:
+
+            path, faixa = tasks[proxima]
+
+            if proxima not in concluidas and not reusable(faixa):
+
+                # Registra no manifesto cada faixa assim que termina,
+                # mesmo fora de ordem, até a próxima ficar pronta.
+                done, pendentes = wait(
+                    pendentes,
+                    return_when=FIRST_COMPLETED,
+                )
+
+                for future in done:
+                    done_path, done_faixa = tasks[futures[future]]
+                    record_result(done_path, done_faixa, future.result())
+                    concluidas.add(futures[future])
+
+                continue
+
+            merge(faixa, contar_progresso=True)
+            proxima += 1
+
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ============================================================
+# SAÍDA
+# ============================================================
+
+def open_output():
+    """
+    Abre o destino dos exemplos conforme OUTPUT_FORMAT.
+
+    Todos os escritores aceitam write_example(linha_jsonl, meta, texto).
+    """
+
+    if OUTPUT_FORMAT == "shards":
+        return ShardedJsonlWriter(
+            OUTPUT_DIR,
+            max_records=SHARD_MAX_RECORDS,
+            max_bytes=SHARD_MAX_BYTES,
+            compression=OUTPUT_COMPRESSION,
+        )
+
+    if OUTPUT_FORMAT == "compact":
+        return CompactJsonlWriter(
+            OUTPUT_DIR,
+            max_records=SHARD_MAX_RECORDS,
+            max_bytes=SHARD_MAX_BYTES,
+            compression=OUTPUT_COMPRESSION,
+        )
+
+    if OUTPUT_FORMAT in ("arrow", "parquet"):
+        return ArrowDatasetWriter(
+            OUTPUT_DIR,
+            fmt=OUTPUT_FORMAT,
+            max_records=SHARD_MAX_RECORDS,
+        )
+
+    return JsonlWriter(OUTPUT_JSONL)
+
+
 # ============================================================
 # PROCESSAMENTO DOS PDFs
 # ============================================================
 
 def process_pdfs(output_file, state):
     """
-    Processa PDFs e adiciona seus chunks diretamente ao JSONL.
+    Processa PDFs e adiciona seus chunks diretamente à saída.
 
     Não acumula todos os exemplos em memória.
     """
@@ -425,24 +1347,27 @@ def process_pdfs(output_file, state):
                     continue
 
                 item = {
-                    "text": (
-                        "<|im_start|>user\n"
-                        "Explique as regras de catalogação MARC "
-                        "a partir deste trecho do documento:\n"
-                        f"{chunk}\n"
-                        "<|im_end|>\n"
-                        "<|im_start|>assistant\n"
-                        f"{chunk}\n"
-                        "<|im_end|>"
+                    "text": render_template(
+                        PDF_TEMPLATE_ID,
+                        {"chunk": chunk},
                     )
                 }
 
-                output_file.write(
+                meta = {
+                    "template": PDF_TEMPLATE_ID,
+                    "source": filename,
+                    "record_id": f"{filename}#{i // PDF_CHUNK_SIZE}",
+                    "chunk": chunk,
+                }
+
+                output_file.write_example(
                     json.dumps(
                         item,
                         ensure_ascii=False,
                     )
-                    + "\n"
+                    + "\n",
+                    meta,
+                    item["text"],
                 )
 
                 state["output_count"] += 1
@@ -474,7 +1399,7 @@ def main():
 
     if not arquivos_xml:
         raise FileNotFoundError(
-            f"\nNenhum arquivo .xml ou .xml.gz encontrado em:\n"
+            f"\nNenhum arquivo .xml, .xml.gz ou .xml.zst encontrado em:\n"
             f"{MARC_FOLDER}"
         )
 
@@ -482,12 +1407,25 @@ def main():
         f"\nEncontrados {len(arquivos_xml)} arquivo(s) XML."
     )
 
+    # Registros por arquivo, para o total da barra de progresso.
+    contagens = (
+        contar_arquivos(arquivos_xml, PROGRESS_COUNT)
+        if PROGRESS_COUNT
+        else {}
+    )
+
     for path in arquivos_xml:
         size_mb = os.path.getsize(path) / (1024 ** 2)
 
+        if path in contagens:
+            registros, exato = contagens[path]
+            registros = f", {'' if exato else '~'}{registros:,} registros"
+        else:
+            registros = ""
+
         print(
             f"  - {os.path.basename(path)} "
-            f"({size_mb:.2f} MB)"
+            f"({size_mb:.2f} MB{registros})"
         )
 
     # --------------------------------------------------------
@@ -499,95 +1437,66 @@ def main():
         "errors": 0,
         "output_count": 0,
         "pdf_errors": 0,
+        "failed_ranges": 0,
     }
 
     # --------------------------------------------------------
     # Barra de progresso
     # --------------------------------------------------------
 
+    if contagens:
+        total_xml = min(
+            MAX_RECORDS,
+            sum(registros for registros, _ in contagens.values()),
+        )
+    else:
+        total_xml = MAX_RECORDS
+
     pbar_xml = tqdm(
-        total=MAX_RECORDS,
+        total=total_xml,
         desc="Extraindo XML",
         unit=" reg",
         colour="green",
     )
 
     # --------------------------------------------------------
-    # Abre o JSONL uma única vez.
+    # Abre a saída uma única vez.
     #
     # Isso evita armazenar milhões de registros em `data`.
+    # O conteúdo vem das partes de BUILD_DIR, na ordem das faixas.
     # --------------------------------------------------------
 
-    with open(
-        OUTPUT_JSONL,
-        "w",
-        encoding="utf-8",
-    ) as output_file:
-
-        def process_record(record):
-            """
-            Callback chamado para cada registro MARC válido.
-            """
-
-            if state["count"] >= MAX_RECORDS:
-                return
-
-            item = format_marc_record(record)
-
-            output_file.write(
-                json.dumps(
-                    item,
-                    ensure_ascii=False,
-                )
-                + "\n"
-            )
-
-            state["count"] += 1
-            state["output_count"] += 1
+    dedup = (
+        Deduplicator(DEDUP_MODE, DEDUP_REPORT, DEDUP_LSH_MEMORY_MB)
+        if DEDUP_MODE
+        else None
+    )
 
-            pbar_xml.update(1)
+    with open_output() as output_file:
 
         # ----------------------------------------------------
         # Processamento dos XMLs
         # ----------------------------------------------------
 
-        for path in arquivos_xml:
-
-            if state["count"] >= MAX_RECORDS:
-                break
-
-            filename = os.path.basename(path)
-
-            print(f"\nLendo: {filename}...")
-
-            map_xml_robusto(
-                process_record,
-                path,
-                pbar_xml,
-                state,
-            )
+        run_extraction(
+            arquivos_xml,
+            output_file,
+            pbar_xml,
+            state,
+            dedup,
+        )
 
-            print(
-                f"Registros válidos acumulados: "
-                f"{state['count']:,}"
-            )
+        if dedup is not None:
+            dedup.close()
 
-    pbar_xml.close()
+        pbar_xml.close()
 
-    # --------------------------------------------------------
-    # PDFs
-    # --------------------------------------------------------
-
-    # PDFs são processados apenas depois dos XMLs.
-    #
-    # Como o arquivo JSONL foi fechado acima, usamos append.
-    if os.path.isdir(PDF_FOLDER):
+        # ----------------------------------------------------
+        # PDFs
+        # ----------------------------------------------------
 
-        with open(
-            OUTPUT_JSONL,
-            "a",
-            encoding="utf-8",
-        ) as output_file:
+        # PDFs são processados apenas depois dos XMLs.
+        if os.path.isdir(PDF_FOLDER):
 
             process_pdfs(
                 output_file,
@@ -612,8 +1521,22 @@ def main():
         f"{state['errors']:,}"
     )
 
+    if state["failed_ranges"]:
+        print(
+            f"Faixas de XML com leitura interrompida: "
+            f"{state['failed_ranges']:,} (ver \"falha\" em {manifest_path()})"
+        )
+
+    if dedup is not None:
+        print(
+            f"Duplicatas descartadas ({DEDUP_MODE}): "
+            f"{dedup.dropped['exata']:,} exata(s), "
+            f"{dedup.dropped['quase']:,} quase duplicata(s)"
+        )
+        print(f"Relatório de duplicatas: {DEDUP_REPORT}")
+
     print(
-        f"Exemplos escritos no JSONL: "
+        f"Exemplos escritos na saída: "
         f"{state['output_count']:,}"
     )
 
@@ -622,7 +1545,10 @@ def main():
         f"{state['pdf_errors']:,}"
     )
 
-    print(f"\nDataset: {OUTPUT_JSONL}")
+    if OUTPUT_FORMAT != "jsonl":
+        print(f"\nDataset: {OUTPUT_DIR} ({INDEX_FILENAME})")
+    else:
+        print(f"\nDataset: {OUTPUT_JSONL}")
 
 
 if __name__ == "__main__":
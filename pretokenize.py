@@ -0,0 +1,408 @@
+"""
+Cache de treino pré-tokenizado e empacotado.
+
+O SFTTrainer com packing=True tokeniza e empacota o dataset inteiro a
+cada início de treino, com o tokenizer lento (use_fast=False). Este
+script faz isso uma única vez, em paralelo, e grava o resultado em
+disco:
+
+    <CACHE_DIR>/<hash do tokenizer>-<MAX_SEQ_LENGTH>/
+        meta.json            configuração, arquivos de origem e contagens
+        train.bin            fluxo de tokens (uint16 ou uint32)
+        train.offsets.npy    início de cada exemplo no fluxo (int64)
+        test.bin / test.offsets.npy
+
+O empacotamento segue o do trl (ConstantLengthDataset): cada exemplo é
+tokenizado com os tokens especiais, recebe um EOS no fim e os exemplos
+são concatenados; o bloco i é o trecho [i * L, (i + 1) * L) do fluxo
+(a sobra final é descartada). O train.py detecta o cache e lê os blocos
+por memory-map, sem retokenizar.
+
+Uso: DATA_PATH=./train_dataset.jsonl python pretokenize.py
+"""
+
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import hashlib
+import json
+import math
+import multiprocessing
+import shutil
+
+import numpy as np
+from tqdm import tqdm
+
+from dataset_writer import dataset_files, load_prepared_dataset
+from prompt_template import render_batch
+from prompt_tokenizer import PrefixTokenizer
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+MODEL_NAME = os.getenv("MODEL_NAME", "mistralai/Mistral-7B-v0.1")
+# Mesmo DATA_PATH do train.py: JSONL único ou diretório de shards.
+DATA_PATH = os.getenv("DATA_PATH", "./train_dataset.jsonl")
+CACHE_DIR = os.getenv("PACKED_CACHE_DIR", "./packed_cache")
+
+MAX_SEQ_LENGTH = 512
+# Mesmo tokenizer do train.py (os IDs precisam ser idênticos).
+TOKENIZER_USE_FAST = False
+
+# Fração dos exemplos separada para avaliação (como o
+# train_test_split(test_size=0.05) do train.py), com semente fixa.
+TEST_SIZE = 0.05
+SPLIT_SEED = 42
+
+# Processos de tokenização e exemplos por lote enviado a cada um.
+NUM_WORKERS = os.cpu_count() or 1
+TOKENIZE_BATCH = 1000
+# Tokeniza o bloco fixo de instruções uma vez só (prompt_tokenizer.py).
+PREFIX_CACHE = True
+
+CACHE_VERSION = 1
+META_FILENAME = "meta.json"
+
+
+# ============================================================
+# IDENTIFICAÇÃO DO CACHE
+# ============================================================
+
+def tokenizer_hash(tokenizer):
+    """
+    SHA-256 do que define os IDs gerados pelo tokenizer: classe,
+    vocabulário, tokens especiais e, quando houver, o arquivo do
+    modelo (ex.: tokenizer.model do SentencePiece).
+
+    O pad_token fica de fora: ele não muda os IDs do cache, e o
+    train.py o define (pad = eos) antes de procurar o cache, o que
+    o pretokenize.py não faz.
+    """
+
+    especiais = {
+        nome: token
+        for nome, token in tokenizer.special_tokens_map.items()
+        if nome != "pad_token"
+    }
+
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+    h.update(json.dumps(especiais, sort_keys=True).encode("utf-8"))
+
+    for flag in ("add_bos_token", "add_eos_token"):
+        h.update(f"{flag}={getattr(tokenizer, flag, None)}".encode("utf-8"))
+
+    vocab_file = getattr(tokenizer, "vocab_file", None)
+
+    if vocab_file and os.path.isfile(vocab_file):
+        with open(vocab_file, "rb") as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+def cache_path(cache_dir, tokenizer, max_seq_length):
+    return os.path.join(
+        cache_dir,
+        f"{tokenizer_hash(tokenizer)[:16]}-{max_seq_length}",
+    )
+
+
+def source_signature(data_path):
+    """
+    Tamanho e mtime dos arquivos de origem: se o dataset preparado
+    mudar, o cache deixa de valer.
+    """
+
+    assinatura = []
+
+    for path in dataset_files(data_path):
+        st = os.stat(path)
+        assinatura.append({
+            "arquivo": os.path.abspath(path),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+        })
+
+    return assinatura
+
+
+def token_dtype(tokenizer):
+    return np.uint16 if len(tokenizer) <= 2 ** 16 else np.uint32
+
+
+# ============================================================
+# SEPARAÇÃO TREINO / TESTE
+# ============================================================
+
+def split_indices(n, test_size=TEST_SIZE, seed=SPLIT_SEED):
+    """
+    Índices de treino e de avaliação de um dataset com n exemplos. A
+    mesma semente dá sempre a mesma separação: o train.py (com ou sem
+    cache) e o marc_eval.py usam os mesmos exemplos de teste.
+    """
+
+    order = np.random.default_rng(seed).permutation(n)
+    n_test = math.ceil(n * test_size)
+
+    return {
+        "train": order[n_test:],
+        "test": order[:n_test],
+    }
+
+
+# ============================================================
+# TOKENIZAÇÃO (PROCESSOS)
+# ============================================================
+
+_tokenizer = None
+_prefix_tokenizer = None
+
+
+def _init_worker(model_name, use_fast):
+    global _tokenizer, _prefix_tokenizer
+
+    from transformers import AutoTokenizer
+
+    _tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=use_fast)
+
+    if PREFIX_CACHE:
+        _prefix_tokenizer = PrefixTokenizer.from_template(_tokenizer)
+
+
+def tokenize_batch(texts):
+    """
+    Tokeniza um lote como o ConstantLengthDataset do trl (com tokens
+    especiais, sem truncar) e acrescenta o EOS a cada exemplo.
+
+    Retorna (IDs concatenados, tamanho de cada exemplo) como arrays,
+    que passam entre processos bem mais rápido que listas.
+    """
+
+    eos = _tokenizer.eos_token_id
+
+    if _prefix_tokenizer is not None:
+        input_ids = _prefix_tokenizer.encode_batch(texts)
+    else:
+        input_ids = _tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=False,
+        )["input_ids"]
+
+    lengths = np.fromiter((len(ids) + 1 for ids in input_ids), dtype=np.int64)
+    tokens = np.fromiter(
+        (t for ids in input_ids for t in (*ids, eos)),
+        dtype=np.int64,
+        count=int(lengths.sum()),
+    )
+
+    return tokens, lengths
+
+
+def iter_text_batches(dataset, indices):
+    """
+    Textos dos exemplos na ordem de `indices`, em lotes. No formato
+    compacto o texto é montado a partir do template.
+    """
+
+    for start in range(0, len(indices), TOKENIZE_BATCH):
+        rows = dataset[indices[start:start + TOKENIZE_BATCH].tolist()]
+
+        if "text" in rows:
+            yield rows["text"]
+        else:
+            yield render_batch(rows)["text"]
+
+
+# ============================================================
+# ESCRITA DO CACHE
+# ============================================================
+
+def write_split(pool, dataset, indices, output_dir, name, dtype, max_seq_length):
+    """
+    Tokeniza os exemplos de `indices` e grava o fluxo de tokens
+    (<name>.bin) e os offsets de cada exemplo (<name>.offsets.npy).
+    """
+
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    total = 0
+    n = 0
+
+    pbar = tqdm(total=len(indices), desc=f"Tokenizando {name}", unit=" ex")
+
+    with open(os.path.join(output_dir, f"{name}.bin"), "wb") as f:
+
+        for tokens, lengths in pool.imap(
+            tokenize_batch,
+            iter_text_batches(dataset, indices),
+        ):
+            f.write(tokens.astype(dtype).tobytes())
+
+            offsets[n + 1:n + 1 + len(lengths)] = total + np.cumsum(lengths)
+            total += int(lengths.sum())
+            n += len(lengths)
+
+            pbar.update(len(lengths))
+
+    pbar.close()
+
+    np.save(os.path.join(output_dir, f"{name}.offsets.npy"), offsets)
+
+    return {
+        "exemplos": n,
+        "tokens": total,
+        "blocos": total // max_seq_length,
+    }
+
+
+def build_cache(data_path=DATA_PATH, cache_dir=CACHE_DIR, max_seq_length=MAX_SEQ_LENGTH):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=TOKENIZER_USE_FAST)
+
+    output_dir = cache_path(cache_dir, tokenizer, max_seq_length)
+    tmp_dir = output_dir + ".tmp"
+    dtype = token_dtype(tokenizer)
+
+    print(f"Cache: {output_dir}")
+
+    # Assinatura antes da leitura: se a origem mudar durante o build,
+    # o cache já nasce inválido em vez de misturar versões.
+    fonte = source_signature(data_path)
+    dataset, _ = load_prepared_dataset(data_path)
+
+    splits = split_indices(len(dataset))
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {
+        "versao": CACHE_VERSION,
+        "model_name": MODEL_NAME,
+        "tokenizer_hash": tokenizer_hash(tokenizer),
+        "max_seq_length": max_seq_length,
+        "dtype": np.dtype(dtype).name,
+        "eos_token_id": tokenizer.eos_token_id,
+        "test_size": TEST_SIZE,
+        "split_seed": SPLIT_SEED,
+        "fonte": fonte,
+        "splits": {},
+    }
+
+    with multiprocessing.Pool(
+        NUM_WORKERS,
+        initializer=_init_worker,
+        initargs=(MODEL_NAME, TOKENIZER_USE_FAST),
+    ) as pool:
+        for name, indices in splits.items():
+            meta["splits"][name] = write_split(
+                pool, dataset, indices, tmp_dir, name, dtype, max_seq_length
+            )
+
+    with open(os.path.join(tmp_dir, META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # Só um cache completo ganha o nome final.
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+
+    for name, info in meta["splits"].items():
+        print(
+            f"{name}: {info['exemplos']:,} exemplos, {info['tokens']:,} tokens, "
+            f"{info['blocos']:,} blocos de {max_seq_length}"
+        )
+
+    return output_dir
+
+
+# ============================================================
+# LEITURA DO CACHE (train.py)
+# ============================================================
+
+def warn_other_caches(cache_dir, path, max_seq_length):
+    """
+    Avisa quando há caches em cache_dir, mas nenhum com o hash deste
+    tokenizer: o treino vai retokenizar tudo, e em geral isso indica
+    tokenizer diferente (modelo, use_fast, tokens especiais).
+    """
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    outros = sorted(
+        nome
+        for nome in os.listdir(cache_dir)
+        if nome.endswith(f"-{max_seq_length}")
+        and os.path.isfile(os.path.join(cache_dir, nome, META_FILENAME))
+    )
+
+    if not outros:
+        return
+
+    print("\n" + "!" * 60)
+    print(f"[AVISO] Nenhum cache para este tokenizer: {path}")
+    print(f"Caches existentes em {cache_dir} (hash de outro tokenizer):")
+
+    for nome in outros:
+        with open(os.path.join(cache_dir, nome, META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        print(f"  {nome}  model_name={meta.get('model_name')}")
+
+    print("O dataset será tokenizado de novo. Confira MODEL_NAME e o tokenizer.")
+    print("!" * 60 + "\n")
+
+
+def load_packed_cache(cache_dir, tokenizer, max_seq_length, data_path):
+    """
+    Procura o cache deste tokenizer/MAX_SEQ_LENGTH para `data_path`.
+
+    Retorna None se não houver cache válido; senão um dict com "meta" e,
+    para "train" e "test", um array (blocos, max_seq_length) mapeado
+    em memória.
+    """
+
+    path = cache_path(cache_dir, tokenizer, max_seq_length)
+    meta_file = os.path.join(path, META_FILENAME)
+
+    if not os.path.isfile(meta_file):
+        warn_other_caches(cache_dir, path, max_seq_length)
+        return None
+
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta.get("versao") != CACHE_VERSION:
+        print(f"Cache {path} de outra versão: ignorado.")
+        return None
+
+    if meta["fonte"] != source_signature(data_path):
+        print(f"Cache {path} desatualizado em relação a {data_path}: ignorado.")
+        return None
+
+    packed = {"meta": meta}
+
+    for name, info in meta["splits"].items():
+        if info["blocos"] == 0:
+            packed[name] = np.zeros((0, max_seq_length), dtype=meta["dtype"])
+            continue
+
+        packed[name] = np.memmap(
+            os.path.join(path, f"{name}.bin"),
+            dtype=meta["dtype"],
+            mode="r",
+            shape=(info["blocos"], max_seq_length),
+        )
+
+    return packed
+
+
+if __name__ == "__main__":
+    if not os.path.exists(DATA_PATH):
+        raise FileNotFoundError(f"Dataset não encontrado em: {DATA_PATH}")
+
+    build_cache()
@@ -0,0 +1,160 @@
+"""
+Templates versionados dos exemplos de treinamento.
+
+O texto fixo dos prompts (regras do SiBi/UFPR etc.) fica só aqui. O
+dataset pode então guardar apenas os campos variáveis de cada exemplo
+mais o ID do template (formato "compact" do preparation.py), e o texto
+completo é montado sob demanda por render_example / render_batch, por
+exemplo em um dataset.map, set_transform ou formatting_func do train.py.
+
+Um template nunca deve ser alterado depois de usado em um dataset:
+crie um novo ID (ex.: "marc-v2") e aponte MARC_TEMPLATE_ID para ele.
+"""
+
+
+# ============================================================
+# TEMPLATES
+# ============================================================
+
+MARC_TEMPLATE_ID = "marc-v1"
+PDF_TEMPLATE_ID = "pdf-v1"
+
+TEMPLATES = {
+    "marc-v1": """<|im_start|>user
+Você é um catalogador profissional do SiBi/UFPR e deve seguir **rigorosamente** o Manual de Catalogação do SiBi/UFPR versão 2025.
+
+Regras obrigatórias:
+  tag indicador 1 indicador 2: descrição da tag
+- 090 0 ?: código de classificação, usar Classificação Decimal de Dewey (CDD) ou Classificação Decimal Universal (CDU) conforme disponível; se ambos, priorizar CDD
+- 100 ? ?: usar subcampos a, c, q, d conforme forma autorizada; se autor corporativo, usar 110 ou 111
+- 240 ? ?: usar para títulos uniformes, com subcampo a para título e subcampo d para data de criação (ex: "Brasil. Ministério da Educação. Secretaria de Educação Superior. Universidade Federal do Paraná. Setor de Ciências Humanas, Letras e Artes. Departamento de História. Curso de História.")
+- 245 ? ?: título principal no subcampo a, subtítulo no subcampo b, responsabilidade no subcampo c; transcrever exatamente sem pontuação extra
+- 250 ? ?: edição ignorar reimpressões; só registrar 1ª edição se aparecer explicitamente
+- 260/264 ? ?: imprenta, usar [S.l.] quando não houver local, [s.n.] quando não houver editora; datas aproximadas entre colchetes [19--], [201-], etc.
+- 300 ? ?: descrição física, usar subcampos a para extensão (ex: "300 p."), b para ilustrações (ex: "il.") e c para dimensões (ex: "21 cm")
+- 490 0 ?: série, usar subcampo a para título da série e subcampo v para número da série (ex: "490 0 $a Coleção UFPR. $v 10")
+- 500 ? ?: notas gerais, usar subcampo a para texto da nota (ex: "500 $a Inclui bibliografia.")
+- 504 ? ?: bibliografia, usar subcampo a para texto da nota (ex: "504 $a Bibliografia: p. 290-300.")
+- 505 ? ?: sumário, usar subcampo a para texto do sumário (ex: "505 $a Capítulo 1: Introdução -- Capítulo 2: Metodologia.")
+- 590 ? ?: notas locais, usar subcampo a para texto da nota (ex: "590 $a Exemplar disponível apenas para consulta local.")
+- 600 ? ?: assuntos, usar subcampos a para assunto principal, x para subdivisão de assunto, z para localidade e y para forma de assunto
+- 650 ? ?: usar LCSH da LC ou DeCS da BIREME, Autoridades da Fundação Biblioteca Nacional, com subcampos a, x, z, y conforme aplicável, em português brasileiro
+- 700 ? ?: autores secundários, usar subcampos a, c, q, d conforme forma autorizada; se autor corporativo, usar apenas o 710
+- 710 ? ?: autores corporativos, usar subcampos a para nome da entidade, c para data de criação, q para qualificação e d para data de extinção
+- 740 ? ?: títulos relacionados, usar subcampo a para título e subcampo d para data de criação. Não usar o 730.
+
+Gere o registro MARC21 completo para este livro aplicando todas as regras acima.
+
+ATENÇÃO ÀS SEGUINTES TAREFAS INTELECTUAIS:
+1. Você deve deduzir e classificar os assuntos (tags 650) em português brasileiro com base no título e autor da obra.
+2. Se não houver informação disponível para um campo específico (ex: sem indicação de edição), apenas omita a tag do registro final. Não gere campos vazios.
+
+Título completo: {full_title}
+Autor: {author_prompt}
+Ano: {year}
+Edição: {edition}
+Imprenta: {imprint}
+
+Responda **APENAS** com o registro MARC completo (todos os campos necessários, com indicadores e subcampos exatos).
+<|im_end|>
+<|im_start|>assistant
+{marc_text}
+<|im_end|>""",
+    "pdf-v1": """<|im_start|>user
+Explique as regras de catalogação MARC a partir deste trecho do documento:
+{chunk}
+<|im_end|>
+<|im_start|>assistant
+{chunk}
+<|im_end|>""",
+}
+
+# Fim do bloco fixo de instruções do prompt MARC: tudo antes desta
+# marca é idêntico em todos os exemplos (ver prompt_tokenizer.py).
+PROMPT_SPLIT_MARKER = "Título completo:"
+
+# Campo com a resposta do modelo em cada template: o prompt de
+# inferência é o texto do template até ele (ver render_prompt).
+RESPONSE_FIELDS = {
+    "marc-v1": "marc_text",
+    "pdf-v1": "chunk",
+}
+
+# Campos variáveis de cada template, na ordem em que aparecem.
+TEMPLATE_FIELDS = {
+    "marc-v1": (
+        "full_title",
+        "author_prompt",
+        "year",
+        "edition",
+        "imprint",
+        "marc_text",
+    ),
+    "pdf-v1": ("chunk",),
+}
+
+
+# ============================================================
+# RENDERIZAÇÃO
+# ============================================================
+
+def render_template(template_id, fields):
+    """Monta o texto completo de um template a partir dos campos."""
+
+    return TEMPLATES[template_id].format_map(fields)
+
+
+def render_prompt(template_id, fields):
+    """
+    Prompt de inferência: o template até o início da resposta
+    (terminando em "<|im_start|>assistant\n"), com os campos do livro.
+    """
+
+    template = TEMPLATES[template_id]
+    corte = template.rindex("{" + RESPONSE_FIELDS[template_id] + "}")
+
+    return template[:corte].format_map(fields)
+
+
+def template_prefix(template_id, marker=PROMPT_SPLIT_MARKER):
+    """Texto fixo do template antes de `marker` (sem campos variáveis)."""
+
+    template = TEMPLATES[template_id]
+
+    return template[:template.index(marker)]
+
+
+def render_example(example):
+    """
+    Monta o texto de um exemplo compacto ({"template": ..., campos}).
+
+    Exemplos que já têm "text" (formato completo) são devolvidos
+    como estão. Serve como formatting_func do SFTTrainer.
+    """
+
+    if example.get("text"):
+        return example["text"]
+
+    return render_template(example["template"], example)
+
+
+def render_batch(batch):
+    """
+    Versão em lote de render_example, para dataset.map(batched=True)
+    ou dataset.set_transform. Retorna {"text": [...]}.
+    """
+
+    templates = batch["template"]
+
+    return {
+        "text": [
+            render_template(
+                template_id,
+                {
+                    name: batch[name][i]
+                    for name in TEMPLATE_FIELDS[template_id]
+                },
+            )
+            for i, template_id in enumerate(templates)
+        ]
+    }
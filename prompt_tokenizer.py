@@ -0,0 +1,188 @@
+"""
+Tokenização com cache do prefixo fixo do prompt.
+
+Em todos os exemplos MARC, o bloco de instruções antes de
+"Título completo:" é o mesmo; só o final (título, autor, ..., registro)
+muda. PrefixTokenizer tokeniza esse prefixo uma única vez e, para cada
+texto que começa por ele, tokeniza apenas o sufixo e concatena os IDs.
+
+Tokenizers de subpalavras podem juntar caracteres dos dois lados do
+corte ou tratar o início do sufixo como início de texto (o "▁" que o
+SentencePiece acrescenta). Por isso, antes do primeiro uso, check()
+compara o resultado com a tokenização completa em alguns textos e
+escolhe o modo:
+
+- "direto": prefixo + sufixo tokenizado sozinho;
+- "ancora": o sufixo é tokenizado precedido do último caractere do
+  prefixo (ex.: "\\n"), cujos IDs são descartados;
+- None: nenhum dos dois reproduz a tokenização completa, e todo texto
+  é tokenizado inteiro (mais lento, mas sempre correto).
+
+Como todo sufixo começa pela própria marca, o contexto dos dois lados
+do corte é sempre o mesmo, e a verificação em poucos textos vale para
+o dataset inteiro.
+
+Textos que não começam pelo prefixo (ex.: exemplos de PDF) são sempre
+tokenizados inteiros.
+"""
+
+from prompt_template import MARC_TEMPLATE_ID, PROMPT_SPLIT_MARKER, template_prefix
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+# Quantos textos comparar com a tokenização completa em check().
+CHECK_SAMPLES = 8
+
+
+# ============================================================
+# TOKENIZER COM PREFIXO
+# ============================================================
+
+class PrefixTokenizer:
+    """
+    Envolve um tokenizer do transformers, reaproveitando os IDs de um
+    prefixo fixo. encode/encode_batch devolvem os mesmos IDs que
+    tokenizer(text, add_special_tokens=...)["input_ids"].
+    """
+
+    def __init__(self, tokenizer, prefix, add_special_tokens=True):
+        self.tokenizer = tokenizer
+        self.prefix = prefix
+        self.add_special_tokens = add_special_tokens
+
+        self.prefix_ids = self._full([prefix])[0]
+        self.anchor = prefix[-1:]
+        self.anchor_ids = self._ids([self.anchor])[0] if self.anchor else []
+
+        self.mode = None
+        self.checked = False
+
+    @classmethod
+    def from_template(cls, tokenizer, template_id=MARC_TEMPLATE_ID, **kwargs):
+        """Prefixo fixo de um template do prompt_template.py."""
+
+        return cls(tokenizer, template_prefix(template_id), **kwargs)
+
+    @classmethod
+    def from_prompt(cls, tokenizer, prompt, marker=PROMPT_SPLIT_MARKER, **kwargs):
+        """Prefixo de um prompt montado à mão (scripts de inferência)."""
+
+        return cls(tokenizer, prompt[:prompt.index(marker)], **kwargs)
+
+    # --------------------------------------------------------
+    # Tokenização bruta
+    # --------------------------------------------------------
+
+    def _full(self, texts):
+        return self.tokenizer(
+            texts,
+            add_special_tokens=self.add_special_tokens,
+        )["input_ids"]
+
+    def _ids(self, texts):
+        return self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+
+    def _suffixes(self, suffixes, mode):
+        if mode == "direto":
+            return self._ids(suffixes)
+
+        n = len(self.anchor_ids)
+        result = []
+
+        for ids in self._ids([self.anchor + s for s in suffixes]):
+            if ids[:n] != self.anchor_ids:
+                return None
+
+            result.append(ids[n:])
+
+        return result
+
+    # --------------------------------------------------------
+    # Verificação do corte
+    # --------------------------------------------------------
+
+    def check(self, texts):
+        """
+        Escolhe o modo comparando com a tokenização completa dos textos
+        (só os que começam pelo prefixo contam). Retorna o modo.
+        """
+
+        amostra = [t for t in texts if t.startswith(self.prefix)][:CHECK_SAMPLES]
+
+        if not amostra:
+            return self.mode
+
+        esperado = self._full(amostra)
+        suffixes = [t[len(self.prefix):] for t in amostra]
+
+        self.mode = None
+
+        for mode in ("direto", "ancora"):
+            if mode == "ancora" and not self.anchor:
+                continue
+
+            ids = self._suffixes(suffixes, mode)
+
+            if ids is not None and all(
+                self.prefix_ids + s == e
+                for s, e in zip(ids, esperado)
+            ):
+                self.mode = mode
+                break
+
+        if self.mode is None:
+            print(
+                "Aviso: o corte do prefixo não é estável para este tokenizer; "
+                "usando tokenização completa."
+            )
+
+        self.checked = True
+
+        return self.mode
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+
+    def encode_batch(self, texts):
+        """IDs de cada texto, tokenizando o prefixo comum só uma vez."""
+
+        if not self.checked:
+            self.check(texts)
+
+        result = [None] * len(texts)
+        com_prefixo = []
+
+        if self.mode is not None:
+            com_prefixo = [
+                i for i, t in enumerate(texts)
+                if t.startswith(self.prefix)
+            ]
+
+        if com_prefixo:
+            ids = self._suffixes(
+                [texts[i][len(self.prefix):] for i in com_prefixo],
+                self.mode,
+            )
+
+            # A âncora só falha em textos muito atípicos: tokeniza
+            # o lote inteiro em vez de arriscar IDs errados.
+            if ids is None:
+                com_prefixo = []
+            else:
+                for i, suffix_ids in zip(com_prefixo, ids):
+                    result[i] = self.prefix_ids + suffix_ids
+
+        restantes = [i for i, r in enumerate(result) if r is None]
+
+        if restantes:
+            for i, ids in zip(restantes, self._full([texts[i] for i in restantes])):
+                result[i] = ids
+
+        return result
+
+    def encode(self, text):
+        return self.encode_batch([text])[0]
@@ -0,0 +1,411 @@
+"""
+Índice dos limites de <record> em arquivos MARCXML grandes.
+
+countRegister.py, split_xml.py, data_split_*.py e o planejamento das
+faixas do preparation.py precisavam varrer o arquivo inteiro, linha a
+linha, só para achar onde cada <record> começa. Aqui a varredura é
+feita uma única vez, sobre um mmap do arquivo e com bytes.find (sem
+decodificar texto), e o resultado fica salvo ao lado do XML:
+
+    arquivo.xml.idx.npz
+        offsets   início de cada <record> (uint64)
+        lengths   tamanho em bytes até o fim de </record> (uint32)
+        stamp     [versão, tamanho, mtime_ns, registros truncados]
+
+O índice só é reaproveitado se o tamanho e o mtime do XML forem os
+mesmos do stamp. Com ele, contar, ler um registro qualquer, dividir o
+arquivo e planejar as faixas paralelas viram consultas aos arrays.
+
+Registros truncados (um <record> que começa antes do fechamento do
+anterior, ou sem fechamento no fim do arquivo) ficam fora do índice e
+são só contados, como em marc_reader.iter_record_chunks.
+
+Arquivos comprimidos (.gz, .zst) não podem ser mapeados em memória e
+não são indexados.
+"""
+
+import mmap
+import os
+from array import array
+
+import numpy as np
+
+from dataset_writer import compression_from_path
+from marc_reader import RECORD_DELIMITERS, RECORD_END, RECORD_START
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+INDEX_SUFFIX = ".idx.npz"
+INDEX_VERSION = 1
+
+
+# ============================================================
+# ÍNDICE
+# ============================================================
+
+class RecordIndex:
+    """Offsets e tamanhos dos <record> de um XML, mais o stamp do arquivo."""
+
+    def __init__(self, path, offsets, lengths, size, mtime_ns, truncados=0):
+        self.path = path
+        self.offsets = offsets
+        self.lengths = lengths
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.truncados = truncados
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def ends(self):
+        """Offset logo depois de cada </record>."""
+
+        return self.offsets + self.lengths
+
+    def is_current(self):
+        """True se o XML ainda tem o tamanho e o mtime do índice."""
+
+        st = os.stat(self.path)
+
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    # --------------------------------------------------------
+    # Acesso aos registros
+    # --------------------------------------------------------
+
+    def read_record(self, i, f=None):
+        """Bytes do registro i (um arquivo já aberto pode ser reaproveitado)."""
+
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self.read_record(i, f)
+
+        f.seek(int(self.offsets[i]))
+
+        return f.read(int(self.lengths[i]))
+
+    def iter_records(self, indices):
+        """Bytes dos registros em `indices`, na ordem dada."""
+
+        with open(self.path, "rb") as f:
+            for i in indices:
+                yield self.read_record(i, f)
+
+    def header(self):
+        """Bytes antes do primeiro registro (declaração XML e <collection>)."""
+
+        with open(self.path, "rb") as f:
+            return f.read(int(self.offsets[0]) if len(self) else self.size)
+
+    def footer(self):
+        """Bytes depois do último registro (normalmente </collection>)."""
+
+        if not len(self):
+            return b""
+
+        with open(self.path, "rb") as f:
+            f.seek(int(self.ends[-1]))
+            return f.read()
+
+    # --------------------------------------------------------
+    # Divisão
+    # --------------------------------------------------------
+
+    def split_by_bytes(self, target_bytes):
+        """
+        Grupos (primeiro, fim) de registros consecutivos com cerca de
+        `target_bytes` cada: cada grupo termina no primeiro registro
+        que ultrapassa o alvo.
+        """
+
+        if not len(self):
+            return []
+
+        ends = self.ends
+        cortes = [0]
+
+        while cortes[-1] < len(self):
+            base = int(self.offsets[cortes[-1]])
+            fim = int(np.searchsorted(ends, base + target_bytes, side="left")) + 1
+            cortes.append(min(max(fim, cortes[-1] + 1), len(self)))
+
+        return list(zip(cortes, cortes[1:]))
+
+    def split_by_count(self, records_per_part):
+        """Grupos (primeiro, fim) de `records_per_part` registros."""
+
+        return [
+            (inicio, min(inicio + records_per_part, len(self)))
+            for inicio in range(0, len(self), records_per_part)
+        ]
+
+    def split_into(self, n_parts, by="bytes"):
+        """
+        `n_parts` grupos (primeiro, fim) equilibrados por número de
+        registros (by="records") ou por bytes (by="bytes"). Com menos
+        registros que partes, sobram só grupos de um registro.
+        """
+
+        n = len(self)
+        n_parts = max(1, min(n_parts, n))
+
+        if not n:
+            return []
+
+        if by == "records":
+            cortes = [n * k // n_parts for k in range(n_parts + 1)]
+
+        elif by == "bytes":
+            # Fim acumulado de cada registro, a partir do primeiro.
+            acumulado = self.ends - self.offsets[0]
+            alvos = acumulado[-1] * np.arange(1, n_parts) / n_parts
+
+            meio = np.searchsorted(acumulado, alvos, side="left") + 1
+            cortes = [0, *np.maximum.accumulate(meio).tolist(), n]
+
+        else:
+            raise ValueError(f"Critério de divisão desconhecido: {by!r}")
+
+        return [(a, b) for a, b in zip(cortes, cortes[1:]) if a < b]
+
+    def copy_records(self, first, end, dst, f=None, block_size=16 * 1024 * 1024):
+        """
+        Copia para `dst` os bytes dos registros first .. end - 1.
+
+        Entre dois registros, só espaço em branco (quebras de linha,
+        indentação) é copiado como está. Qualquer outra coisa, como
+        </collection>, <?xml> e <collection> de arquivos concatenados
+        ou registros truncados, vira uma quebra de linha, como no
+        split_xml antigo, que pulava essas linhas.
+        Retorna o número de bytes escritos.
+        """
+
+        if first >= end:
+            return 0
+
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self.copy_records(first, end, dst, f, block_size)
+
+        ends = self.ends
+        copiados = 0
+        i = first
+
+        while i < end:
+
+            # Registros seguintes que cabem em um bloco (ao menos um).
+            base = int(self.offsets[i])
+            j = int(np.searchsorted(ends, base + block_size, side="right"))
+            j = min(max(j, i + 1), end)
+
+            f.seek(base)
+            bloco = memoryview(f.read(int(ends[j - 1]) - base))
+
+            # Trecho limpo ainda não escrito começa em `inicio`.
+            inicio = 0
+
+            for fim, proximo in zip(
+                (ends[i:j - 1] - base).tolist(),
+                (self.offsets[i + 1:j] - base).tolist(),
+            ):
+                if proximo > fim and bytes(bloco[fim:proximo]).strip():
+                    dst.write(bloco[inicio:fim])
+                    dst.write(b"\n")
+                    copiados += fim - inicio + 1
+                    inicio = proximo
+
+            dst.write(bloco[inicio:])
+            copiados += len(bloco) - inicio
+
+            if j < end:
+                lacuna = _read_gap(f, int(ends[j - 1]), int(self.offsets[j]))
+                dst.write(lacuna)
+                copiados += len(lacuna)
+
+            i = j
+
+        return copiados
+
+
+# Lacunas maiores que isso entre dois registros nunca são só espaço.
+MAX_WHITESPACE_GAP = 4096
+
+
+def _read_gap(f, inicio, fim):
+    """Bytes entre dois registros, ou uma quebra de linha se não forem só espaço."""
+
+    if fim - inicio > MAX_WHITESPACE_GAP:
+        return b"\n"
+
+    f.seek(inicio)
+    lacuna = f.read(fim - inicio)
+
+    return b"\n" if lacuna.strip() else lacuna
+
+
+# ============================================================
+# VARREDURA
+# ============================================================
+
+def scan_records(buf):
+    """
+    Varre `buf` (bytes ou mmap) atrás dos <record>...</record>.
+    Retorna (offsets, lengths, truncados).
+    """
+
+    offsets, lengths, truncados, aberto = scan_records_partial(buf)
+
+    # No fim do arquivo, um <record> sem fechamento está truncado.
+    if aberto is not None:
+        truncados += 1
+
+    return offsets, lengths, truncados
+
+
+def scan_records_partial(buf):
+    """
+    Como scan_records, para um trecho de um fluxo lido em blocos:
+    o último <record> sem fechamento não é contado como truncado, e
+    sim devolvido (seu offset, ou None) para ser completado com o
+    bloco seguinte. Retorna (offsets, lengths, truncados, aberto).
+    """
+
+    offsets = array("Q")
+    lengths = array("I")
+    truncados = 0
+    aberto = None
+
+    n = len(buf)
+    pos = 0
+
+    while True:
+        inicio = buf.find(RECORD_START, pos)
+
+        if inicio < 0:
+            break
+
+        fim_tag = inicio + len(RECORD_START)
+
+        # Ignora <records>, <recordInfo> etc.
+        if fim_tag < n and buf[fim_tag:fim_tag + 1] not in RECORD_DELIMITERS:
+            pos = fim_tag
+            continue
+
+        fim = buf.find(RECORD_END, fim_tag)
+
+        if fim < 0:
+            aberto = inicio
+            break
+
+        proximo = buf.find(RECORD_START, fim_tag, fim)
+
+        if proximo >= 0:
+            truncados += 1
+            pos = proximo
+            continue
+
+        fim += len(RECORD_END)
+
+        offsets.append(inicio)
+        lengths.append(fim - inicio)
+        pos = fim
+
+    return (
+        np.frombuffer(offsets, dtype=np.uint64).astype(np.int64),
+        np.frombuffer(lengths, dtype=np.uint32).astype(np.int64),
+        truncados,
+        aberto,
+    )
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def build_index(path):
+    """Varre o XML uma vez (mmap + bytes.find) e monta o índice."""
+
+    if compression_from_path(path) is not None:
+        raise ValueError(f"Arquivos comprimidos não podem ser indexados: {path}")
+
+    st = os.stat(path)
+
+    if st.st_size == 0:
+        vazio = np.zeros(0, dtype=np.int64)
+        return RecordIndex(path, vazio, vazio, 0, st.st_mtime_ns)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offsets, lengths, truncados = scan_records(mm)
+
+    return RecordIndex(path, offsets, lengths, st.st_size, st.st_mtime_ns, truncados)
+
+
+def save_index(index):
+    """Grava o índice em <xml>.idx.npz (de forma atômica)."""
+
+    destino = index_path(index.path)
+    tmp = destino + ".tmp.npz"
+
+    np.savez(
+        tmp,
+        offsets=index.offsets.astype(np.uint64),
+        lengths=index.lengths.astype(np.uint32),
+        stamp=np.array(
+            [INDEX_VERSION, index.size, index.mtime_ns, index.truncados],
+            dtype=np.int64,
+        ),
+    )
+
+    os.replace(tmp, destino)
+
+
+def load_index(path):
+    """Índice salvo do XML, ou None se não existir ou estiver desatualizado."""
+
+    destino = index_path(path)
+
+    if not os.path.isfile(destino):
+        return None
+
+    with np.load(destino) as data:
+        versao, size, mtime_ns, truncados = (int(v) for v in data["stamp"])
+
+        index = RecordIndex(
+            path,
+            data["offsets"].astype(np.int64),
+            data["lengths"].astype(np.int64),
+            size,
+            mtime_ns,
+            truncados,
+        )
+
+    if versao != INDEX_VERSION or not index.is_current():
+        return None
+
+    return index
+
+
+def get_index(path, save=True):
+    """
+    Índice do XML: reaproveita o .idx.npz quando válido; senão varre
+    o arquivo e, com save=True, grava o índice para as próximas vezes.
+    """
+
+    index = load_index(path)
+
+    if index is not None:
+        return index
+
+    index = build_index(path)
+
+    if save:
+        try:
+            save_index(index)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar {index_path(path)}: {e}")
+
+    return index
@@ -0,0 +1,361 @@
+"""
+Amostragem aleatória de registros sobre vários XMLs MARC indexados.
+
+Montar um subconjunto balanceado (ex.: 200 mil registros) lendo os
+arquivos desde o início favorece os arquivos menores e os primeiros
+registros de cada um (find_xml_files ordena por tamanho e a leitura
+para em MAX_RECORDS). Aqui os registros são sorteados entre todos os
+arquivos, de forma uniforme ou estratificada, e lidos direto pelos
+offsets do índice (record_index.py): o custo da amostra é proporcional
+ao seu tamanho, não ao do corpus.
+
+Estratos disponíveis:
+- "source":   arquivo de origem;
+- "language": idioma do 008/35-37;
+- "decade":   década do 260$c (264$c como fallback, como no
+              preparation.py) ou, sem ela, da data 1 do 008/07-10.
+
+Idioma e década exigem olhar cada registro: isso é feito uma vez por
+arquivo, direto nos bytes (sem parser XML), e salvo em
+<xml>.strata.npz com o mesmo stamp de tamanho/mtime do índice.
+
+Uso: python sampling.py pasta_xml amostra.xml N [source|language|decade]
+"""
+
+import mmap
+import os
+import re
+import sys
+
+import numpy as np
+from lxml import etree
+
+from dataset_writer import compression_from_path
+from marc_reader import CABECALHO_FAKE, RODAPE_FAKE, element_to_lite_record
+from record_index import INDEX_VERSION, get_index
+
+
+# ============================================================
+# CONFIGURAÇÃO
+# ============================================================
+
+STRATA_SUFFIX = ".strata.npz"
+STRATA = ("source", "language", "decade")
+
+# Rótulos de registros sem idioma ou década identificáveis.
+IDIOMA_DESCONHECIDO = "und"
+DECADA_DESCONHECIDA = -1
+
+SAMPLE_SEED = 42
+
+_CAMPO_008 = re.compile(rb'<controlfield[^>]*tag=["\']008["\'][^>]*>([^<]*)<')
+_CAMPOS_DATA = (
+    re.compile(rb'<datafield[^>]*tag=["\']260["\'][^>]*>(.*?)</datafield>', re.S),
+    re.compile(rb'<datafield[^>]*tag=["\']264["\'][^>]*>(.*?)</datafield>', re.S),
+)
+_SUBCAMPO_C = re.compile(rb'<subfield[^>]*code=["\']c["\'][^>]*>([^<]*)<')
+# Três dígitos do ano mais um dígito ou marca de incerteza: 1996, 199-, 199u, 199?
+_ANO = re.compile(rb"(?<!\d)(\d{3})[\d\-u?]")
+
+
+# ============================================================
+# ESTRATOS POR REGISTRO
+# ============================================================
+
+def record_strata(raw):
+    """(idioma, década) de um registro, direto dos bytes do XML."""
+
+    campo_008 = _CAMPO_008.search(raw)
+    data_008 = campo_008.group(1) if campo_008 else b""
+
+    idioma = data_008[35:38].strip().decode("ascii", "replace").lower()
+
+    decada = DECADA_DESCONHECIDA
+
+    for campo in _CAMPOS_DATA:
+        datafield = campo.search(raw)
+
+        if datafield is None:
+            continue
+
+        subcampo = _SUBCAMPO_C.search(datafield.group(1))
+        ano = _ANO.search(subcampo.group(1)) if subcampo else None
+
+        if ano:
+            decada = int(ano.group(1)) * 10
+            break
+
+    if decada == DECADA_DESCONHECIDA:
+        ano = _ANO.match(data_008[7:11])
+
+        if ano:
+            decada = int(ano.group(1)) * 10
+
+    return idioma or IDIOMA_DESCONHECIDO, decada
+
+
+def strata_path(path):
+    return path + STRATA_SUFFIX
+
+
+def get_strata(index):
+    """
+    Idioma e década de cada registro do índice, como arrays
+    (S3 e int16). Reaproveita o <xml>.strata.npz quando o stamp
+    confere; senão percorre os registros e grava o arquivo.
+    """
+
+    destino = strata_path(index.path)
+    stamp = np.array([INDEX_VERSION, index.size, index.mtime_ns], dtype=np.int64)
+
+    if os.path.isfile(destino):
+        with np.load(destino) as data:
+            if np.array_equal(data["stamp"], stamp) and len(data["decade"]) == len(index):
+                return data["language"], data["decade"]
+
+    idiomas = np.empty(len(index), dtype="S3")
+    decadas = np.empty(len(index), dtype=np.int16)
+
+    if len(index):
+        with open(index.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i, (inicio, fim) in enumerate(zip(index.offsets, index.ends)):
+                idioma, decada = record_strata(mm[inicio:fim])
+                idiomas[i] = idioma.encode("ascii", "replace")
+                decadas[i] = decada
+
+    try:
+        tmp = destino + ".tmp.npz"
+        np.savez(tmp, language=idiomas, decade=decadas, stamp=stamp)
+        os.replace(tmp, destino)
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar {destino}: {e}")
+
+    return idiomas, decadas
+
+
+# ============================================================
+# CORPUS
+# ============================================================
+
+class MarcCorpus:
+    """
+    Vários XMLs vistos como uma sequência única de registros,
+    numerados de 0 a len(corpus) - 1 na ordem dos arquivos.
+
+    Arquivos comprimidos não são indexáveis e ficam de fora (com aviso).
+    """
+
+    def __init__(self, paths):
+        self.indexes = []
+
+        for path in paths:
+            if compression_from_path(path) is not None:
+                print(f"Aviso: {os.path.basename(path)} ignorado (arquivo comprimido não é indexável).")
+                continue
+
+            self.indexes.append(get_index(path))
+
+        tamanhos = [len(index) for index in self.indexes]
+
+        # inicios[k] = número global do primeiro registro do arquivo k
+        self.inicios = np.concatenate([[0], np.cumsum(tamanhos)]).astype(np.int64)
+
+    def __len__(self):
+        return int(self.inicios[-1])
+
+    def locate(self, ids):
+        """(arquivo, registro local) de cada número global."""
+
+        ids = np.asarray(ids, dtype=np.int64)
+        arquivos = np.searchsorted(self.inicios, ids, side="right") - 1
+
+        return arquivos, ids - self.inicios[arquivos]
+
+    # --------------------------------------------------------
+    # Estratos
+    # --------------------------------------------------------
+
+    def labels(self, by):
+        """
+        Rótulo de estrato de cada registro do corpus. Para "source", o
+        rótulo é o número do arquivo em self.indexes (um inteiro por
+        registro em vez do nome); strata_counts o troca pelo nome.
+        """
+
+        if by not in STRATA:
+            raise ValueError(f"Estrato desconhecido: {by!r} (use {', '.join(STRATA)})")
+
+        if by == "source":
+            return np.repeat(
+                np.arange(len(self.indexes), dtype=np.int32),
+                [len(index) for index in self.indexes],
+            )
+
+        partes = []
+
+        for index in self.indexes:
+            idiomas, decadas = get_strata(index)
+            partes.append(idiomas.astype(str) if by == "language" else decadas)
+
+        return np.concatenate(partes)
+
+    # --------------------------------------------------------
+    # Sorteio
+    # --------------------------------------------------------
+
+    def sample(self, n, by=None, allocation="equal", seed=SAMPLE_SEED):
+        """
+        Sorteia até `n` números de registro, sem reposição, em ordem
+        crescente (leitura sequencial dentro de cada arquivo).
+
+        Com `by`, a amostra é estratificada: allocation="equal" divide
+        `n` igualmente entre os estratos (os que não têm registros
+        suficientes entram inteiros e a sobra vai para os demais);
+        "proportional" segue o tamanho de cada estrato.
+        """
+
+        rng = np.random.default_rng(seed)
+        total = len(self)
+        n = min(n, total)
+
+        if by is None:
+            return np.sort(rng.choice(total, size=n, replace=False))
+
+        labels = self.labels(by)
+        ordem = np.argsort(labels, kind="stable")
+        _, inicios, tamanhos = np.unique(labels[ordem], return_index=True, return_counts=True)
+
+        cotas = allocate(tamanhos, n, allocation)
+
+        escolhidos = [
+            ordem[inicio + rng.choice(tamanho, size=cota, replace=False)]
+            for inicio, tamanho, cota in zip(inicios, tamanhos, cotas)
+            if cota
+        ]
+
+        if not escolhidos:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.sort(np.concatenate(escolhidos))
+
+    def strata_counts(self, by, ids=None):
+        """Quantos registros (do corpus ou de `ids`) há em cada estrato."""
+
+        labels = self.labels(by)
+
+        if ids is not None:
+            labels = labels[ids]
+
+        valores, contagens = np.unique(labels, return_counts=True)
+        valores = valores.tolist()
+
+        if by == "source":
+            valores = [os.path.basename(self.indexes[k].path) for k in valores]
+
+        return dict(zip(valores, contagens.tolist()))
+
+    # --------------------------------------------------------
+    # Leitura
+    # --------------------------------------------------------
+
+    def iter_raw(self, ids):
+        """Bytes de cada registro de `ids`, lidos pelos offsets do índice."""
+
+        arquivos, locais = self.locate(ids)
+        abertos = {}
+
+        try:
+            for arquivo, local in zip(arquivos.tolist(), locais.tolist()):
+                index = self.indexes[arquivo]
+
+                if arquivo not in abertos:
+                    abertos[arquivo] = open(index.path, "rb")
+
+                yield index.read_record(local, abertos[arquivo])
+        finally:
+            for f in abertos.values():
+                f.close()
+
+    def iter_records(self, ids, factory=element_to_lite_record, state=None):
+        """
+        Registros de `ids` montados por `factory` (LiteRecord por padrão).
+        Registros malformados são pulados e contados em state["errors"].
+        """
+
+        parser = etree.XMLParser(huge_tree=True)
+
+        for raw in self.iter_raw(ids):
+            try:
+                yield factory(etree.fromstring(raw, parser))
+            except (etree.XMLSyntaxError, ValueError):
+                if state is not None:
+                    state["errors"] += 1
+
+    def write_xml(self, ids, output_path):
+        """Grava os registros de `ids` como uma coleção MARCXML."""
+
+        with open(output_path, "wb") as f:
+            f.write(CABECALHO_FAKE + b"\n")
+
+            for raw in self.iter_raw(ids):
+                f.write(raw)
+                f.write(b"\n")
+
+            f.write(RODAPE_FAKE + b"\n")
+
+
+def allocate(tamanhos, n, allocation="equal"):
+    """Quantos registros sortear de cada estrato, somando min(n, total)."""
+
+    tamanhos = np.asarray(tamanhos, dtype=np.int64)
+    n = min(n, int(tamanhos.sum()))
+
+    if allocation == "proportional":
+        cotas = np.floor(tamanhos * n / max(tamanhos.sum(), 1)).astype(np.int64)
+
+        # Distribui o que sobrou do arredondamento pelos maiores restos.
+        restos = tamanhos * n / max(tamanhos.sum(), 1) - cotas
+        for i in np.argsort(-restos)[:n - cotas.sum()]:
+            cotas[i] += 1
+
+        return cotas
+
+    if allocation != "equal":
+        raise ValueError(f"Alocação desconhecida: {allocation!r}")
+
+    cotas = np.zeros(len(tamanhos), dtype=np.int64)
+    restante = n
+
+    # Estratos pequenos entram inteiros; a sobra é dividida entre os demais.
+    while restante > 0:
+        abertos = np.flatnonzero(cotas < tamanhos)
+        parte = max(restante // len(abertos), 1)
+
+        for i in abertos:
+            extra = min(parte, tamanhos[i] - cotas[i], restante)
+            cotas[i] += extra
+            restante -= extra
+
+            if restante == 0:
+                break
+
+    return cotas
+
+
+if __name__ == "__main__":
+    from preparation import find_xml_files
+
+    pasta, saida, n = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    by = sys.argv[4] if len(sys.argv) > 4 else None
+
+    corpus = MarcCorpus(find_xml_files(pasta))
+    print(f"Corpus: {len(corpus):,} registros em {len(corpus.indexes)} arquivo(s)")
+
+    ids = corpus.sample(n, by=by)
+    corpus.write_xml(ids, saida)
+
+    print(f"Amostra: {len(ids):,} registros em {saida}")
+
+    if by:
+        for estrato, total in corpus.strata_counts(by, ids).items():
+            print(f"  {estrato}: {total:,}")
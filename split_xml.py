@@ -1,75 +1,122 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-def particionar_marcxml(arquivo_entrada, prefixo_saida, tamanho_gb=10):
+from dataset_writer import COMPRESSION_EXTENSIONS, compression_from_path, open_binary_writer
+from marc_reader import RECORD_START
+from pipeline_xml import processar_dump
+from record_index import get_index
+
+# Máximo de partes gravadas ao mesmo tempo quando o destino está em
+# outro disco (no mesmo disco, escritas concorrentes só disputam a
+# cabeça de leitura/escrita e a partição é gravada uma parte por vez).
+MAX_WRITERS = 4
+
+
+def escritores_para(arquivo_entrada, pasta_saida, num_partes):
+    # Um escritor por parte (até MAX_WRITERS) só se origem e destino
+    # estiverem em dispositivos diferentes.
+    mesmo_disco = os.stat(arquivo_entrada).st_dev == os.stat(pasta_saida).st_dev
+    return 1 if mesmo_disco else max(1, min(MAX_WRITERS, num_partes))
+
+
+def rodape_de(index, rodape=b"</collection>\n"):
+    # O rodapé original só é usado se for o fechamento da <collection>:
+    # depois do último registro completo pode haver um registro truncado.
+    rodape_original = index.footer()
+    if rodape_original.strip().startswith(b"</") and RECORD_START not in rodape_original:
+        return rodape_original
+    return rodape
+
+
+def grupos_por_tamanho(index, limite_bytes, rodape=b"</collection>\n"):
+    # Grupos de registros para partes de até ~limite_bytes: cabeçalho e
+    # rodapé se repetem em cada parte, então os registros ficam com o resto.
+    sobra = len(index.header()) + len(rodape_de(index, rodape))
+    return index.split_by_bytes(limite_bytes - sobra)
+
+
+def gravar_partes(index, grupos, destinos, compressao=None, num_writers=1, rodape=b"</collection>\n"):
+    # Cada parte é cabeçalho + bytes dos seus registros (copiados direto do
+    # arquivo de origem, em blocos, sem montar a parte em memória) + rodapé.
+    # Com num_writers > 1 várias partes são gravadas ao mesmo tempo, cada
+    # uma com seu próprio handle de leitura. Retorna o tamanho de cada parte.
+    cabecalho = index.header()
+    rodape = rodape_de(index, rodape)
+
+    def gravar(parte):
+        (primeiro, fim), destino = parte
+        with open(index.path, 'rb') as f_in, open_binary_writer(destino, compressao) as f_out:
+            f_out.write(cabecalho)
+            tamanho = len(cabecalho) + index.copy_records(primeiro, fim, f_out, f_in)
+            f_out.write(rodape)
+        return tamanho + len(rodape)
+
+    partes = list(zip(grupos, destinos))
+
+    if num_writers <= 1:
+        return [gravar(parte) for parte in partes]
+
+    with ThreadPoolExecutor(max_workers=num_writers) as executor:
+        return list(executor.map(gravar, partes))
+
+
+def particionar_marcxml(arquivo_entrada, prefixo_saida, tamanho_gb=10, compressao=None, num_partes=None, balancear="bytes", num_writers=None):
     # Converte GB para Bytes
     limite_bytes = tamanho_gb * 1024 * 1024 * 1024
-    
-    cabecalho_linhas = []
-    parte_atual = 1
-    tamanho_atual = 0
-    arquivo_saida = None
-    
-    print(f"Lendo o arquivo original: {arquivo_entrada}...")
-    
-    with open(arquivo_entrada, 'r', encoding='utf-8') as f_in:
-        # 1. Identificar e guardar o cabeçalho original (antes do primeiro <record>)
-        for linha in f_in:
-            if '<record>' in linha or '<record ' in linha:
-                primeira_linha_record = linha
-                break
-            cabecalho_linhas.append(linha)
-            
-        cabecalho = "".join(cabecalho_linhas)
-        rodape = "</collection>\n"
-        
-        # Função auxiliar para criar um novo arquivo
-        def abrir_nova_parte(num_parte):
-            nome_arquivo = f"{prefixo_saida}_parte{num_parte}.xml"
-            f_out = open(nome_arquivo, 'w', encoding='utf-8')
-            f_out.write(cabecalho)
-            print(f"Criando {nome_arquivo}...")
-            return f_out, len(cabecalho.encode('utf-8'))
-
-        # Abre o primeiro arquivo de saída
-        arquivo_saida, tamanho_atual = abrir_nova_parte(parte_atual)
-        
-        # Escreve aquela primeira linha de <record> que usamos para parar o loop do cabeçalho
-        arquivo_saida.write(primeira_linha_record)
-        tamanho_atual += len(primeira_linha_record.encode('utf-8'))
-        
-        # 2. Processar o resto do arquivo linha por linha
-        registros_processados = 1
-        
-        for linha in f_in:
-            # Ignora o rodapé original, nós adicionaremos o nosso em cada arquivo
-            if '</collection>' in linha:
-                continue
-                
-            arquivo_saida.write(linha)
-            tamanho_atual += len(linha.encode('utf-8'))
-            
-            # Se terminou de escrever um registro, checa se atingiu o limite de 10GB
-            if '</record>' in linha:
-                registros_processados += 1
-                
-                if registros_processados % 100000 == 0:
-                    print(f"Processados {registros_processados} registros. Tamanho da parte {parte_atual}: {tamanho_atual / (1024**3):.2f} GB")
-                
-                if tamanho_atual >= limite_bytes:
-                    # Fecha perfeitamente o arquivo atual
-                    arquivo_saida.write(rodape)
-                    arquivo_saida.close()
-                    print(f"✅ Parte {parte_atual} finalizada com {tamanho_atual / (1024**3):.2f} GB.\n")
-                    
-                    # Abre o próximo arquivo
-                    parte_atual += 1
-                    arquivo_saida, tamanho_atual = abrir_nova_parte(parte_atual)
-                    
-        # 3. Fecha o último arquivo quando terminar a leitura de tudo
-        if arquivo_saida:
-            arquivo_saida.write(rodape)
-            arquivo_saida.close()
-            print(f"✅ Parte {parte_atual} finalizada com {tamanho_atual / (1024**3):.2f} GB.")
+    pasta_saida = os.path.dirname(prefixo_saida) or "."
+
+    # Entrada .gz/.zst não tem índice: divide em uma leitura sequencial
+    # (mesmas partes, sem a limpeza do clean_xml).
+    if compression_from_path(arquivo_entrada) is not None:
+        if num_partes:
+            print("Aviso: num_partes exige o índice (arquivo sem compressão); dividindo por tamanho.")
+        print(f"Lendo em sequência o arquivo comprimido: {arquivo_entrada}...")
+        resumo = processar_dump(
+            arquivo_entrada,
+            pasta_saida,
+            nome_parte=os.path.basename(prefixo_saida) + "_parte{}.xml",
+            max_bytes=limite_bytes,
+            max_registros=None,
+            compressao=compressao,
+            limpar=False,
+            manifesto=None,
+        )
+        for parte in resumo["partes"]:
+            print(f"✅ {parte['arquivo']}: {parte['registros']} registros, {parte['bytes'] / (1024**3):.2f} GB.")
+        print("\n🎉 Particionamento concluído com sucesso!")
+        return
+
+    print(f"Lendo o índice de registros de: {arquivo_entrada}...")
+
+    # 1. Índice dos <record> (arquivo.xml.idx.npz): os cortes saem direto
+    # dos offsets, sem varrer o arquivo linha a linha.
+    index = get_index(arquivo_entrada)
+
+    if not len(index):
+        print("Nenhum registro encontrado.")
+        return
+
+    # 2. Grupos de registros consecutivos: num_partes partes equilibradas
+    # (por registros ou por bytes) ou partes de ~limite_bytes cada
+    if num_partes:
+        grupos = index.split_into(num_partes, by=balancear)
+    else:
+        grupos = grupos_por_tamanho(index, limite_bytes)
+
+    destinos = [
+        f"{prefixo_saida}_parte{parte_atual}.xml{COMPRESSION_EXTENSIONS[compressao]}"
+        for parte_atual in range(1, len(grupos) + 1)
+    ]
+
+    if num_writers is None:
+        num_writers = escritores_para(arquivo_entrada, pasta_saida, len(grupos))
+
+    print(f"Criando {len(grupos)} parte(s) com {num_writers} escritor(es)...")
+
+    tamanhos = gravar_partes(index, grupos, destinos, compressao, num_writers)
+
+    for nome_arquivo, (primeiro, fim), tamanho_atual in zip(destinos, grupos, tamanhos):
+        print(f"✅ {nome_arquivo}: {fim - primeiro} registros, {tamanho_atual / (1024**3):.2f} GB.")
 
     print("\n🎉 Particionamento concluído com sucesso!")
 
@@ -85,5 +132,13 @@ if __name__ == "__main__":
     
     # Tamanho desejado em Gigabytes
     TAMANHO_POR_PARTE = 10 
+
+    # Compressão das partes: None, "gzip" ou "zstd"
+    COMPRESSAO = None
+
+    # Alternativa ao tamanho: número fixo de partes equilibradas
+    # por "bytes" ou por "records" (None = usa TAMANHO_POR_PARTE)
+    NUM_PARTES = None
+    BALANCEAR = "bytes"
     
-    particionar_marcxml(ARQUIVO_ORIGINAL, PREFIXO_DESTINO, TAMANHO_POR_PARTE)
\ No newline at end of file
+    particionar_marcxml(ARQUIVO_ORIGINAL, PREFIXO_DESTINO, TAMANHO_POR_PARTE, COMPRESSAO, NUM_PARTES, BALANCEAR)
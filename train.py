@@ -3,7 +3,6 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 os.environ["WANDB_DISABLED"] = "true" 
 
 import torch
-from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
@@ -12,13 +11,21 @@ from transformers import (
 from peft import LoraConfig, prepare_model_for_kbit_training
 from trl import SFTTrainer, SFTConfig
 
+from dataset_writer import load_prepared_dataset
+from pretokenize import load_packed_cache, split_indices
+
 # =====================================================
 # CONFIG
 # =====================================================
 
 MODEL_NAME = "mistralai/Mistral-7B-v0.1"
+# Arquivo JSONL único ou diretório de shards gerado pelo preparation.py
+# (OUTPUT_FORMAT = "shards", "arrow", "parquet" ou "compact"), com index.json.
 DATA_PATH = os.getenv("DATA_PATH", "./train_dataset.jsonl")
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./outputs")
+# Cache gerado pelo pretokenize.py (usado se existir para este
+# tokenizer, MAX_SEQ_LENGTH e DATA_PATH).
+PACKED_CACHE_DIR = os.getenv("PACKED_CACHE_DIR", "./packed_cache")
 
 MAX_SEQ_LENGTH = 512
 # 🚀 DOBRAMOS O BATCH SIZE: Vamos saturar os 48GB da A6000!
@@ -45,8 +52,38 @@ tokenizer.padding_side = "right"
 if not os.path.exists(DATA_PATH):
     raise FileNotFoundError(f"Dataset não encontrado em: {DATA_PATH}")
 
-dataset = load_dataset("json", data_files=DATA_PATH, split="train")
-dataset = dataset.train_test_split(test_size=0.05)
+
+class PackedBlocksDataset(torch.utils.data.Dataset):
+    """Blocos de MAX_SEQ_LENGTH tokens do cache, no formato do trl."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, i):
+        input_ids = torch.from_numpy(self.blocks[i].astype("int64"))
+        return {"input_ids": input_ids, "labels": input_ids.clone()}
+
+
+packed = load_packed_cache(PACKED_CACHE_DIR, tokenizer, MAX_SEQ_LENGTH, DATA_PATH)
+
+if packed is not None:
+    # Já tokenizado e empacotado: o SFTTrainer usa os blocos como estão.
+    print(f"Usando cache pré-tokenizado ({packed['meta']['dtype']})")
+    formatting_func = None
+    dataset = {
+        "train": PackedBlocksDataset(packed["train"]),
+        "test": PackedBlocksDataset(packed["test"]),
+    }
+else:
+    # No formato "compact" o texto de cada exemplo é montado sob demanda
+    # a partir do template, durante o empacotamento do SFTTrainer.
+    dataset, formatting_func = load_prepared_dataset(DATA_PATH)
+    # Mesma separação do cache e do marc_eval.py (semente fixa).
+    splits = split_indices(len(dataset))
+    dataset = {nome: dataset.select(indices) for nome, indices in splits.items()}
 
 print("Train:", len(dataset["train"]))
 print("Eval:", len(dataset["test"]))
@@ -138,6 +175,7 @@ trainer = SFTTrainer(
     peft_config=peft_config,
     tokenizer=tokenizer,
     args=training_args,
+    formatting_func=formatting_func,
 )
 
 # =====================================================